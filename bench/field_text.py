@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Compares tools.anki.field_text with the BeautifulSoup path it replaces.
+
+Run with
+
+    python -m bench.field_text
+
+It reports how many notes per second each path turns into text. The notes
+are built from the fixture corpus in testdata/anki_fields.json. "cold"
+notes are all distinct, so field_text's cache never hits. "warm" repeats
+the corpus, as an audit over the same collection does.
+"""
+import json
+from os import path
+import time
+from typing import Callable, Dict, List
+
+from tools import anki
+
+PROJECT_DIR = path.dirname(path.dirname(path.realpath(__file__)))
+FIELDS_CORPUS = path.join(PROJECT_DIR, 'testdata', 'anki_fields.json')
+
+
+def notes_per_second(extract: Callable[[str], str],
+                     fields: List[str]) -> float:
+    start = time.perf_counter()
+    for field in fields:
+        extract(field)
+    return len(fields) / (time.perf_counter() - start)
+
+
+def run(notes: int = 20000) -> List[Dict]:
+    with open(FIELDS_CORPUS, encoding='utf-8') as f:
+        corpus = json.load(f)
+    cold = [
+        corpus[i % len(corpus)] + '<div>{}</div>'.format(i)
+        for i in range(notes)
+    ]
+    warm = [corpus[i % len(corpus)] for i in range(notes)]
+    results = []
+    for name, extract in [('bs4', anki.field_text_with_bs),
+                          ('field_text', anki.field_text)]:
+        for workload, fields in [('cold', cold), ('warm', warm)]:
+            anki.field_text.cache_clear()
+            results.append({
+                'extractor': name,
+                'workload': workload,
+                'notes_per_second': notes_per_second(extract, fields),
+            })
+    return results
+
+
+def main():
+    for r in run():
+        print('{extractor:<12} {workload:<5} {notes_per_second:>12,.0f} '
+              'notes/s'.format(**r))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,372 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmarks the image processing and import pipeline.
+
+Run with
+
+    python -m bench.pipeline [--sizes 100,1000,10000] [--stages split,...]
+
+The stages are:
+
+* split: splitting a double adjective picture with
+  split_double_adjective_img,
+* remove_subs: cropping the subtitles off with remove_subs,
+* resize: halving a SingleAdjectivePic with resize,
+* export: export_halves, i.e., everything fill200 does to a picture,
+* import: export, media staging and adding cloze notes to a temporary Anki
+  collection, like fill200 does (skipped without Anki),
+* scrape: scraping gallery pages and downloading their images from a local
+  fixture server.
+
+Pictures are synthesized in the 640x402 and in the 1280x803 layout for
+corpora of every size. Each stage and corpus runs in a fresh process, so
+that the reported peak RSS is the stage's own. Per-picture latencies
+include decoding the picture.
+
+Results are printed and saved as JSON, by default to
+bench/results/pipeline-<commit>.json. Pass `--compare` an earlier results
+file to print the change in throughput against it.
+"""
+import argparse
+from concurrent import futures
+import json
+import multiprocessing
+import os
+from os import path
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from PIL import Image, ImageDraw
+
+from tools import process
+
+PROJECT_DIR = path.dirname(path.dirname(path.realpath(__file__)))
+RESULTS_DIR = path.join(PROJECT_DIR, 'bench', 'results')
+
+LAYOUTS = [(640, 402), (1280, 803)]
+CORPUS_SIZES = [100, 1000, 10000]
+STAGES = ['split', 'remove_subs', 'resize', 'export', 'import', 'scrape']
+# Distinct pictures per corpus. The rest of a corpus are hard links to them.
+VARIANTS = 16
+IMAGES_PER_PAGE = 100
+
+
+def synthesize_picture(size: Tuple[int, int], seed: int) -> Image.Image:
+    """Draws a picture in the layout of the scraped ones.
+
+    Each half has a flat illustration above a white band with a dark
+    subtitle, like the originals.
+    """
+    width, height = size
+    img = Image.new('RGBA', size, 'white')
+    draw = ImageDraw.Draw(img)
+    cut = process.KNOWN_SUBS_CUTS.get(height, round(height * 0.82))
+    for half in (0, 1):
+        x0 = half * width // 2
+        color = ((seed * 37 + half * 90) % 256, (seed * 91) % 256,
+                 (seed * 53 + 120) % 256)
+        scale = width / 640
+        draw.ellipse((x0 + (30 + seed % 20) * scale, 30 * scale,
+                      x0 + 290 * scale, (cut - 30 * scale)),
+                     fill=color,
+                     outline='black',
+                     width=max(1, round(3 * scale)))
+        draw.rectangle((x0 + 100 * scale, cut + (height - cut) * 0.35,
+                        x0 + 220 * scale, cut + (height - cut) * 0.65),
+                       fill='black')
+    return img
+
+
+def synthesize_corpus(directory: str, size: Tuple[int, int],
+                      count: int) -> List[str]:
+    """Writes `count` scraped-like pictures into `directory`."""
+    variants = []
+    for seed in range(min(VARIANTS, count)):
+        filename = path.join(directory, 'variant{}.png'.format(seed))
+        synthesize_picture(size, seed).save(filename)
+        variants.append(filename)
+    filenames = []
+    for i in range(count):
+        filename = path.join(
+            directory,
+            'adj{0}_gegen{0}_Adjektive_Deutsch_deutschlernerblog.png'.format(
+                i))
+        os.link(variants[i % len(variants)], filename)
+        filenames.append(filename)
+    for variant in variants:
+        os.remove(variant)
+    return filenames
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def time_each(fn: Callable, items: Iterable) -> Tuple[List[float], float]:
+    """Returns the latency of `fn` for every item and the total time."""
+    latencies = []
+    start = time.perf_counter()
+    for item in items:
+        item_start = time.perf_counter()
+        fn(item)
+        latencies.append(time.perf_counter() - item_start)
+    return latencies, time.perf_counter() - start
+
+
+def bench_split(filenames: List[str], work_dir: str):
+    def split(filename: str) -> None:
+        with Image.open(filename) as img:
+            for half in process.split_double_adjective_img(img):
+                half.load()
+
+    return time_each(split, filenames)
+
+
+def bench_remove_subs(filenames: List[str], work_dir: str):
+    def remove_subs(filename: str) -> None:
+        with Image.open(filename) as img:
+            process.remove_subs(img).load()
+
+    return time_each(remove_subs, filenames)
+
+
+def bench_resize(filenames: List[str], work_dir: str):
+    def resize(filename: str) -> None:
+        sap = process.SingleAdjectivePic(filename, 'adj', subs=True)
+        sap.resize(0.5).to_image().close()
+
+    return time_each(resize, filenames)
+
+
+def bench_export(filenames: List[str], work_dir: str):
+    def export(filename: str) -> None:
+        dap = process.DoubleAdjectivePic.from_original(filename)
+        process.export_halves(dap, work_dir)
+
+    return time_each(export, filenames)
+
+
+def bench_import(filenames: List[str], work_dir: str):
+    import anki as anki_lib
+
+    from tools import anki
+    from tools.media import MediaStager
+    col = anki_lib.Collection(path.join(work_dir, 'collection.anki2'))
+    try:
+        stager = MediaStager(col.media.dir(), staging_dir=work_dir)
+        drafts = []
+
+        def export_and_stage(filename: str) -> None:
+            dap = process.DoubleAdjectivePic.from_original(filename)
+            left, right = process.export_halves(dap, work_dir)
+            media = (stager.stage(left.filename, dap.left_adjective),
+                     stager.stage(right.filename, dap.right_adjective))
+            drafts.append(
+                anki.NoteDraft([
+                    '<img src="{}"><img src="{}">{{{{c1::{}}}}} {{{{c2::{}}}}}'
+                    .format(media[0], media[1], dap.left_adjective,
+                            dap.right_adjective)
+                ], [dap.left_adjective, dap.right_adjective]))
+
+        start = time.perf_counter()
+        with stager:
+            latencies, _ = time_each(export_and_stage, filenames)
+            stager.flush()
+        anki.add_notes_in_bulk(col, drafts, 'Cloze', '200')
+        return latencies, time.perf_counter() - start
+    finally:
+        col.close()
+
+
+def write_gallery(pages_dir: str, filenames: List[str]) -> str:
+    """Writes gallery pages linking to `filenames` and returns the first."""
+    pages = [
+        filenames[i:i + IMAGES_PER_PAGE]
+        for i in range(0, len(filenames), IMAGES_PER_PAGE)
+    ]
+    for number, page in enumerate(pages):
+        imgs = ''.join(
+            '<p><img src="{{base}}/images/{}" width="640" height="402"></p>'.
+            format(path.basename(filename)) for filename in page)
+        weiter = ('<p>weiter <a href="{{base}}/page{}.html">Teil</a></p>'.
+                  format(number + 1) if number + 1 < len(pages) else '')
+        with open(path.join(pages_dir, 'page{}.html'.format(number)),
+                  'w',
+                  encoding='utf-8') as f:
+            f.write('<html><body>' + imgs + weiter + '</body></html>')
+    return 'page0.html'
+
+
+def bench_scrape(filenames: List[str], work_dir: str):
+    import requests
+
+    from test.fixture_server import FixtureServer
+    from tools import scrape
+    latencies: List[float] = []
+
+    class TimingSession(requests.Session):
+        def request(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return super().request(*args, **kwargs)
+            finally:
+                latencies.append(time.perf_counter() - start)
+
+    pages_dir = path.join(work_dir, 'pages')
+    dest_dir = path.join(work_dir, 'downloads')
+    os.mkdir(pages_dir)
+    os.mkdir(dest_dir)
+    first_page = write_gallery(pages_dir, filenames)
+    with FixtureServer(pages_dir, filenames[0]) as server:
+        session = TimingSession()
+        for prefix, adapter in scrape.make_session().adapters.items():
+            session.mount(prefix, adapter)
+        start = time.perf_counter()
+        report = scrape.download_images(
+            scrape.prefetch(
+                scrape.iter_image_sources(server.url(first_page), session)),
+            dest_dir,
+            session=session)
+        seconds = time.perf_counter() - start
+    if len(report.downloaded) != len(filenames):
+        raise Exception('Downloaded only {} of {} images.'.format(
+            len(report.downloaded), len(filenames)))
+    return latencies, seconds
+
+
+BENCHMARKS = {
+    'split': bench_split,
+    'remove_subs': bench_remove_subs,
+    'resize': bench_resize,
+    'export': bench_export,
+    'import': bench_import,
+    'scrape': bench_scrape,
+}
+
+
+def run_case(stage: str, filenames: List[str]) -> Dict:
+    """Runs one stage on one corpus. Meant to run in a fresh process."""
+    with tempfile.TemporaryDirectory() as work_dir:
+        try:
+            latencies, seconds = BENCHMARKS[stage](filenames, work_dir)
+        except ImportError as e:
+            return {'skipped': 'missing dependency: {}'.format(e)}
+    return {
+        'images': len(filenames),
+        'seconds': seconds,
+        'images_per_second': len(filenames) / seconds,
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        # Kilobytes on Linux.
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def get_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              cwd=PROJECT_DIR,
+                              capture_output=True,
+                              text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(stages: List[str], sizes: List[int],
+        layouts: List[Tuple[int, int]]) -> List[Dict]:
+    results = []
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as corpus_dir:
+        for width, height in layouts:
+            layout_dir = path.join(corpus_dir, '{}x{}'.format(width, height))
+            os.mkdir(layout_dir)
+            corpus = synthesize_corpus(layout_dir, (width, height),
+                                       max(sizes))
+            for size in sizes:
+                for stage in stages:
+                    with futures.ProcessPoolExecutor(
+                            max_workers=1, mp_context=context) as executor:
+                        result = executor.submit(run_case, stage,
+                                                 corpus[:size]).result()
+                    result.update({
+                        'stage': stage,
+                        'layout': '{}x{}'.format(width, height),
+                        'corpus_size': size,
+                    })
+                    print(format_result(result), flush=True)
+                    results.append(result)
+    return results
+
+
+def format_result(r: Dict) -> str:
+    case = '{stage:<12} {layout:<9} {corpus_size:>6}'.format(**r)
+    if 'skipped' in r:
+        return case + '  skipped, ' + r['skipped']
+    return case + ('  {images_per_second:>9,.1f} img/s  p50 {p50_ms:>7.2f} ms'
+                   '  p99 {p99_ms:>7.2f} ms  peak RSS {peak_rss_kb:>8,} KB'.
+                   format(**r))
+
+
+def compare(results: List[Dict], baseline: List[Dict]) -> None:
+    def key(r: Dict) -> Tuple:
+        return (r['stage'], r['layout'], r['corpus_size'])
+
+    before = {key(r): r for r in baseline if 'skipped' not in r}
+    for r in results:
+        old = before.get(key(r))
+        if old is None or 'skipped' in r:
+            continue
+        change = r['images_per_second'] / old['images_per_second'] - 1
+        print('{:<12} {:<9} {:>6}  throughput {:+.1%}'.format(*key(r),
+                                                             change))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--stages', default=','.join(STAGES))
+    parser.add_argument('--sizes',
+                        default=','.join(str(s) for s in CORPUS_SIZES))
+    parser.add_argument('--layouts',
+                        default=','.join('{}x{}'.format(*l) for l in LAYOUTS))
+    parser.add_argument('--output', help='Where to save the JSON results.')
+    parser.add_argument('--compare', help='Earlier results to compare to.')
+    args = parser.parse_args()
+    stages = args.stages.split(',')
+    for stage in stages:
+        if stage not in BENCHMARKS:
+            parser.error('Unknown stage: ' + stage)
+    layouts = [
+        (int(w), int(h))
+        for w, h in (l.split('x') for l in args.layouts.split(','))
+    ]
+    results = run(stages, [int(s) for s in args.sizes.split(',')], layouts)
+    commit = get_commit()
+    output = args.output or path.join(
+        RESULTS_DIR, 'pipeline-{}.json'.format(commit or 'unknown'))
+    os.makedirs(path.dirname(path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(
+            {
+                'commit': commit,
+                'python': sys.version.split()[0],
+                'platform': platform.platform(),
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'results': results,
+            },
+            f,
+            indent=2)
+    print('Saved the results to ' + output)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f)['results'])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Compares ways of halving the halves of a 1280x803 picture.
+
+Run with
+
+    python -m bench.reduce
+
+It renders both halves of a synthesized picture in the large layout, with
+the subtitles removed and scaled by half as in `plan_halves`, from an
+already decoded source. "reduce" is the default box reduction; the others
+resample with the named Pillow filter.
+"""
+import time
+from typing import Dict, List, Optional
+
+from PIL import Image
+
+from bench.pipeline import synthesize_picture
+from tools import process
+
+FILTERS = [('reduce', None), ('bilinear', Image.BILINEAR),
+           ('bicubic', Image.BICUBIC), ('lanczos', Image.LANCZOS)]
+
+
+def ms_per_picture(source: Image.Image, resample: Optional[int],
+                   repeat: int) -> float:
+    dap = process.DoubleAdjectivePic.from_image(source, 'links', 'rechts',
+                                                subs=True)
+    halves = process.plan_halves(dap, resample=resample)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for half in halves:
+            half.plan.apply(source)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def run(repeat: int = 200) -> List[Dict]:
+    source = synthesize_picture((1280, 803), seed=1)
+    source.load()
+    return [{
+        'filter': name,
+        'ms_per_picture': ms_per_picture(source, resample, repeat),
+    } for name, resample in FILTERS]
+
+
+def main():
+    for r in run():
+        print('{filter:<9} {ms_per_picture:>7.3f} ms/picture'.format(**r))
+
+
+if __name__ == "__main__":
+    main()
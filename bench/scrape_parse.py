@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Compares the gallery page parsers of tools.scrape.
+
+Run with
+
+    python -m bench.scrape_parse
+
+It reports the mean parse time and the peak memory per page for the fixture
+pages in testdata/scrape/ and for a synthetic page the size of a real gallery.
+"""
+import glob
+from os import path
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Tuple
+
+from tools import scrape
+
+PROJECT_DIR = path.dirname(path.dirname(path.realpath(__file__)))
+PAGES_DIR = path.join(PROJECT_DIR, 'testdata', 'scrape')
+
+IMAGE_BLOCK = """
+<figure class="wp-block-image">
+  <img src="https://example.com/images/{i}_{i}x_Adjektive_Deutsch_deutschlernerblog.png"
+       alt="Adjektiv {i}" width="640" height="402" class="aligncenter size-full"
+       srcset="https://example.com/images/{i}-300x188.png 300w, https://example.com/images/{i}.png 640w">
+  <noscript><img src="https://example.com/images/{i}-lazy.png" width="640" height="402"
+       data-lazy-src="https://example.com/images/{i}.png"></noscript>
+  <figcaption>Adjektiv <strong>{i}</strong> &ndash; Gegensatz</figcaption>
+</figure>
+<p>Lorem ipsum dolor sit amet, <a href="https://example.com/{i}">consectetur</a>
+adipiscing elit, sed do eiusmod tempor incididunt ut labore et dolore.</p>
+"""
+
+
+def synthetic_page(images: int = 100) -> str:
+    """Returns a page resembling a real gallery page with `images` images."""
+    body = ''.join(IMAGE_BLOCK.format(i=i) for i in range(images))
+    return ('<!DOCTYPE html><html><head><title>Teil 1</title>' +
+            '<script>var x = "<p>weiter </p>";</script></head><body>' +
+            '<nav>' + '<a href="#">Menu</a>' * 200 + '</nav>' + body +
+            '<p>weiter <a href="https://example.com/teil-2/">Teil 2</a></p>' +
+            '</body></html>')
+
+
+def measure(parse: Callable[[str], Tuple], page: str,
+            repeat: int) -> Tuple[float, int]:
+    """Returns the mean parse time in seconds and the peak memory in bytes."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        parse(page)
+    mean = (time.perf_counter() - start) / repeat
+    tracemalloc.start()
+    parse(page)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (mean, peak)
+
+
+def run(repeat: int = 20) -> List[Dict]:
+    pages = [(path.basename(p), open(p, encoding='utf-8').read())
+             for p in sorted(glob.glob(path.join(PAGES_DIR, '*.html')))]
+    pages.append(('synthetic-100-images', synthetic_page()))
+    results = []
+    for name, page in pages:
+        for parser, parse in sorted(scrape.GALLERY_PAGE_PARSERS.items()):
+            mean, peak = measure(parse, page, repeat)
+            results.append({
+                'page': name,
+                'bytes': len(page.encode('utf-8')),
+                'parser': parser,
+                'mean_ms': mean * 1000,
+                'peak_kib': peak / 1024,
+            })
+    return results
+
+
+def main():
+    print('{:<24} {:>9} {:<7} {:>9} {:>10}'.format('page', 'bytes',
+                                                  'parser', 'mean ms',
+                                                  'peak KiB'))
+    for r in run():
+        print('{page:<24} {bytes:>9} {parser:<7} {mean_ms:>9.2f} '
+              '{peak_kib:>10.1f}'.format(**r))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Checks how fast the quick commands of `python -m tools` start.
+
+Run with
+
+    python -m bench.startup
+
+It runs each command with `-X importtime` on a directory of empty pictures
+with generated names, and sums up the import time of the modules that the
+interpreter itself does not import at startup. It also reports the median
+wall time of the command next to that of `python -c pass`. The run fails if
+a command goes over the import time budget or imports any of the heavy
+dependencies, which only the commands that need them should load.
+"""
+import argparse
+from os import path
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, NamedTuple, Set
+
+PROJECT_DIR = path.dirname(path.dirname(path.realpath(__file__)))
+HEAVY_MODULES = ['anki', 'bs4', 'requests', 'PIL', 'numpy']
+# Command lines by name. '{images}' is replaced by the picture directory.
+COMMANDS = {
+    'help': ['--help'],
+    'list': ['list', '{images}'],
+    'validate': ['validate', '{images}'],
+}
+DEFAULT_BUDGET_MS = 30.0
+
+
+class ImportEntry(NamedTuple):
+    module: str
+    # How deep in the import of a top level module this one was imported.
+    level: int
+    self_us: int
+    cumulative_us: int
+
+
+def parse_importtime(stderr: str) -> List[ImportEntry]:
+    """Parses the lines that `-X importtime` writes to stderr."""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        name = fields[2][1:]
+        stripped = name.lstrip()
+        entries.append(
+            ImportEntry(stripped, (len(name) - len(stripped)) // 2,
+                        int(fields[0]), int(fields[1])))
+    return entries
+
+
+def run_importtime(argv: List[str]) -> List[ImportEntry]:
+    result = subprocess.run([sys.executable, '-X', 'importtime'] + argv,
+                            cwd=PROJECT_DIR,
+                            stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE,
+                            universal_newlines=True)
+    return parse_importtime(result.stderr)
+
+
+def import_ms(entries: List[ImportEntry], startup: Set[str]) -> float:
+    """Sums up the import time of the top level modules not in `startup`."""
+    return sum(e.cumulative_us for e in entries
+               if e.level == 0 and e.module not in startup) / 1000
+
+
+def wall_ms(argv: List[str], repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + argv,
+                       cwd=PROJECT_DIR,
+                       stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def make_pictures(directory: str, count: int) -> None:
+    for i in range(count):
+        name = 'adj{0}_gegenteil{0}_Adjektive_Deutsch_deutschlernerblog.png'
+        open(path.join(directory, name.format(i)), 'w').close()
+
+
+def run(pictures: int = 200, repeat: int = 10) -> List[Dict]:
+    startup = {e.module for e in run_importtime(['-c', 'pass'])}
+    baseline_ms = wall_ms(['-c', 'pass'], repeat)
+    results = []
+    with tempfile.TemporaryDirectory() as images:
+        make_pictures(images, pictures)
+        for name, command in COMMANDS.items():
+            argv = ['-m', 'tools'] + [a.format(images=images) for a in command]
+            entries = run_importtime(argv)
+            loaded = {e.module.split('.')[0] for e in entries}
+            slowest = sorted((e for e in entries
+                              if e.level == 0 and e.module not in startup),
+                             key=lambda e: -e.cumulative_us)
+            results.append({
+                'command': name,
+                'import_ms': import_ms(entries, startup),
+                'wall_ms': wall_ms(argv, repeat),
+                'baseline_ms': baseline_ms,
+                'heavy': [m for m in HEAVY_MODULES if m in loaded],
+                'slowest': [e.module for e in slowest[:3]],
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--budget-ms',
+                        type=float,
+                        default=DEFAULT_BUDGET_MS,
+                        help='The most import time a command may take.')
+    parser.add_argument('--pictures', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+    failed = False
+    for r in run(args.pictures, args.repeat):
+        print('{command:<9} imports {import_ms:>6.1f} ms  wall {wall_ms:>6.1f}'
+              ' ms (python -c pass {baseline_ms:.1f} ms)  slowest: {}'.format(
+                  ', '.join(r['slowest']), **r))
+        if r['heavy']:
+            print('  imports ' + ', '.join(r['heavy']))
+            failed = True
+        if r['import_ms'] > args.budget_ms:
+            print('  over the budget of {} ms'.format(args.budget_ms))
+            failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,98 +2,207 @@
 # -*- coding: utf-8 -*-
 """This gist uses tools to add 100 German cloze image cards."""
 from contextlib import closing
+from functools import partial
 from pathlib import PosixPath
 import os
-from typing import List
-
-import anki
+import sys
+import tempfile
+from typing import TYPE_CHECKING, List, Optional, Tuple
 
 import tools.anki
-from tools.process import DoubleAdjectivePic, SingleAdjectivePic
+from tools.cache import (DerivedImageCache, lookup_fingerprint,
+                         lookup_halves, store_fingerprint, store_halves)
+from tools.cards import make_double_cloze_draft
+from tools.dedup import DuplicateIndex, export_fingerprinted_halves
+from tools.filenames import originals_first_key
+from tools.manifest import Manifest
+from tools.media import MediaStager
+from tools.process import (COMPACT_ENCODE_OPTIONS, DoubleAdjectivePic,
+                           EncodedPic, EncodeReport, Fingerprint,
+                           check_source_names, iter_source_files,
+                           process_in_parallel)
+
+if TYPE_CHECKING:
+    import anki
 
-ANKI_DB = PosixPath('/home/grzesiek/Documents/Anki/grzesiek/collection.anki2')
-assert (ANKI_DB.is_file())
+ANKI_DB = PosixPath(tools.anki.MY_COLLECTION)
 IMAGE_DIR = PosixPath('images/').absolute()
-assert (IMAGE_DIR.is_dir())
-SHARED_TAGS = {'200-wichtigsten-deutschen-adjektive', 'Adjektiv'}
-DOUBLE_CLOZE_TEMPLATE = """
-<div style="display:flex;justify-content:center;">
-  <div style="text-align:center;">
-    <img src="{left_pic}" style="max-height:200px"/>
-    <div>{{{{c1::{left_word}}}}}</div>
-  </div>
-  <div style="text-align:center;">
-    <img src="{right_pic}" style="max-height:200px"/>
-    <div>{right_cloze}</div>
-  </div>
-</div>
-"""
-
-
-def load_images() -> List[DoubleAdjectivePic]:
-    pics = []
-    import os
-    for img in IMAGE_DIR.iterdir():
-        pics.append(DoubleAdjectivePic.from_original(str(img)))
-    return pics
-
-
-def change_model_to_cloze(
-        anki_collection: anki.collection._Collection) -> None:
-    """Returns the id of the "cloze" model"""
-    for m in anki_collection.models.all():
-        if m['name'] == 'Cloze':
-            anki_collection.models.setCurrent(m)
-            return None
-    assert (False)
-
-
-def get_cloze_field(left_pic: str, left_adj: str, right_pic: str,
-                    right_adj: str) -> str:
-    if right_adj.startswith('un'):
-        right_cloze = 'un{{c1::' + right_adj[2:] + '}}'
-    elif right_adj.startswith('nicht '):
-        right_cloze = 'nicht {{c1::' + right_adj[6:] + '}}'
-    elif right_adj.endswith('los'):
-        right_cloze = '{{c1::' + right_adj[:-3] + '}}los'
-    else:
-        right_cloze = '{{c2::' + right_adj + '}}'
-    return DOUBLE_CLOZE_TEMPLATE.format(
-        left_pic=left_pic,
-        left_word=left_adj,
-        right_pic=right_pic,
-        right_cloze=right_cloze,
-    )
-
-
-def add_a_double_cloze_note(dap: DoubleAdjectivePic,
-                            col: anki.collection._Collection):
-    change_model_to_cloze(col)
-    note = col.newNote(forDeck=False)
-    note.model()['did'] = col.decks.id("200")  # type: ignore
-    left_sap, right_sap = [sap.remove_subs() for sap in dap.split()]
-    if left_sap.get_size()[1] > 400:
-        left_sap, right_sap = (left_sap.resize(scale=0.5),
-                               right_sap.resize(scale=0.5))
-    left_pic = col.media.addFile(left_sap.get_filename())
-    right_pic = col.media.addFile(right_sap.get_filename())
-    note.fields[0] = get_cloze_field(left_pic, dap.left_adjective, right_pic,
-                                     dap.right_adjective)
-    note.tags = (list(SHARED_TAGS) +
-                 [dap.left_adjective, dap.right_adjective] + ['double'])
-    print("Adding an image for " +
-          str((dap.left_adjective, dap.right_adjective)))
-    col.addNote(note)
-    note.flush()
-
-
-def main(anki_collection: anki.collection._Collection):
-    daps = load_images()
-    for dap in daps:
-        add_a_double_cloze_note(dap, col)
-    col.save()
+CACHE_DIR = PosixPath(
+    os.environ.get('XDG_CACHE_HOME', '~/.cache'),
+    '200-wichtigste-deutsche-adjektive').expanduser()
+# Records what has been imported, so that rebuilds skip unchanged pictures.
+MANIFEST_PATH = str(ANKI_DB.with_suffix('.fill200-manifest.json'))
+# tools.apkg encodes with the same options by default.
+ENCODE_OPTIONS = COMPACT_ENCODE_OPTIONS
+# Also encodes every picture with Pillow's defaults to report how many bytes
+# ENCODE_OPTIONS save. This doubles the encoding work.
+MEASURE_SAVINGS = False
+# Scale halves to fit within this many pixels instead of halving the large
+# layout. None keeps the halving.
+MAX_DIMENSION = None
+
+
+def load_manifest() -> Manifest:
+    # Media files depend on these settings, so changing them rebuilds all.
+    return Manifest(MANIFEST_PATH,
+                    settings=repr((MAX_DIMENSION, ENCODE_OPTIONS)))
+
+
+def load_known_pictures(manifest: Manifest,
+                        sources: List[str]) -> DuplicateIndex:
+    """Indexes imported pictures by their recorded fingerprints."""
+    index = DuplicateIndex()
+    for source in sources:
+        entry = manifest.get(source, str(IMAGE_DIR))
+        if entry is not None and entry.fingerprint is not None:
+            index.add(DoubleAdjectivePic.from_original(source),
+                      entry.fingerprint)
+    return index
+
+
+def lookup_fingerprinted_halves(
+    cache: DerivedImageCache, dap: DoubleAdjectivePic
+) -> Optional[Tuple[Fingerprint, Tuple[EncodedPic, EncodedPic]]]:
+    # The fingerprint is cached next to the halves, so that a hit needs no
+    # decode, but duplicates are still checked.
+    fingerprint = lookup_fingerprint(cache, dap)
+    if fingerprint is None:
+        return None
+    halves = lookup_halves(cache,
+                           dap,
+                           max_dimension=MAX_DIMENSION,
+                           options=ENCODE_OPTIONS)
+    if halves is None:
+        return None
+    return (fingerprint, halves)
+
+
+def check_paths() -> None:
+    if not ANKI_DB.is_file():
+        raise Exception("Could not find the collection: " + str(ANKI_DB))
+    if not IMAGE_DIR.is_dir():
+        raise Exception("Could not find the images: " + str(IMAGE_DIR))
+
+
+def main(anki_collection: 'anki.collection._Collection',
+         dry_run: bool = False):
+    # Bad filenames fail the run before any picture or note gets touched.
+    check_source_names(str(IMAGE_DIR))
+    manifest = load_manifest()
+    changes = manifest.diff(iter_source_files(str(IMAGE_DIR)),
+                            str(IMAGE_DIR))
+    print(changes.summary())
+    for source in changes.removed:
+        manifest.forget(source, str(IMAGE_DIR))
+    if not changes.new and not changes.changed:
+        if changes.removed and not dry_run:
+            manifest.save()
+        return
+    known = load_known_pictures(manifest, changes.unchanged)
+    daps = (DoubleAdjectivePic.from_original(source)
+            for source in sorted(changes.new + changes.changed,
+                                 key=originals_first_key))
+    duplicates: List[Tuple[DoubleAdjectivePic, DoubleAdjectivePic]] = []
+    cache = DerivedImageCache(str(CACHE_DIR))
+    stager = MediaStager(anki_collection.media.dir())
+    encode_report = EncodeReport()
+    # Pairs of a picture and its media names, for new notes and for notes
+    # to update.
+    additions: List[Tuple[DoubleAdjectivePic, Tuple[str, str]]] = []
+    updates: List[Tuple[DoubleAdjectivePic, Tuple[str, str], int]] = []
+    with tempfile.TemporaryDirectory() as out_dir, stager:
+        # Images are fingerprinted and processed in parallel, from a single
+        # decode each, but only this process talks to the collection and
+        # the cache. Results come in order, originals before reuploads, so
+        # the first of duplicate pictures is kept.
+        for result in process_in_parallel(
+                partial(export_fingerprinted_halves,
+                        out_dir=out_dir,
+                        max_dimension=MAX_DIMENSION,
+                        options=ENCODE_OPTIONS,
+                        measure_savings=MEASURE_SAVINGS),
+                daps,
+                shortcut=partial(lookup_fingerprinted_halves, cache)):
+            if result.error:
+                print("Could not process " + result.item.get_filename() +
+                      ":\n" + result.error)
+                continue
+            dap = result.item
+            fingerprint, halves = result.value
+            original = known.find(fingerprint)
+            if original is not None:
+                print("Skipping " + dap.get_filename() +
+                      ", a duplicate of " + original.get_filename())
+                duplicates.append((dap, original))
+                continue
+            known.add(dap, fingerprint)
+            # Halves are staged from the exported files, as the cache may
+            # evict the copies it stores before the media get flushed.
+            media = (stager.stage(halves[0].filename, dap.left_adjective),
+                     stager.stage(halves[1].filename, dap.right_adjective))
+            left, right = store_halves(cache,
+                                       dap,
+                                       halves,
+                                       max_dimension=MAX_DIMENSION,
+                                       options=ENCODE_OPTIONS)
+            store_fingerprint(cache, dap, fingerprint)
+            for adj, half in ((dap.left_adjective, left),
+                              (dap.right_adjective, right)):
+                encode_report.add(half)
+                if half.baseline_bytes is not None:
+                    print("Encoded {} into {} bytes, saving {}.".format(
+                        adj, half.bytes, half.baseline_bytes - half.bytes))
+            entry = manifest.get(dap.get_filename(), str(IMAGE_DIR))
+            if entry is not None and entry.note_id is not None:
+                updates.append((dap, media, entry.note_id))
+            else:
+                additions.append((dap, media))
+        print(encode_report.summary())
+        if not dry_run:
+            added_media = stager.flush()
+            # Let Anki register the new files in its media database.
+            anki_collection.media.findChanges()
+            print("Added {} media files, reused {}.".format(
+                len(added_media), stager.reused))
+    update_report = tools.anki.update_notes_in_bulk(
+        anki_collection,
+        [(nid, make_double_cloze_draft(dap, *media))
+         for dap, media, nid in updates],
+        dry_run=dry_run)
+    print(update_report.summary())
+    # Notes deleted in Anki since they were imported get added again.
+    additions.extend(updates[i][:2] for i in update_report.missing)
+    report = tools.anki.add_notes_in_bulk(
+        anki_collection,
+        [make_double_cloze_draft(dap, *media) for dap, media in additions],
+        model_name='Cloze',
+        deck_name='200',
+        dry_run=dry_run)
+    print(report.summary())
+    print("Derived image cache: " + str(cache.stats()))
+    if dry_run:
+        return
+    imported = [(dap, media, report.note_ids[i])
+                for i, (dap, media) in enumerate(additions)
+                if i in report.note_ids]
+    imported.extend(u for u in updates if u[2] in update_report.added)
+    for dap, media, nid in imported:
+        manifest.record(dap.get_filename(), str(IMAGE_DIR), media, nid,
+                        known.fingerprints.get(dap.get_filename()))
+    # Duplicates are recorded too, so that rebuilds skip them.
+    for duplicate, original in duplicates:
+        manifest.record(duplicate.get_filename(),
+                        str(IMAGE_DIR), ('', ''),
+                        None,
+                        duplicate_of=original.get_filename())
+    manifest.save()
+
+
+def run(dry_run: bool = False) -> None:
+    check_paths()
+    with closing(tools.anki.open_collection(str(ANKI_DB))) as col:
+        main(col, dry_run=dry_run)
 
 
 if __name__ == "__main__":
-    with closing(anki.Collection(str(ANKI_DB))) as col:
-        main(col)
+    run(dry_run='--dry-run' in sys.argv[1:])
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""A stand-in for an Anki collection backed by an in-memory notes table.
+
+It implements just the parts of `anki.collection._Collection` that the bulk
+queries of tools.anki use.
+"""
+import sqlite3
+from typing import Any, Dict, List, Optional, Sequence
+
+MODELS = {
+    1: {'id': 1, 'name': 'Basic'},
+    2: {'id': 2, 'name': 'Image Occlusion Enhanced'},
+    3: {'id': 3, 'name': 'Cloze'},
+}
+BASIC, IMAGE_OCCLUSION, CLOZE = 1, 2, 3
+
+
+class FakeDB:
+    def __init__(self):
+        self._db = sqlite3.connect(':memory:')
+        self._db.execute(
+            'create table notes (id integer primary key, mid integer, ' +
+            'mod integer, tags text, flds text)')
+        self.queries = 0
+
+    def all(self, sql: str, *args: Any) -> List[tuple]:
+        self.queries += 1
+        return self._db.execute(sql, args).fetchall()
+
+    def execute(self, sql: str, *args: Any) -> None:
+        self.queries += 1
+        self._db.execute(sql, args)
+
+
+class FakeModels:
+    def __init__(self):
+        self.gets = 0
+
+    def get(self, mid: int) -> Optional[Dict]:
+        self.gets += 1
+        return MODELS.get(mid)
+
+
+class FakeCollection:
+    def __init__(self):
+        self.db = FakeDB()
+        self.models = FakeModels()
+
+    def add(self,
+            nid: int,
+            mid: int,
+            fields: List[str],
+            tags: Sequence[str] = (),
+            mod: int = 0) -> None:
+        self.db.execute('insert into notes values (?, ?, ?, ?, ?)', nid, mid,
+                        mod, ' ' + ' '.join(tags) + ' ', '\x1f'.join(fields))
+
+    def close(self) -> None:
+        self.db._db.close()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""A local HTTP stand-in for deutschlernerblog.de.
+
+It serves the gallery pages from testdata/scrape/, with `{base}` replaced by
+the server's URL, and the same fixture picture for every /images/ path.
+"""
+import hashlib
+import http.server
+from os import path
+import threading
+from typing import Dict, List, Tuple
+
+PROJECT_DIR = path.dirname(path.dirname(path.realpath(__file__)))
+TESTDATA_DIR = path.join(PROJECT_DIR, 'testdata')
+PAGES_DIR = path.join(TESTDATA_DIR, 'scrape')
+IMAGE = path.join(TESTDATA_DIR,
+                  'left_right_Adjektive_Deutsch_deutschlernerblog.png')
+
+
+class FixtureServer:
+    def __init__(self, pages_dir: str = PAGES_DIR, image: str = IMAGE):
+        self.pages_dir = pages_dir
+        with open(image, 'rb') as f:
+            self.image = f.read()
+        # Every handled request as (method, path).
+        self.requests: List[Tuple[str, str]] = []
+        # Paths that should fail with 503 for the given number of requests.
+        self.failures: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                      self._handler())
+        self.base = 'http://127.0.0.1:{}'.format(self._httpd.server_port)
+        self._thread = threading.Thread(target=self._httpd.serve_forever,
+                                        kwargs={'poll_interval': 0.01},
+                                        daemon=True)
+
+    def __enter__(self) -> 'FixtureServer':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def url(self, page: str) -> str:
+        return self.base + '/' + page
+
+    def count(self, method: str, prefix: str = '/') -> int:
+        with self._lock:
+            return sum(1 for m, p in self.requests
+                       if m == method and p.startswith(prefix))
+
+    def _respond(self, handler: http.server.BaseHTTPRequestHandler,
+                 body: bool) -> None:
+        with self._lock:
+            self.requests.append((handler.command, handler.path))
+            failures = self.failures.get(handler.path, 0)
+            if failures:
+                self.failures[handler.path] = failures - 1
+        if failures:
+            handler.send_error(503)
+            return
+        if handler.path.startswith('/images/'):
+            content = self.image
+            content_type = 'image/png'
+        else:
+            page = path.join(self.pages_dir, path.basename(handler.path))
+            if not path.isfile(page):
+                handler.send_error(404)
+                return
+            with open(page, encoding='utf-8') as f:
+                content = f.read().replace('{base}', self.base).encode('utf-8')
+            content_type = 'text/html; charset=utf-8'
+        etag = '"{}"'.format(hashlib.sha1(content).hexdigest())
+        if handler.headers.get('If-None-Match') == etag:
+            handler.send_response(304)
+            handler.send_header('ETag', etag)
+            handler.end_headers()
+            return
+        handler.send_response(200)
+        handler.send_header('Content-Type', content_type)
+        handler.send_header('Content-Length', str(len(content)))
+        handler.send_header('ETag', etag)
+        handler.end_headers()
+        if body:
+            handler.wfile.write(content)
+
+    def _handler(self):
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                server._respond(self, body=True)
+
+            def do_HEAD(self):
+                server._respond(self, body=False)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
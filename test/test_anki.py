@@ -1,10 +1,141 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import importlib.util
+import json
+from os import path
+import tempfile
 import unittest
 
 from tools import anki
 
+from test import fake_anki
+from test.fake_anki import FakeCollection
+
+PROJECT_DIR = path.dirname(path.dirname(path.realpath(__file__)))
+FIELDS_CORPUS = path.join(PROJECT_DIR, 'testdata', 'anki_fields.json')
+
 
 class ShyRemovalTestCase(unittest.TestCase):
     def test_removes_shys(self):
         self.assertEqual(anki.remove_silent_hyphens('he\u00adllo'), 'hello')
+
+
+class BulkLookupTestCase(unittest.TestCase):
+    def setUp(self):
+        self.col = FakeCollection()
+        self.col.add(1, fake_anki.BASIC, ['wild', 'wild'])
+        self.col.add(2, fake_anki.BASIC, ['<b>zahm</b>', 'tame'])
+        self.col.add(3, fake_anki.IMAGE_OCCLUSION, ['', ''], ['wild', 'zahm'])
+        self.col.add(4, fake_anki.CLOZE,
+                     ['<img src="wild_zahm_Adjektive_Deutsch.png">'],
+                     ['wild', 'zahm'])
+        self.col.add(5, fake_anki.BASIC, ['wildnis', 'wilderness'])
+        self.col.add(6, fake_anki.BASIC, ['gut', 'good'])
+
+    def ids(self, records):
+        return [r.id for r in records]
+
+    def test_get_related_notes_in_bulk(self):
+        queries = self.col.db.queries
+        related = anki.get_related_notes_in_bulk(self.col, ['wild', 'zahm'])
+        self.assertEqual(self.col.db.queries - queries, 1)
+        self.assertEqual(self.ids(related['wild'][0]), [3])
+        self.assertEqual(self.ids(related['wild'][1]), [1, 4])
+        self.assertEqual(self.ids(related['zahm'][0]), [3])
+        self.assertEqual(self.ids(related['zahm'][1]), [2, 4])
+
+    def test_get_related_double_notes_in_bulk(self):
+        related = anki.get_related_double_notes_in_bulk(
+            self.col, [('wild', 'zahm'), ('gut', 'schlecht')])
+        self.assertEqual(self.ids(related[('wild', 'zahm')][0]), [3])
+        self.assertEqual(self.ids(related[('wild', 'zahm')][1]), [4])
+        self.assertEqual(related[('gut', 'schlecht')], ([], []))
+
+    def test_case_of_umlauts_is_ignored(self):
+        self.col.add(7, fake_anki.BASIC, ['ärgerlich', 'annoying'])
+        self.col.add(8, fake_anki.BASIC, ['Öl', 'oil'], ['ÜBEL'])
+        related = anki.get_related_double_notes_in_bulk(
+            self.col, [('ÄRGERLICH', 'annoying'), ('öl', 'übel')])
+        self.assertEqual(self.ids(related[('ÄRGERLICH', 'annoying')][1]),
+                         [7])
+        self.assertEqual(self.ids(related[('öl', 'übel')][1]), [8])
+
+    def test_models_are_resolved_once(self):
+        anki.load_notes_mentioning(self.col, ['wild', 'zahm', 'gut'])
+        self.assertEqual(self.col.models.gets, 3)
+
+    def test_splits_many_terms_into_few_queries(self):
+        queries = self.col.db.queries
+        terms = ['term{}'.format(i) for i in range(anki.TERMS_PER_QUERY + 1)]
+        anki.load_notes_mentioning(self.col, terms)
+        self.assertEqual(self.col.db.queries - queries, 2)
+
+
+class FieldTextTestCase(unittest.TestCase):
+    def test_field_text_matches_bs_on_the_corpus(self):
+        with open(FIELDS_CORPUS, encoding='utf-8') as f:
+            fields = json.load(f)
+        for field in fields:
+            self.assertEqual(anki.field_text(field),
+                             anki.field_text_with_bs(field), repr(field))
+
+    def test_field_text_strips_markup(self):
+        self.assertEqual(
+            anki.field_text('<div><b>gro&szlig;</b><!-- x --></div>'),
+            'groß')
+
+
+@unittest.skipUnless(importlib.util.find_spec('anki'), 'needs Anki')
+class AddNotesInBulkTestCase(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.col = anki.open_collection(
+            path.join(tmp.name, 'collection.anki2'))
+        self.addCleanup(self.col.close)
+        self.drafts = [
+            anki.NoteDraft(['{{c1::wild}} {{c2::zahm}}'], ['wild', 'zahm']),
+            anki.NoteDraft(['{{c1::gut}}'], ['gut']),
+            anki.NoteDraft(['no cloze'], ['broken']),
+        ]
+
+    def test_adds_notes_in_one_go(self):
+        report = anki.add_notes_in_bulk(self.col, self.drafts, 'Cloze', '200')
+        self.assertEqual(report.count, 2)
+        self.assertEqual([draft for draft, _ in report.failed],
+                         self.drafts[2:])
+        self.assertEqual(len(self.col.findNotes('deck:200')), 2)
+        self.assertEqual(len(self.col.findCards('tag:wild')), 2)
+        self.assertIn('Added 2 notes, 1 failed.', report.summary())
+
+    def test_dry_run_leaves_the_collection_untouched(self):
+        report = anki.add_notes_in_bulk(self.col,
+                                        self.drafts,
+                                        'Cloze',
+                                        '200',
+                                        dry_run=True)
+        self.assertEqual(report.count, 2)
+        self.assertEqual(report.added, [])
+        self.assertEqual(self.col.noteCount(), 0)
+        self.assertIn('Would add 2 notes', report.summary())
+
+    def test_records_note_ids_by_draft(self):
+        report = anki.add_notes_in_bulk(self.col, self.drafts, 'Cloze', '200')
+        self.assertEqual(sorted(report.note_ids), [0, 1])
+        self.assertEqual(report.note_ids[1], report.added[1])
+
+    def test_updates_notes_in_one_go(self):
+        report = anki.add_notes_in_bulk(self.col, self.drafts, 'Cloze', '200')
+        nid = report.note_ids[1]
+        update = anki.NoteDraft(['{{c1::besser}}'], ['besser'])
+        report = anki.update_notes_in_bulk(self.col, [(nid, update),
+                                                      (1, update)])
+        self.assertEqual(report.added, [nid])
+        self.assertEqual(len(report.failed), 1)
+        self.assertEqual(report.missing, [1])
+        self.assertEqual(self.col.getNote(nid).fields[0], '{{c1::besser}}')
+        self.assertIn('Updated 1 notes, 1 failed.', report.summary())
+
+    def test_rejects_unknown_models(self):
+        with self.assertRaises(Exception):
+            anki.add_notes_in_bulk(self.col, self.drafts, 'Unknown', '200')
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+import os
+from os import path
+import shutil
+import sqlite3
+import tempfile
+import unittest
+import zipfile
+
+from PIL import Image, ImageDraw
+
+from tools import apkg, process
+from tools.cards import NoteDraft
+
+PROJECT_DIR = path.dirname(path.dirname(path.realpath(__file__)))
+TESTDATA_DIR = path.join(PROJECT_DIR, 'testdata')
+LEFT_RIGHT_IMG = path.join(
+    TESTDATA_DIR, "left_right_Adjektive_Deutsch_deutschlernerblog.png")
+
+
+class ApkgTestCase(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        self.daps = []
+        for name in ('wild_zahm', 'nett_nicht_nett'):
+            source = path.join(
+                self.tmp, name + '_Adjektive_Deutsch_deutschlernerblog.png')
+            shutil.copyfile(LEFT_RIGHT_IMG, source)
+            self.daps.append(process.DoubleAdjectivePic.from_original(source))
+
+    def export(self, filename: str) -> sqlite3.Connection:
+        writer = apkg.export_deck(self.daps, filename, max_workers=1)
+        self.assertEqual((writer.notes, writer.cards), (2, 3))
+        db_path = path.join(self.tmp, path.basename(filename) + '.anki2')
+        with zipfile.ZipFile(filename) as package:
+            with open(db_path, 'wb') as f:
+                f.write(package.read('collection.anki2'))
+            self.media = json.loads(package.read('media'))
+            self.numbers = sorted(n for n in package.namelist()
+                                  if n.isdigit())
+            self.media_bytes = {n: package.read(n) for n in self.numbers}
+        db = sqlite3.connect(db_path)
+        self.addCleanup(db.close)
+        return db
+
+    def test_export_deck(self):
+        db = self.export(path.join(self.tmp, 'deck.apkg'))
+        self.assertEqual(self.numbers, ['0', '1', '2', '3'])
+        self.assertTrue(self.media['0'].startswith('wild_'))
+        ver, models, decks = db.execute(
+            'select ver, models, decks from col').fetchone()
+        self.assertEqual(ver, 11)
+        self.assertEqual(
+            json.loads(models)[str(apkg.CLOZE_MODEL_ID)]['name'], 'Cloze')
+        self.assertIn('200', [d['name'] for d in json.loads(decks).values()])
+        notes = db.execute('select id, tags, flds from notes order by id')
+        ords = {}
+        for nid, tags, flds in notes:
+            self.assertIn(' double ', tags)
+            for name in self.media.values():
+                if name.split('_')[0] in tags.split():
+                    self.assertIn(name, flds)
+            ords[tags.split()[2]] = [
+                o for o, in db.execute(
+                    'select ord from cards where nid = ? order by ord', (
+                        nid, ))
+            ]
+        self.assertEqual(ords, {'wild': [0, 1], 'nett': [0]})
+
+    def test_media_are_encoded_like_fill200s(self):
+        self.export(path.join(self.tmp, 'deck.apkg'))
+        with tempfile.TemporaryDirectory() as out_dir:
+            halves = process.export_halves(
+                self.daps[0], out_dir, options=process.COMPACT_ENCODE_OPTIONS)
+            expected = []
+            for half in halves:
+                with open(half.filename, 'rb') as f:
+                    expected.append(f.read())
+        self.assertEqual([self.media_bytes['0'], self.media_bytes['1']],
+                         expected)
+
+    def test_guids_are_stable_across_builds(self):
+        guids = [
+            sorted(g for g, in self.export(path.join(
+                self.tmp, name)).execute('select guid from notes'))
+            for name in ('a.apkg', 'b.apkg')
+        ]
+        self.assertEqual(guids[0], guids[1])
+
+    def test_build_keeps_the_original_of_duplicates(self):
+        images = path.join(self.tmp, 'images')
+        os.mkdir(images)
+        names = [
+            name + '_Adjektive_Deutsch_deutschlernerblog.png'
+            for name in ('wild_zahm', 'wild_zahm_2', 'gut_schlecht')
+        ]
+        shutil.copyfile(LEFT_RIGHT_IMG, path.join(images, names[0]))
+        shutil.copyfile(LEFT_RIGHT_IMG, path.join(images, names[1]))
+        with Image.open(LEFT_RIGHT_IMG) as img:
+            img = img.convert('RGB')
+        ImageDraw.Draw(img).ellipse((40, 40, 600, 280), fill='blue')
+        img.save(path.join(images, names[2]))
+        filename = path.join(self.tmp, 'deck.apkg')
+        apkg.build(images, filename)
+        with zipfile.ZipFile(filename) as package:
+            package.extract('collection.anki2', self.tmp)
+        db = sqlite3.connect(path.join(self.tmp, 'collection.anki2'))
+        self.addCleanup(db.close)
+        self.assertEqual(
+            sorted(g for g, in db.execute('select guid from notes')),
+            sorted(apkg.note_guid(name) for name in (names[0], names[2])))
+
+    def test_sort_field_keeps_picture_names(self):
+        field = ('<div><img src="wild_1.png" style="max-height:200px"/>'
+                 '<div>{{c1::wild}} &amp; </div></div>')
+        self.assertEqual(apkg.sort_field(field),
+                         'wild_1.png {{c1::wild}} &')
+
+    def test_failed_build_leaves_no_package(self):
+        filename = path.join(self.tmp, 'deck.apkg')
+        with self.assertRaises(Exception):
+            with apkg.ApkgWriter(filename) as writer:
+                writer.add_note(NoteDraft(['no cloze'], []))
+        self.assertEqual(
+            [f for f in os.listdir(self.tmp) if f.startswith('deck')], [])
+
+    def test_notes_are_written_in_batches(self):
+        filename = path.join(self.tmp, 'deck.apkg')
+        with apkg.ApkgWriter(filename) as writer:
+            for i in range(apkg.BATCH_SIZE + 1):
+                writer.add_note(NoteDraft(['{{c1::%d}}' % i], []))
+            self.assertEqual(len(writer._note_rows), 1)
+        with zipfile.ZipFile(filename) as package:
+            package.extract('collection.anki2', self.tmp)
+        db = sqlite3.connect(path.join(self.tmp, 'collection.anki2'))
+        self.addCleanup(db.close)
+        self.assertEqual(
+            db.execute('select count(*) from cards').fetchone()[0],
+            apkg.BATCH_SIZE + 1)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+from os import path
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from tools import cache, process
+
+PROJECT_DIR = path.dirname(path.dirname(path.realpath(__file__)))
+TESTDATA_DIR = path.join(PROJECT_DIR, 'testdata')
+LEFT_RIGHT_IMG = path.join(
+    TESTDATA_DIR, "left_right_Adjektive_Deutsch_deutschlernerblog.png")
+LEFT_IMG = path.join(TESTDATA_DIR, "left.png")
+RIGHT_IMG = path.join(TESTDATA_DIR, "right.png")
+
+
+class PicKeyTestCase(unittest.TestCase):
+    def test_key_depends_on_the_operations(self):
+        dap = process.DoubleAdjectivePic.from_original(LEFT_RIGHT_IMG)
+        left, right = dap.split()
+        self.assertNotEqual(cache.get_pic_key(left), cache.get_pic_key(right))
+        self.assertNotEqual(cache.get_pic_key(left),
+                            cache.get_pic_key(left.remove_subs()))
+        self.assertEqual(cache.get_pic_key(left),
+                         cache.get_pic_key(dap.split()[0]))
+
+    def test_key_depends_on_the_content(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = path.join(tmp, 'pic.png')
+            shutil.copyfile(LEFT_IMG, filename)
+            pic = process.SingleAdjectivePic(filename, 'left', subs=True)
+            key = cache.get_pic_key(pic)
+            shutil.copyfile(RIGHT_IMG, filename)
+            os.utime(filename, ns=(0, 0))
+            self.assertNotEqual(cache.get_pic_key(pic), key)
+
+
+class DerivedImageCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def test_get_and_put(self):
+        c = cache.DerivedImageCache(self.tmp.name)
+        self.assertIsNone(c.get('a'))
+        entry = c.put('a', LEFT_IMG)
+        self.assertEqual(c.get('a'), entry)
+        self.assertEqual(c.stats()['hits'], 1)
+        self.assertEqual(c.stats()['misses'], 1)
+        self.assertEqual(c.stats()['bytes'], path.getsize(LEFT_IMG))
+
+    def test_evicts_least_recently_used_entries(self):
+        size = path.getsize(LEFT_IMG)
+        c = cache.DerivedImageCache(self.tmp.name, max_bytes=2 * size)
+        c.put('a', LEFT_IMG)
+        c.put('b', LEFT_IMG)
+        os.utime(c.get('b'), ns=(1, 1))
+        os.utime(c.get('a'), ns=(2, 2))
+        c.put('c', LEFT_IMG)
+        self.assertIsNone(c.get('b'))
+        self.assertIsNotNone(c.get('a'))
+        self.assertIsNotNone(c.get('c'))
+        self.assertEqual(c.evictions, 1)
+
+    def test_lookup_and_store_halves(self):
+        c = cache.DerivedImageCache(self.tmp.name)
+        dap = process.DoubleAdjectivePic.from_original(LEFT_RIGHT_IMG)
+        self.assertIsNone(cache.lookup_halves(c, dap))
+        with tempfile.TemporaryDirectory() as out_dir:
+            halves = process.export_halves(dap, out_dir)
+            stored = cache.store_halves(c, dap, halves)
+        self.assertEqual(cache.lookup_halves(c, dap), stored)
+        self.assertEqual(process.get_picture_size(stored[0].filename),
+                         (320, 329))
+
+    def test_lookup_and_store_fingerprint(self):
+        c = cache.DerivedImageCache(self.tmp.name)
+        dap = process.DoubleAdjectivePic.from_original(LEFT_RIGHT_IMG)
+        self.assertIsNone(cache.lookup_fingerprint(c, dap))
+        fingerprint = dap.remove_subs().get_fingerprint()
+        cache.store_fingerprint(c, dap, fingerprint)
+        other = process.DoubleAdjectivePic.from_original(LEFT_RIGHT_IMG)
+        with mock.patch.object(process.ImagePlan, 'render') as render:
+            self.assertEqual(cache.lookup_fingerprint(c, other), fingerprint)
+            render.assert_not_called()
+
+    def test_encode_options_are_part_of_the_key(self):
+        c = cache.DerivedImageCache(self.tmp.name)
+        dap = process.DoubleAdjectivePic.from_original(LEFT_RIGHT_IMG)
+        webp = process.EncodeOptions(format='webp')
+        with tempfile.TemporaryDirectory() as out_dir:
+            cache.store_halves(c, dap, process.export_halves(dap, out_dir))
+            self.assertIsNone(cache.lookup_halves(c, dap, options=webp))
+            halves = process.export_halves(dap, out_dir, options=webp)
+            stored = cache.store_halves(c, dap, halves, options=webp)
+        self.assertTrue(stored[0].filename.endswith('.webp'))
+        self.assertEqual(cache.lookup_halves(c, dap, options=webp), stored)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import contextlib
+import io
+from os import path
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from tools import anki
+from tools.__main__ import main
+
+from test import fake_anki
+from test.fake_anki import FakeCollection
+
+PROJECT_DIR = path.dirname(path.dirname(path.realpath(__file__)))
+HEAVY_MODULES = ['anki', 'bs4', 'requests', 'PIL', 'numpy']
+
+
+def make_pictures(directory: str, names) -> None:
+    for name in names:
+        open(
+            path.join(directory,
+                      name + '_Adjektive_Deutsch_deutschlernerblog.png'),
+            'w').close()
+
+
+def heavy_modules_after(code: str):
+    """Returns the heavy modules imported by running `code` in a new Python.
+    """
+    output = subprocess.check_output(
+        [
+            sys.executable, '-c', code + '\nimport sys\nprint(" ".join(' +
+            'm for m in {!r} if m in sys.modules))'.format(HEAVY_MODULES)
+        ],
+        cwd=PROJECT_DIR,
+        universal_newlines=True)
+    return output.splitlines()[-1].split()
+
+
+class CliTestCase(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.images = tmp.name
+        make_pictures(self.images, ['wild_zahm', 'nett_nicht_nett'])
+
+    def run_main(self, argv):
+        out, err = io.StringIO(), io.StringIO()
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            code = main(argv)
+        return (code, out.getvalue(), err.getvalue())
+
+    def test_list(self):
+        code, out, err = self.run_main(['list', self.images])
+        self.assertEqual(code, 0)
+        self.assertEqual(out.splitlines(), [
+            'nett_nicht_nett_Adjektive_Deutsch_deutschlernerblog.png\tnett' +
+            '\tnicht nett',
+            'wild_zahm_Adjektive_Deutsch_deutschlernerblog.png\twild\tzahm',
+        ])
+        self.assertEqual(err, '')
+
+    def test_validate_reports_bad_names(self):
+        self.assertEqual(self.run_main(['validate', self.images])[0], 0)
+        open(path.join(self.images, 'wild.png'), 'w').close()
+        code, out, err = self.run_main(['validate', self.images])
+        self.assertEqual(code, 1)
+        self.assertIn('wild.png: ', err)
+        self.assertIn('Found 3 pictures, 1 with bad names.', out)
+
+    def test_audit(self):
+        def open_collection(filename: str) -> FakeCollection:
+            col = FakeCollection()
+            col.add(1, fake_anki.CLOZE, [
+                '<img src="wild_Adjektive.png"> {{c1::wild}} {{c2::zahm}}'
+            ], ['wild', 'zahm', 'double'])
+            return col
+
+        index = path.join(self.images, 'index.sqlite')
+        argv = [
+            'audit', self.images, '--collection', 'c.anki2', '--index', index
+        ]
+        with mock.patch.object(anki,
+                               'open_collection',
+                               side_effect=open_collection) as opened:
+            code, out, _ = self.run_main(argv)
+        opened.assert_called_once_with('c.anki2')
+        self.assertEqual(code, 0)
+        self.assertIn('Reindexed 1 notes, removed 0.', out)
+        self.assertIn('wild / zahm: 0 image occlusion, 1 other notes', out)
+        self.assertIn('1 of 2 pairs have no notes.', out)
+        with mock.patch.object(anki,
+                               'open_collection',
+                               side_effect=open_collection):
+            code, out, _ = self.run_main(argv)
+        self.assertIn('Reindexed 0 notes, removed 0.', out)
+        self.assertIn('wild / zahm: 0 image occlusion, 1 other notes', out)
+
+
+class StartupTestCase(unittest.TestCase):
+    def test_quick_commands_skip_heavy_imports(self):
+        with tempfile.TemporaryDirectory() as images:
+            make_pictures(images, ['wild_zahm'])
+            self.assertEqual(
+                heavy_modules_after(
+                    'from tools.__main__ import main\n' +
+                    'main(["validate", {!r}])'.format(images)), [])
+
+    def test_tools_import_anki_and_scrapers_lazily(self):
+        self.assertEqual(
+            heavy_modules_after('import tools.anki, tools.note_index, ' +
+                                'tools.scrape'), [])
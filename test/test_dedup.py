@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from os import path
+import random
+import shutil
+import tempfile
+import unittest
+
+from PIL import Image, ImageDraw
+
+from tools import dedup, process
+
+PROJECT_DIR = path.dirname(path.dirname(path.realpath(__file__)))
+TESTDATA_DIR = path.join(PROJECT_DIR, 'testdata')
+LEFT_RIGHT_IMG = path.join(
+    TESTDATA_DIR, "left_right_Adjektive_Deutsch_deutschlernerblog.png")
+
+
+def read_bytes(filename: str) -> bytes:
+    with open(filename, 'rb') as f:
+        return f.read()
+
+
+class BKTreeTestCase(unittest.TestCase):
+    def test_search_matches_a_linear_scan(self):
+        rng = random.Random(0)
+        keys = [rng.getrandbits(64) for _ in range(500)]
+        tree: dedup.BKTree[int] = dedup.BKTree()
+        for i, key in enumerate(keys):
+            tree.add(key, i)
+        self.assertEqual(len(tree), 500)
+        for query in keys[:20] + [rng.getrandbits(64) for _ in range(20)]:
+            for max_distance in (0, 3, 24):
+                expected = sorted(
+                    i for i, key in enumerate(keys)
+                    if process.hamming_distance(query, key) <= max_distance)
+                self.assertEqual(
+                    sorted(i for _, i in tree.search(query, max_distance)),
+                    expected)
+
+    def test_search_sorts_by_distance(self):
+        tree: dedup.BKTree[str] = dedup.BKTree()
+        tree.add(0b111, 'far')
+        tree.add(0b001, 'near')
+        tree.add(0b000, 'exact')
+        self.assertEqual(tree.search(0b000, 3), [(0, 'exact'), (1, 'near'),
+                                                 (3, 'far')])
+
+
+class RemoveDuplicatesTestCase(unittest.TestCase):
+    def test_remove_duplicates(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            original = path.join(
+                tmp, 'wild_zahm_Adjektive_Deutsch_deutschlernerblog.png')
+            reupload = path.join(
+                tmp, 'wild_zahm_2_Adjektive_Deutsch_deutschlernerblog.png')
+            other = path.join(
+                tmp, 'gut_schlecht_Adjektive_Deutsch_deutschlernerblog.png')
+            shutil.copyfile(LEFT_RIGHT_IMG, original)
+            with Image.open(LEFT_RIGHT_IMG) as img:
+                img.save(reupload, compress_level=1)
+                img = img.convert('RGB')
+                ImageDraw.Draw(img).ellipse((40, 40, 600, 280), fill='blue')
+                img.save(other)
+            daps = [
+                process.DoubleAdjectivePic.from_original(fn)
+                for fn in (original, reupload, other)
+            ]
+            unique, duplicates = dedup.remove_duplicates(daps, max_workers=2)
+        self.assertEqual([dap.filename for dap in unique], [other, original])
+        self.assertEqual([(d.filename, o.filename) for d, o in duplicates],
+                         [(reupload, original)])
+
+    def test_keeps_the_original_when_the_reupload_comes_first(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            original = path.join(
+                tmp, 'wild_zahm_Adjektive_Deutsch_deutschlernerblog.png')
+            reupload = path.join(
+                tmp, 'wild_zahm_2_Adjektive_Deutsch_deutschlernerblog.png')
+            shutil.copyfile(LEFT_RIGHT_IMG, original)
+            shutil.copyfile(LEFT_RIGHT_IMG, reupload)
+            # Sorted by name, the reupload is scanned first.
+            daps = [
+                process.DoubleAdjectivePic.from_original(fn)
+                for fn in process.iter_source_files(tmp)
+            ]
+            self.assertEqual(daps[0].filename, reupload)
+            unique, duplicates = dedup.remove_duplicates(daps, max_workers=1)
+        self.assertEqual([dap.filename for dap in unique], [original])
+        self.assertEqual([(d.filename, o.filename) for d, o in duplicates],
+                         [(reupload, original)])
+
+    def test_remove_near_duplicates(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            original = path.join(
+                tmp, 'wild_zahm_Adjektive_Deutsch_deutschlernerblog.png')
+            retouched = path.join(
+                tmp, 'wild_zahm_2_Adjektive_Deutsch_deutschlernerblog.png')
+            shutil.copyfile(LEFT_RIGHT_IMG, original)
+            with Image.open(LEFT_RIGHT_IMG) as img:
+                img = img.copy()
+            for x in range(100, 110):
+                img.putpixel((x, 100), (255, 0, 0, 255))
+            img.save(retouched)
+            daps = [
+                process.DoubleAdjectivePic.from_original(fn)
+                for fn in (original, retouched)
+            ]
+            fingerprints = [
+                dedup.get_illustration_fingerprint(dap) for dap in daps
+            ]
+            unique, duplicates = dedup.remove_duplicates(daps, max_workers=1)
+        # The pixels differ, so only the dHash in the BK-tree matches.
+        self.assertNotEqual(fingerprints[0].digest, fingerprints[1].digest)
+        self.assertEqual([dap.filename for dap in unique], [original])
+        self.assertEqual([(d.filename, o.filename) for d, o in duplicates],
+                         [(retouched, original)])
+
+    def test_index_matches_hashes_within_max_distance(self):
+        dap = process.DoubleAdjectivePic.from_original(LEFT_RIGHT_IMG)
+        fingerprint = dedup.get_illustration_fingerprint(dap)
+        index = dedup.DuplicateIndex(max_distance=3)
+        index.add(dap, fingerprint)
+        near = fingerprint._replace(digest='other',
+                                    dhash=fingerprint.dhash ^ 0b10101)
+        far = fingerprint._replace(digest='other',
+                                   dhash=fingerprint.dhash ^ 0b1111)
+        self.assertIs(index.find(near), dap)
+        self.assertIsNone(index.find(far))
+
+    def test_export_fingerprinted_halves(self):
+        dap = process.DoubleAdjectivePic.from_original(LEFT_RIGHT_IMG)
+        with tempfile.TemporaryDirectory() as tmp:
+            fingerprint, halves = dedup.export_fingerprinted_halves(dap, tmp)
+            contents = [read_bytes(half.filename) for half in halves]
+            with tempfile.TemporaryDirectory() as other:
+                expected = [
+                    read_bytes(half.filename)
+                    for half in process.export_halves(dap, other)
+                ]
+        self.assertEqual(contents, expected)
+        self.assertEqual(fingerprint,
+                         dedup.get_illustration_fingerprint(dap))
+
+    def test_remove_duplicates_against_known_pictures(self):
+        dap = process.DoubleAdjectivePic.from_original(LEFT_RIGHT_IMG)
+        index = dedup.DuplicateIndex()
+        index.add(dap, dedup.get_illustration_fingerprint(dap))
+        with tempfile.TemporaryDirectory() as tmp:
+            reupload = path.join(
+                tmp, 'wild_zahm_Adjektive_Deutsch_deutschlernerblog.png')
+            shutil.copyfile(LEFT_RIGHT_IMG, reupload)
+            unique, duplicates = dedup.remove_duplicates(
+                [process.DoubleAdjectivePic.from_original(reupload)],
+                max_workers=1,
+                index=index)
+        self.assertEqual(unique, [])
+        self.assertEqual(duplicates[0][1], dap)
+        self.assertIn(LEFT_RIGHT_IMG, index.fingerprints)
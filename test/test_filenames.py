@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+from os import path
+import tempfile
+import unittest
+
+from tools import filenames
+
+
+class FilenameParserTestCase(unittest.TestCase):
+    def setUp(self):
+        self.parser = filenames.default_parser()
+
+    def test_dirty_filenames_from_the_default_config(self):
+        self.assertEqual(
+            self.parser.parse('neugierig_gleichgültig_unehrlich_' +
+                              'Adjektive_Deutsch_deutschlernerblog.png'),
+            ('neugierig', 'gleichgültig'))
+        self.assertEqual(
+            self.parser.parse(
+                'wild_zahm_2_Adjektive_Deutsch_deutschlernerblog.png'),
+            ('wild', 'zahm'))
+
+    def test_errors_name_the_file(self):
+        with self.assertRaises(filenames.FilenameError) as cm:
+            self.parser.parse('/images/a_b_c_Adjektive_Deutsch.png')
+        self.assertEqual(cm.exception.filename, 'a_b_c_Adjektive_Deutsch.png')
+        self.assertIn("['a', 'b', 'c']", cm.exception.reason)
+
+    def test_parses_are_memoized_by_basename(self):
+        parser = filenames.FilenameParser()
+        parser.parse('/a/wild_zahm_Adjektive.png')
+        parser.parse('/b/wild_zahm_Adjektive.png')
+        self.assertEqual(parser._parse_basename.cache_info().hits, 1)
+
+    def test_rules_from_a_config(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            config = path.join(tmp, 'rules.json')
+            with open(config, 'w') as f:
+                json.dump(
+                    {
+                        'overrides': {
+                            'gut schlecht böse': ['gut', 'böse']
+                        },
+                        'rules': [{
+                            'pattern': r'(\S+) oder (\S+)',
+                            'left': '{0}',
+                            'right': '{1}'
+                        }]
+                    }, f)
+            parser = filenames.FilenameParser.from_config(config)
+        self.assertEqual(parser.parse('gut_schlecht_böse_Adjektive.png'),
+                         ('gut', 'böse'))
+        self.assertEqual(parser.parse('alt-oder-jung-Adjektive.png'),
+                         ('alt', 'jung'))
+        self.assertEqual(parser.parse('nett_nicht_nett_Adjektive.png'),
+                         ('nett', 'nicht nett'))
+
+    def test_reuploads_sort_after_originals(self):
+        names = [
+            'wild_zahm_2_Adjektive.png', 'wild_zahm_Adjektive.png',
+            'gut_schlecht_Adjektive.png', 'logo.png'
+        ]
+        self.assertEqual(
+            sorted(names, key=filenames.originals_first_key), [
+                'gut_schlecht_Adjektive.png', 'logo.png',
+                'wild_zahm_Adjektive.png', 'wild_zahm_2_Adjektive.png'
+            ])
+        self.assertEqual(
+            self.parser.count_ignored_words(
+                '/images/wild_zahm_2_Adjektive.png'), 1)
+
+    def test_parse_all_collects_errors(self):
+        results = self.parser.parse_all([
+            'wild_zahm_Adjektive.png', 'logo.png', 'Adjektive.png',
+            'x_nicht_y_Adjektive.png'
+        ])
+        self.assertEqual(results.parsed, {
+            'wild_zahm_Adjektive.png': ('wild', 'zahm'),
+            'x_nicht_y_Adjektive.png': ('x', 'nicht y'),
+        })
+        self.assertEqual([e.filename for e in results.errors],
+                         ['logo.png', 'Adjektive.png'])
+
+
+class SourceFilesTestCase(unittest.TestCase):
+    def test_sources_are_sorted_by_name(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for name in ('wild_zahm_Adjektive.png',
+                         'wild_zahm_2_Adjektive.png',
+                         'gut_schlecht_Adjektive.png', 'notes.txt',
+                         '.hidden.png'):
+                with open(path.join(tmp, name), 'wb'):
+                    pass
+            sources = list(filenames.iter_source_files(tmp))
+        self.assertEqual([path.basename(s) for s in sources], [
+            'gut_schlecht_Adjektive.png', 'wild_zahm_2_Adjektive.png',
+            'wild_zahm_Adjektive.png'
+        ])
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+import os
+from os import path
+import tempfile
+import unittest
+from unittest import mock
+
+from tools import instrument, process
+
+
+def _square(x: int) -> int:
+    with instrument.timer('square'):
+        return x * x
+
+
+class InstrumentTestCase(unittest.TestCase):
+    def setUp(self):
+        for patcher in (mock.patch.dict(os.environ),
+                        mock.patch.multiple(instrument,
+                                            _profile_stage=None,
+                                            _profiler=None)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(instrument.reset)
+        self.addCleanup(instrument.disable)
+        instrument.reset()
+
+    def test_disabled_timers_record_nothing(self):
+        with instrument.timer('decode') as t:
+            t.add_bytes(10)
+        instrument.count('decode')
+        self.assertEqual(instrument.summary(), {})
+
+    def test_timers_and_counters(self):
+        instrument.enable()
+
+        @instrument.timed('decorated')
+        def decorated() -> int:
+            return 1
+
+        for n in (3, 4):
+            with instrument.timer('encode') as t:
+                t.add_bytes(n)
+        self.assertEqual(decorated(), 1)
+        instrument.count('reused', 2)
+        summary = instrument.summary()
+        self.assertEqual(summary['encode']['count'], 2)
+        self.assertEqual(summary['encode']['bytes'], 7)
+        self.assertGreaterEqual(summary['encode']['max_s'],
+                                summary['encode']['mean_s'])
+        self.assertEqual(summary['decorated']['count'], 1)
+        self.assertEqual(summary['reused']['count'], 2)
+        self.assertEqual(summary['reused']['total_s'], 0.0)
+
+    def test_worker_stats_get_merged(self):
+        instrument.enable()
+        results = list(
+            process.process_in_parallel(_square, [1, 2, 3],
+                                        max_workers=2,
+                                        shortcut=lambda x: 1
+                                        if x == 1 else None))
+        self.assertEqual([r.value for r in results], [1, 4, 9])
+        self.assertEqual(instrument.summary()['square']['count'], 2)
+
+    def test_dump_and_profile(self):
+        instrument.enable(profile_stage='encode')
+        with instrument.timer('encode'):
+            sum(range(1000))
+        with tempfile.TemporaryDirectory() as tmp:
+            output = path.join(tmp, 'stats.json')
+            instrument.dump(output)
+            with open(output) as f:
+                self.assertEqual(json.load(f)['encode']['count'], 1)
+            self.assertTrue(path.isfile(output + '.encode.prof'))
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+from os import path
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from tools import manifest, process
+
+PROJECT_DIR = path.dirname(path.dirname(path.realpath(__file__)))
+TESTDATA_DIR = path.join(PROJECT_DIR, 'testdata')
+LEFT_RIGHT_IMG = path.join(
+    TESTDATA_DIR, "left_right_Adjektive_Deutsch_deutschlernerblog.png")
+LEFT_IMG = path.join(TESTDATA_DIR, "left.png")
+
+
+class ManifestTestCase(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.source_dir = path.join(tmp.name, 'images')
+        os.mkdir(self.source_dir)
+        self.filename = path.join(tmp.name, 'manifest.json')
+        self.sources = []
+        for name in ('wild_zahm', 'gut_schlecht'):
+            source = path.join(
+                self.source_dir,
+                name + '_Adjektive_Deutsch_deutschlernerblog.png')
+            shutil.copyfile(LEFT_RIGHT_IMG, source)
+            self.sources.append(source)
+
+    def record_all(self, m: manifest.Manifest) -> None:
+        for i, source in enumerate(self.sources):
+            m.record(source, self.source_dir, ('l.png', 'r.png'), i)
+
+    def test_everything_is_new_at_first(self):
+        m = manifest.Manifest(self.filename)
+        diff = m.diff(self.sources, self.source_dir)
+        self.assertEqual(diff.new, self.sources)
+        self.assertEqual(diff.summary(),
+                         '2 new, 0 changed, 0 unchanged, 0 removed sources.')
+
+    def test_round_trip(self):
+        m = manifest.Manifest(self.filename)
+        self.record_all(m)
+        m.record(self.sources[1],
+                 self.source_dir, ('', ''),
+                 None,
+                 fingerprint=process.Fingerprint((640, 402), 'abc', 1 << 63),
+                 duplicate_of=self.sources[0])
+        m.save()
+        loaded = manifest.Manifest(self.filename)
+        self.assertEqual(loaded.entries, m.entries)
+        entry = loaded.get(self.sources[0], self.source_dir)
+        self.assertEqual(entry.adjectives, ('wild', 'zahm'))
+        self.assertEqual(entry.note_id, 0)
+        self.assertEqual(
+            loaded.get(self.sources[1], self.source_dir).duplicate_of,
+            'wild_zahm_Adjektive_Deutsch_deutschlernerblog.png')
+
+    def test_unchanged_sources_are_not_hashed(self):
+        m = manifest.Manifest(self.filename)
+        self.record_all(m)
+        m.save()
+        m = manifest.Manifest(self.filename)
+        with mock.patch.object(manifest, 'file_digest') as digest:
+            diff = m.diff(self.sources, self.source_dir)
+            digest.assert_not_called()
+        self.assertEqual(diff.unchanged, self.sources)
+
+    def test_changed_new_and_removed_sources(self):
+        m = manifest.Manifest(self.filename)
+        self.record_all(m)
+        shutil.copyfile(LEFT_IMG, self.sources[0])
+        os.remove(self.sources[1])
+        added = path.join(self.source_dir,
+                          'alt_jung_Adjektive_Deutsch_deutschlernerblog.png')
+        shutil.copyfile(LEFT_RIGHT_IMG, added)
+        diff = m.diff([self.sources[0], added], self.source_dir)
+        self.assertEqual(diff.changed, [self.sources[0]])
+        self.assertEqual(diff.new, [added])
+        self.assertEqual(diff.removed, [self.sources[1]])
+
+    def test_touched_but_identical_sources_are_unchanged(self):
+        m = manifest.Manifest(self.filename)
+        self.record_all(m)
+        os.utime(self.sources[0], ns=(0, 0))
+        diff = m.diff(self.sources, self.source_dir)
+        self.assertEqual(diff.unchanged, self.sources)
+
+    def test_changed_settings_rebuild_everything(self):
+        m = manifest.Manifest(self.filename, settings='png')
+        self.record_all(m)
+        m.save()
+        m = manifest.Manifest(self.filename, settings='webp')
+        self.assertEqual(
+            m.diff(self.sources, self.source_dir).changed, self.sources)
+
+    def test_settings_change_once_every_changed_source_is_recorded(self):
+        m = manifest.Manifest(self.filename, settings='png')
+        self.record_all(m)
+        m.save()
+        m = manifest.Manifest(self.filename, settings='webp')
+        m.diff(self.sources, self.source_dir)
+        # The second source failed to rebuild.
+        m.record(self.sources[0], self.source_dir, ('l.webp', 'r.webp'), 0)
+        m.save()
+        m = manifest.Manifest(self.filename, settings='webp')
+        diff = m.diff(self.sources, self.source_dir)
+        self.assertEqual(diff.changed, self.sources)
+        self.record_all(m)
+        m.save()
+        m = manifest.Manifest(self.filename, settings='webp')
+        self.assertEqual(
+            m.diff(self.sources, self.source_dir).unchanged, self.sources)
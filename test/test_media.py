@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+from os import path
+import tempfile
+import unittest
+
+from tools import media
+from tools.cache import DerivedImageCache
+
+PROJECT_DIR = path.dirname(path.dirname(path.realpath(__file__)))
+TESTDATA_DIR = path.join(PROJECT_DIR, 'testdata')
+LEFT_IMG = path.join(TESTDATA_DIR, "left.png")
+RIGHT_IMG = path.join(TESTDATA_DIR, "right.png")
+
+
+class MediaStagerTestCase(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.media_dir = tmp.name
+
+    def test_names_media_after_their_content(self):
+        stager = media.MediaStager(self.media_dir)
+        left = stager.stage(LEFT_IMG, prefix='nicht nett')
+        self.assertRegex(left, r'^nicht_nett_[0-9a-f]{16}\.png$')
+        self.assertEqual(stager.stage(LEFT_IMG, prefix='nicht nett'), left)
+        self.assertNotEqual(stager.stage(RIGHT_IMG, prefix='nicht nett'),
+                            left)
+
+    def test_flush_copies_new_media_once(self):
+        stager = media.MediaStager(self.media_dir)
+        left = stager.stage(LEFT_IMG, prefix='left')
+        stager.stage(LEFT_IMG, prefix='left')
+        right = stager.stage(RIGHT_IMG, prefix='right')
+        self.assertEqual(os.listdir(self.media_dir), [])
+        self.assertEqual(stager.flush(), [left, right])
+        self.assertEqual(sorted(os.listdir(self.media_dir)),
+                         sorted([left, right]))
+        self.assertEqual(stager.flush(), [])
+
+    def test_reuses_media_from_earlier_runs(self):
+        first = media.MediaStager(self.media_dir)
+        name = first.stage(LEFT_IMG, prefix='left')
+        first.flush()
+        second = media.MediaStager(self.media_dir)
+        self.assertEqual(second.stage(LEFT_IMG, prefix='other'), name)
+        self.assertEqual(second.flush(), [])
+        self.assertEqual(second.reused, 1)
+
+    def test_flush_survives_sources_evicted_from_the_cache(self):
+        with tempfile.TemporaryDirectory() as cache_dir, \
+                media.MediaStager(self.media_dir) as stager:
+            # The cache only has room for one of the pictures.
+            cache = DerivedImageCache(cache_dir,
+                                      max_bytes=max(
+                                          path.getsize(LEFT_IMG),
+                                          path.getsize(RIGHT_IMG)))
+            left_entry = cache.put('left', LEFT_IMG)
+            left = stager.stage(left_entry, prefix='left')
+            right = stager.stage(cache.put('right', RIGHT_IMG),
+                                 prefix='right')
+            self.assertFalse(path.exists(left_entry))
+            self.assertEqual(stager.flush(), [left, right])
+        with open(LEFT_IMG, 'rb') as expected, open(
+                path.join(self.media_dir, left), 'rb') as actual:
+            self.assertEqual(actual.read(), expected.read())
+
+    def test_close_discards_what_was_not_flushed(self):
+        with media.MediaStager(self.media_dir) as stager:
+            stager.stage(LEFT_IMG, prefix='left')
+            staging_dir = stager._staging.name
+            self.assertEqual(len(os.listdir(staging_dir)), 1)
+        self.assertFalse(path.exists(staging_dir))
+        self.assertEqual(os.listdir(self.media_dir), [])
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from os import path
+import tempfile
+import unittest
+from unittest import mock
+
+from tools import note_index
+
+from test import fake_anki
+from test.fake_anki import FakeCollection
+
+
+class NormalizeTextTestCase(unittest.TestCase):
+    def test_normalize_text(self):
+        self.assertEqual(
+            note_index.normalize_text(' <div>gleich\u00adgültig</div><br>'),
+            'gleichgültig')
+
+
+class NoteIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.filename = path.join(self.tmp.name, 'index.sqlite')
+        self.col = FakeCollection()
+        self.col.add(1, fake_anki.BASIC, ['<b>wild</b>', 'wild'], mod=10)
+        self.col.add(2, fake_anki.BASIC, ['zahm', 'tame'], ['Zahm'], mod=10)
+        self.col.add(3,
+                     fake_anki.IMAGE_OCCLUSION, ['', ''], ['wild', 'zahm'],
+                     mod=10)
+        self.col.add(4,
+                     fake_anki.CLOZE, ['<img src="wild_Adjektive.png">'],
+                     ['wild', 'zahm'],
+                     mod=10)
+        self.col.add(5, fake_anki.BASIC, ['sentence'], ['wild'], mod=10)
+
+    def open_index(self):
+        index = note_index.NoteIndex(self.filename)
+        self.addCleanup(index.close)
+        return index
+
+    def test_find(self):
+        index = self.open_index()
+        self.assertEqual(index.refresh(self.col), (5, 0))
+        self.assertEqual(index.find('wild'), [1, 3, 4, 5])
+        self.assertEqual(index.find('ZAHM'), [2, 3, 4])
+
+    def test_get_related_notes(self):
+        index = self.open_index()
+        index.refresh(self.col)
+        self.assertEqual(index.get_related_notes('wild'), ([3], [1, 4]))
+
+    def test_get_related_double_notes(self):
+        index = self.open_index()
+        index.refresh(self.col)
+        self.assertEqual(index.get_related_double_notes('wild', 'zahm'),
+                         ([3], [4]))
+
+    def test_refresh_only_reparses_changed_notes(self):
+        self.open_index().refresh(self.col)
+        self.col.db.execute(
+            "update notes set flds = 'wildnis', mod = 11 where id = 1")
+        self.col.db.execute("delete from notes where id = 5")
+        index = self.open_index()
+        with mock.patch.object(note_index,
+                               'normalize_text',
+                               wraps=note_index.normalize_text) as normalize:
+            self.assertEqual(index.refresh(self.col), (1, 1))
+            self.assertEqual(normalize.call_count, 1)
+        self.assertEqual(index.find('wild'), [3, 4])
+        self.assertEqual(index.find('wildnis'), [1])
+        self.assertEqual(index.refresh(self.col), (0, 0))
@@ -2,12 +2,14 @@
 # -*- coding: utf-8 -*-
 from functools import partial
 from os import path
+import tempfile
 from typing import Union
 import unittest
+from unittest import mock
 
 from tools import process
 
-from PIL import Image, ImageChops
+from PIL import Image, ImageDraw
 
 PROJECT_DIR = path.dirname(path.dirname(path.realpath(__file__)))
 TESTDATA_DIR = path.join(PROJECT_DIR, 'testdata')
@@ -19,13 +21,18 @@ LEFT_NO_SUBS_IMG = path.join(TESTDATA_DIR, "left_no_subs.png")
 RIGHT_IMG = path.join(TESTDATA_DIR, "right.png")
 
 
-def assertTwoImagesEqual(self, a: Image, b: Image, msg=None):
+def assertTwoImagesEqual(self, a: Image.Image, b: Image.Image, msg=None):
     if a.size != b.size:
         raise self.failureException(
             "The image sizes differ: {} vs {}.\n{}".format(
                 a.size, b.size, msg))
-    diff = ImageChops.difference(a, b)
-    if diff.getbbox():
+    if a.mode != b.mode:
+        raise self.failureException(
+            "The image modes differ: {} vs {}.\n{}".format(
+                a.mode, b.mode, msg))
+    # Compares every band, as difference().getbbox() only looks at the
+    # alpha band of RGBA images.
+    if a.tobytes() != b.tobytes():
         raise self.failureException(
             "The picture images differ.\n{}".format(msg))
 
@@ -89,6 +96,44 @@ class SubtitleRemovalTestCase(unittest.TestCase):
                                  left_no_subs_img)
 
 
+class SubtitleDetectionTestCase(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.dict(process._detected_subs_cuts, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_detects_the_known_cut(self):
+        with Image.open(LEFT_RIGHT_IMG) as img:
+            self.assertEqual(process.detect_subs_cut(img), 329)
+
+    def test_detects_the_cut_at_other_resolutions(self):
+        with Image.open(LEFT_RIGHT_IMG) as img:
+            for width, height in [(500, 314), (960, 603), (1280, 804)]:
+                cut = process.detect_subs_cut(img.resize((width, height)))
+                self.assertAlmostEqual(cut / height, 329 / 402, places=2)
+
+    def test_rejects_pictures_without_subs(self):
+        with Image.open(LEFT_NO_SUBS_IMG) as img, \
+                self.assertRaises(Exception):
+            process.detect_subs_cut(img)
+
+    def test_memoizes_the_cut_per_layout(self):
+        with Image.open(LEFT_IMG) as img:
+            scaled = img.resize((240, 301))
+        detect = mock.Mock(
+            side_effect=lambda: process.detect_subs_cut(scaled))
+        box = process.get_subs_box((240, 301), detect, 'layout')
+        self.assertEqual(
+            process.get_subs_box((240, 301), detect, 'layout'), box)
+        self.assertEqual(detect.call_count, 1)
+        self.assertEqual(box, (0, 0, 240, process.detect_subs_cut(scaled)))
+
+    def test_removes_subs_of_an_unknown_layout(self):
+        dap = process.DoubleAdjectivePic.from_original(LEFT_RIGHT_IMG)
+        small = dap.split()[0].resize(0.75)
+        self.assertEqual(small.remove_subs().get_size(), (240, 247))
+
+
 class SplitTestCase(unittest.TestCase):
     def test_split_double_adjective_img(self):
         with Image.open(LEFT_IMG) as left_img, \
@@ -107,3 +152,296 @@ class SplitTestCase(unittest.TestCase):
                                                         adjective='right',
                                                         subs=True)
         self.assertEqual(dap.split(), (expected_left_pic, expected_right_pic))
+
+
+class InMemoryPipelineTestCase(unittest.TestCase):
+    def test_transformations_stay_in_memory(self):
+        dap = process.DoubleAdjectivePic.from_original(LEFT_RIGHT_IMG)
+        left, right = [sap.remove_subs() for sap in dap.split()]
+        self.assertIsNone(left.filename)
+        self.assertIsNone(right.filename)
+        with self.assertRaises(Exception):
+            left.get_filename()
+        self.assertEqual(left.get_size(), (320, 329))
+
+    def test_save_writes_the_final_picture(self):
+        dap = process.DoubleAdjectivePic.from_original(LEFT_RIGHT_IMG)
+        left = dap.split()[0].remove_subs()
+        with tempfile.TemporaryDirectory() as out_dir:
+            out = left.save(path.join(out_dir, 'left.png'))
+            self.assertEqual(left.get_filename(), out)
+            with Image.open(out) as saved, \
+                    Image.open(LEFT_NO_SUBS_IMG) as expected:
+                assertTwoImagesEqual(self, saved, expected)
+
+
+class ImagePlanTestCase(unittest.TestCase):
+    def test_composed_plan_matches_eager_pipeline(self):
+        dap = process.DoubleAdjectivePic.from_original(LEFT_RIGHT_IMG)
+        left = dap.split()[0].remove_subs().resize(0.5)
+        self.assertEqual(left.get_size(), (160, 164))
+        with Image.open(LEFT_NO_SUBS_IMG) as expected, \
+                left.to_image() as actual:
+            # Halving averages 2x2 blocks, dropping the odd last row.
+            assertTwoImagesEqual(self, actual,
+                                 expected.reduce(2, (0, 0, 320, 328)))
+
+    def test_crop_after_resize_maps_to_source_coordinates(self):
+        plan = process.ImagePlan(LEFT_RIGHT_IMG).resize((320, 201))
+        plan = plan.crop((160, 0, 320, 100))
+        self.assertEqual(plan.get_box(), (320, 0, 640, 200))
+        self.assertEqual(plan.get_size(), (160, 100))
+
+    def test_reduce_factor(self):
+        plan = process.ImagePlan(LEFT_RIGHT_IMG, (0, 0, 640, 659))
+        self.assertIsNone(plan.get_reduce_factor())
+        self.assertEqual(plan.resize((320, 329)).get_reduce_factor(), 2)
+        self.assertEqual(plan.resize((160, 164)).get_reduce_factor(), 4)
+        self.assertIsNone(plan.resize((300, 300)).get_reduce_factor())
+        plan = process.ImagePlan(LEFT_RIGHT_IMG, (0.5, 0, 640.5, 658))
+        self.assertIsNone(plan.resize((320, 329)).get_reduce_factor())
+
+    def test_halving_reduces_the_source_directly(self):
+        img = Image.effect_noise((1280, 803), 64).convert('RGBA')
+        sap = process.SingleAdjectivePic.from_image(img, 'adj', subs=False)
+        right = sap.plan.crop((640, 0, 1280, 659))
+        half = process.SingleAdjectivePic(None, 'adj', False,
+                                          plan=right).resize(0.5)
+        with mock.patch.object(Image.Image, 'resize') as resize:
+            actual = half.to_image()
+            resize.assert_not_called()
+        self.assertEqual(actual.size, (320, 329))
+        assertTwoImagesEqual(self, actual,
+                             img.crop((640, 0, 1280, 658)).reduce(2))
+
+    def test_halving_with_a_chosen_filter(self):
+        img = Image.effect_noise((640, 402), 64).convert('RGBA')
+        sap = process.SingleAdjectivePic.from_image(img, 'adj', subs=False)
+        half = sap.resize(0.5, resample=Image.LANCZOS)
+        assertTwoImagesEqual(self, half.to_image(),
+                             img.resize((320, 201), Image.LANCZOS))
+        self.assertNotEqual(half.plan.describe(),
+                            sap.resize(0.5).plan.describe())
+
+    def test_sizes_do_not_decode_the_source(self):
+        dap = process.DoubleAdjectivePic.from_original(LEFT_RIGHT_IMG)
+        dap.get_size()
+        with mock.patch.object(process.Image, 'open') as image_open:
+            left = dap.split()[0].remove_subs().resize(0.5)
+            self.assertEqual(left.get_size(), (160, 164))
+            image_open.assert_not_called()
+
+    def test_save_pics_decodes_the_source_once(self):
+        dap = process.DoubleAdjectivePic.from_original(LEFT_RIGHT_IMG)
+        left, right = dap.remove_subs().split()
+        with tempfile.TemporaryDirectory() as out_dir, \
+                mock.patch.object(process.Image, 'open',
+                                  wraps=Image.open) as image_open:
+            process.save_pics([(left, path.join(out_dir, 'l.png')),
+                               (right, path.join(out_dir, 'r.png'))])
+            self.assertEqual(image_open.call_count, 1)
+            with Image.open(left.get_filename()) as saved, \
+                    Image.open(LEFT_NO_SUBS_IMG) as expected:
+                assertTwoImagesEqual(self, saved, expected)
+
+
+def _reciprocal(x: int) -> float:
+    return 1 / x
+
+
+class BatchTestCase(unittest.TestCase):
+    def test_process_in_parallel_keeps_order_and_reports_errors(self):
+        results = list(
+            process.process_in_parallel(_reciprocal, [1, 2, 0, 4] * 5,
+                                        max_workers=2))
+        self.assertEqual([r.position for r in results], list(range(20)))
+        self.assertEqual(results[1].value, 0.5)
+        self.assertIsNone(results[1].error)
+        self.assertIsNone(results[2].value)
+        self.assertIn('ZeroDivisionError', results[2].error)
+        self.assertEqual(results[7].value, 0.25)
+
+    def test_process_in_parallel_uses_the_shortcut(self):
+        results = list(
+            process.process_in_parallel(
+                _reciprocal, [0, 2],
+                max_workers=1,
+                shortcut=lambda x: 'cached' if x == 0 else None))
+        self.assertEqual([r.value for r in results], ['cached', 0.5])
+
+    def test_export_halves(self):
+        dap = process.DoubleAdjectivePic.from_original(LEFT_RIGHT_IMG)
+        with tempfile.TemporaryDirectory() as out_dir:
+            result, = process.process_in_parallel(
+                partial(process.export_halves, out_dir=out_dir), [dap])
+            self.assertIsNone(result.error)
+            left_pic, right_pic = result.value
+            self.assertEqual(path.dirname(left_pic.filename), out_dir)
+            self.assertEqual(left_pic.bytes, path.getsize(left_pic.filename))
+            with Image.open(left_pic.filename) as left, \
+                    Image.open(LEFT_NO_SUBS_IMG) as expected:
+                assertTwoImagesEqual(self, left, expected)
+            self.assertEqual(process.get_picture_size(right_pic.filename),
+                             (320, 329))
+
+    def test_export_halves_fits_max_dimension(self):
+        dap = process.DoubleAdjectivePic.from_original(LEFT_RIGHT_IMG)
+        with tempfile.TemporaryDirectory() as out_dir:
+            left, right = process.export_halves(dap,
+                                                out_dir,
+                                                max_dimension=200)
+            self.assertEqual(process.get_picture_size(left.filename),
+                             (195, 200))
+
+
+class EncodeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.img = Image.open(LEFT_NO_SUBS_IMG)
+        self.addCleanup(self.img.close)
+
+    def test_compact_png_is_smaller_and_looks_the_same(self):
+        filename = path.join(self.tmp.name, 'pic.png')
+        pic = process.save_image(self.img,
+                                 filename,
+                                 process.COMPACT_ENCODE_OPTIONS,
+                                 measure_savings=True)
+        self.assertEqual(pic.bytes, path.getsize(filename))
+        self.assertLess(pic.bytes, pic.baseline_bytes)
+        with Image.open(filename) as saved:
+            self.assertEqual(
+                saved.convert(self.img.mode).tobytes(), self.img.tobytes())
+
+    def test_palette_only_when_lossless_unless_quantizing(self):
+        self.assertIsNone(process.to_palette(self.img, 16))
+        self.assertEqual(process.to_palette(self.img, 64).mode, 'P')
+        filename = path.join(self.tmp.name, 'pic.png')
+        process.save_image(self.img, filename,
+                           process.EncodeOptions(colors=16))
+        with Image.open(filename) as saved:
+            self.assertEqual(saved.mode, 'RGBA')
+        process.save_image(self.img, filename,
+                           process.EncodeOptions(colors=16, quantize=True))
+        with Image.open(filename) as saved:
+            self.assertEqual(saved.mode, 'P')
+
+    def test_savings_are_measured_only_on_request(self):
+        pic = process.save_image(self.img, path.join(self.tmp.name, 'a.png'))
+        self.assertIsNone(pic.baseline_bytes)
+
+    def test_formats(self):
+        for fmt, ext in [('webp', '.webp'), ('jpeg', '.jpg')]:
+            options = process.EncodeOptions(format=fmt)
+            self.assertEqual(options.get_extension(), ext)
+            filename = path.join(self.tmp.name, 'pic' + ext)
+            process.save_image(self.img, filename, options)
+            with Image.open(filename) as saved:
+                self.assertEqual(saved.format, fmt.upper())
+                self.assertEqual(saved.size, self.img.size)
+
+    def test_report(self):
+        report = process.EncodeReport()
+        report.add(process.EncodedPic('a.png', 60, 100))
+        report.add(process.EncodedPic('b.png', 50))
+        self.assertEqual(
+            report.summary(), 'Encoded 2 pictures into 110 bytes.\n' +
+            'Saved 40 bytes (40%) over default PNGs on 1 pictures.')
+
+
+class ScanTestCase(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        for name in ('wild_zahm_Adjektive_Deutsch_deutschlernerblog.png',
+                     'gut_schlecht_Adjektive_Deutsch_deutschlernerblog.png',
+                     'notes.txt', '.hidden.png'):
+            with open(path.join(self.dir, name), 'wb'):
+                pass
+
+    def test_scan_streams_pics(self):
+        pics = process.scan_source_pics(self.dir)
+        self.assertEqual(
+            sorted((p.left_adjective, p.right_adjective) for p in pics),
+            [('gut', 'schlecht'), ('wild', 'zahm')])
+
+    def test_scan_reports_all_bad_names_before_any_pic(self):
+        for name in ('logo.png', 'Adjektive_Deutsch.png'):
+            with open(path.join(self.dir, name), 'wb'):
+                pass
+        with mock.patch.object(process.DoubleAdjectivePic,
+                               'from_original') as from_original, \
+                self.assertRaises(Exception) as cm:
+            process.scan_source_pics(self.dir)
+        from_original.assert_not_called()
+        message = str(cm.exception)
+        self.assertIn('Found 2 filenames', message)
+        self.assertIn('logo.png', message)
+        self.assertIn('Adjektive_Deutsch.png', message)
+
+
+class FingerprintTestCase(unittest.TestCase):
+    def test_pics_with_different_pixels_differ(self):
+        left = process.SingleAdjectivePic(LEFT_IMG, 'adj', subs=True)
+        right = process.SingleAdjectivePic(RIGHT_IMG, 'adj', subs=True)
+        self.assertNotEqual(left, right)
+
+    def test_pics_with_different_metadata_differ(self):
+        left = process.SingleAdjectivePic(LEFT_IMG, 'left', subs=True)
+        other = process.SingleAdjectivePic(LEFT_IMG, 'other', subs=True)
+        self.assertNotEqual(left, other)
+
+    def test_equality_short_circuits_on_the_file_digest(self):
+        left = process.SingleAdjectivePic(LEFT_IMG, 'left', subs=True)
+        same = process.SingleAdjectivePic(LEFT_IMG, 'left', subs=True)
+        with mock.patch.object(process.ImagePlan, 'render') as render:
+            self.assertEqual(left, same)
+            render.assert_not_called()
+
+    def test_equality_compares_pixels_of_different_encodings(self):
+        left = process.SingleAdjectivePic(LEFT_IMG, 'left', subs=True)
+        with tempfile.TemporaryDirectory() as tmp:
+            reencoded = path.join(tmp, 'left.png')
+            with Image.open(LEFT_IMG) as img:
+                img.save(reencoded, compress_level=1)
+            self.assertEqual(
+                left, process.SingleAdjectivePic(reencoded, 'left',
+                                                 subs=True))
+
+    def test_palette_pictures_with_different_palettes_differ(self):
+        red = Image.new('P', (8, 8), 0)
+        red.putpalette([255, 0, 0])
+        blue = Image.new('P', (8, 8), 0)
+        blue.putpalette([0, 0, 255])
+        self.assertEqual(red.tobytes(), blue.tobytes())
+        self.assertNotEqual(
+            process.compute_fingerprint(red).digest,
+            process.compute_fingerprint(blue).digest)
+
+    def test_pics_are_hashable(self):
+        dap = process.DoubleAdjectivePic.from_original(LEFT_RIGHT_IMG)
+        pics = {dap.split()[0], dap.split()[0],
+                process.SingleAdjectivePic(LEFT_IMG, 'left', subs=True)}
+        self.assertEqual(len(pics), 1)
+
+    def test_fingerprint_is_cached(self):
+        left = process.SingleAdjectivePic(LEFT_IMG, 'left', subs=True)
+        with mock.patch.object(left.plan, 'render',
+                               wraps=left.plan.render) as render:
+            self.assertEqual(left.get_fingerprint(), left.get_fingerprint())
+            self.assertEqual(render.call_count, 1)
+
+    def test_dhash_finds_near_duplicates(self):
+        circle = Image.new('RGB', (320, 320), 'white')
+        ImageDraw.Draw(circle).ellipse((40, 40, 200, 200), fill='red')
+        square = Image.new('RGB', (320, 320), 'white')
+        ImageDraw.Draw(square).rectangle((120, 120, 300, 300), fill='blue')
+        circle_hash = process.compute_dhash(circle)
+        self.assertLessEqual(
+            process.hamming_distance(
+                circle_hash, process.compute_dhash(circle.resize(
+                    (160, 160)))), 4)
+        self.assertGreater(
+            process.hamming_distance(circle_hash,
+                                     process.compute_dhash(square)), 10)
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+from os import path
+import tempfile
+import time
+import unittest
+
+from tools import scrape
+
+from test.fixture_server import PAGES_DIR, FixtureServer
+
+IMAGE_NAMES = [
+    'wild_zahm_Adjektive_Deutsch_deutschlernerblog.png',
+    'nett_nicht_nett_Adjektive_Deutsch_deutschlernerblog.png',
+    'wertvoll-wertlos-Adjektive-Bilder-Gegensatzpaare-deutschlernerblog.png',
+]
+
+
+class ExtractFilenameTestCase(unittest.TestCase):
+    def test_extract_filename_from_image_url(self):
+        self.assertEqual(
+            scrape.extract_filename_from_image_url(
+                'https://deutschlernerblog.de/wp-content/uploads/2017/07/' +
+                'wild_zahm_Adjektive_Deutsch_deutschlernerblog.png'),
+            'wild_zahm_Adjektive_Deutsch_deutschlernerblog.png')
+
+
+class ParseGalleryPageTestCase(unittest.TestCase):
+    PAGES = [
+        path.join(PAGES_DIR, 'page1.html'),
+        path.join(PAGES_DIR, 'page2.html'),
+    ]
+    SNIPPETS = [
+        '<p>weiter <a href="/2">Teil 2</a></p>',
+        '<p>weiter </p><p><a href="/2">Teil 2</a></p>',
+        '<p>weiter <strong>Teil 2</strong></p>',
+        '<p>Weiter geht es <a href="/x">hier</a></p>',
+        '<img src="a.png" width="640" height="402"/>' +
+        '<IMG SRC="b.png" WIDTH="640" HEIGHT="402">' +
+        '<img src="c.png" width="640" height="402" data-lazy-src="d.png">' +
+        '<img src="e.png" width="320" height="402">',
+    ]
+
+    def test_stream_and_tree_parsers_agree(self):
+        pages = [open(p, encoding='utf-8').read() for p in self.PAGES]
+        for page in pages + self.SNIPPETS:
+            self.assertEqual(scrape.parse_gallery_page_with_stream(page),
+                             scrape.parse_gallery_page_with_tree(page))
+
+    def test_stream_parser(self):
+        with open(self.PAGES[0], encoding='utf-8') as f:
+            srcs, next_link = scrape.parse_gallery_page_with_stream(f.read())
+        self.assertEqual(len(srcs), 2)
+        self.assertEqual(next_link, '{base}/page2.html')
+
+
+class ScrapeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = FixtureServer()
+        self.server.__enter__()
+        self.addCleanup(self.server.__exit__, None, None, None)
+        self.session = scrape.make_session(backoff=0)
+        self.addCleanup(self.session.close)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def image_urls(self):
+        return [self.server.base + '/images/' + fn for fn in IMAGE_NAMES]
+
+    def test_iter_image_sources_follows_weiter(self):
+        self.assertEqual(
+            list(
+                scrape.iter_image_sources(self.server.url('page1.html'),
+                                          self.session)), self.image_urls())
+
+    def test_iter_image_sources_yields_before_fetching_the_next_page(self):
+        srcs = scrape.iter_image_sources(self.server.url('page1.html'),
+                                         self.session)
+        self.assertEqual(next(srcs), self.image_urls()[0])
+        self.assertEqual(self.server.count('GET', '/page2.html'), 0)
+        self.assertEqual(list(srcs), self.image_urls()[1:])
+
+    def test_download_images_from_a_pipelined_scrape(self):
+        srcs = scrape.prefetch(
+            scrape.iter_image_sources(self.server.url('page1.html'),
+                                      self.session))
+        report = scrape.download_images(srcs,
+                                        self.tmp.name,
+                                        session=self.session)
+        self.assertEqual(report.downloaded, self.image_urls())
+
+    def test_download_images(self):
+        report = scrape.download_images(self.image_urls(),
+                                        self.tmp.name,
+                                        session=self.session)
+        self.assertEqual(report.downloaded, self.image_urls())
+        self.assertEqual(report.failed, [])
+        self.assertEqual(
+            sorted(os.listdir(self.tmp.name)),
+            sorted(IMAGE_NAMES + [scrape.ETAGS_FILENAME]))
+        with open(path.join(self.tmp.name, IMAGE_NAMES[0]), 'rb') as f:
+            self.assertEqual(f.read(), self.server.image)
+
+    def test_download_images_skips_up_to_date_images(self):
+        scrape.download_images(self.image_urls(),
+                               self.tmp.name,
+                               session=self.session)
+        report = scrape.download_images(self.image_urls(),
+                                        self.tmp.name,
+                                        session=self.session)
+        self.assertEqual(report.downloaded, [])
+        self.assertEqual(report.skipped, self.image_urls())
+        self.assertEqual(self.server.count('GET', '/images/'), 6)
+
+    def test_download_images_resumes_without_etags(self):
+        scrape.download_images(self.image_urls()[:1],
+                               self.tmp.name,
+                               session=self.session)
+        os.remove(path.join(self.tmp.name, scrape.ETAGS_FILENAME))
+        report = scrape.download_images(self.image_urls(),
+                                        self.tmp.name,
+                                        session=self.session)
+        self.assertEqual(report.skipped, self.image_urls()[:1])
+        self.assertEqual(report.downloaded, self.image_urls()[1:])
+        self.assertEqual(self.server.count('HEAD'), 1)
+
+    def test_download_images_retries(self):
+        self.server.failures['/images/' + IMAGE_NAMES[0]] = 2
+        report = scrape.download_images(self.image_urls(),
+                                        self.tmp.name,
+                                        session=self.session)
+        self.assertEqual(report.downloaded, self.image_urls())
+
+    def test_download_images_reports_failures(self):
+        self.server.failures['/images/' + IMAGE_NAMES[0]] = 10
+        report = scrape.download_images(self.image_urls(),
+                                        self.tmp.name,
+                                        session=self.session)
+        self.assertEqual(report.downloaded, self.image_urls()[1:])
+        self.assertEqual([url for url, _ in report.failed],
+                         self.image_urls()[:1])
+
+
+class PrefetchTestCase(unittest.TestCase):
+    def test_prefetch_keeps_order(self):
+        self.assertEqual(list(scrape.prefetch(range(100), maxsize=3)),
+                         list(range(100)))
+
+    def test_prefetch_reraises_errors(self):
+        def items():
+            yield 1
+            raise ValueError('boom')
+
+        it = scrape.prefetch(items())
+        self.assertEqual(next(it), 1)
+        with self.assertRaises(ValueError):
+            next(it)
+
+    def test_prefetch_is_bounded(self):
+        produced = []
+
+        def items():
+            for i in range(100):
+                produced.append(i)
+                yield i
+
+        it = scrape.prefetch(items(), maxsize=2)
+        self.assertEqual(next(it), 0)
+        time.sleep(0.1)
+        self.assertLessEqual(len(produced), 4)
+        it.close()
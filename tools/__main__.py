@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""The command line interface to tools.
+
+Run
+
+    python -m tools <command> --help
+
+for the commands and their options. Each command imports what it needs when
+it runs, so that commands that only look at filenames, like `list` and
+`validate`, never load Anki, requests, bs4, Pillow or numpy and return
+almost at once. `bench.startup` checks this against an import time budget.
+"""
+import argparse
+from functools import partial
+import os
+from os import path
+import sys
+from typing import List, Optional
+
+DEFAULT_IMAGE_DIR = 'images'
+
+
+def print_name_errors(errors) -> None:
+    for error in sorted(errors, key=lambda e: e.filename):
+        print('{}: {}'.format(path.basename(error.filename), error.reason),
+              file=sys.stderr)
+
+
+def list_pictures(args: argparse.Namespace) -> int:
+    """Prints each picture's filename and adjectives, tab separated."""
+    from tools import filenames
+
+    results = filenames.default_parser().parse_all(
+        sorted(filenames.iter_source_files(args.image_dir)))
+    for filename, (left, right) in results.parsed.items():
+        print('\t'.join((path.basename(filename), left, right)))
+    print_name_errors(results.errors)
+    return 1 if results.errors else 0
+
+
+def validate_names(args: argparse.Namespace) -> int:
+    """Checks that the adjectives can be parsed out of every filename."""
+    from tools import filenames
+
+    results = filenames.default_parser().parse_all(
+        filenames.iter_source_files(args.image_dir))
+    print_name_errors(results.errors)
+    print('Found {} pictures, {} with bad names.'.format(
+        len(results.parsed) + len(results.errors), len(results.errors)))
+    return 1 if results.errors else 0
+
+
+def scrape_pictures(args: argparse.Namespace) -> int:
+    from tools import scrape
+
+    scrape.main()
+    return 0
+
+
+def process_pictures(args: argparse.Namespace) -> int:
+    """Writes the halves of every picture, as they go on cards."""
+    from tools.process import (EncodeOptions, EncodeReport, export_halves,
+                               process_in_parallel, scan_source_pics)
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    report = EncodeReport()
+    failed = 0
+    for result in process_in_parallel(
+            partial(export_halves,
+                    out_dir=args.out_dir,
+                    max_dimension=args.max_dimension,
+                    options=EncodeOptions(format=args.format)),
+            scan_source_pics(args.image_dir), args.workers):
+        if result.error:
+            print("Could not process " + result.item.get_filename() + ":\n" +
+                  result.error)
+            failed += 1
+            continue
+        for half in result.value:
+            report.add(half)
+    print(report.summary())
+    return 1 if failed else 0
+
+
+def import_notes(args: argparse.Namespace) -> int:
+    """Adds or updates the notes of new or changed pictures, like fill200."""
+    from gists import fill200
+
+    fill200.run(dry_run=args.dry_run)
+    return 0
+
+
+def audit_collection(args: argparse.Namespace) -> int:
+    """Reports the notes the collection has for each pair of adjectives.
+
+    Notes are looked up in the persistent `tools.note_index`, which only
+    reparses the notes that changed since the last audit.
+    """
+    from tools import anki, filenames, note_index
+
+    results = filenames.default_parser().parse_all(
+        filenames.iter_source_files(args.image_dir))
+    print_name_errors(results.errors)
+    pairs = sorted(set(results.parsed.values()))
+    collection = args.collection or anki.MY_COLLECTION
+    index = note_index.NoteIndex(
+        args.index or note_index.default_index_path(collection))
+    try:
+        col = anki.open_collection(collection)
+        try:
+            reindexed, removed = index.refresh(col)
+        finally:
+            col.close()
+        print('Reindexed {} notes, removed {}.'.format(reindexed, removed))
+        related = {pair: index.get_related_double_notes(*pair)
+                   for pair in pairs}
+    finally:
+        index.close()
+    missing = 0
+    for pair in pairs:
+        image_occlusion_notes, normal_notes = related[pair]
+        if not image_occlusion_notes and not normal_notes:
+            missing += 1
+        print('{} / {}: {} image occlusion, {} other notes'.format(
+            pair[0], pair[1], len(image_occlusion_notes), len(normal_notes)))
+    print('{} of {} pairs have no notes.'.format(missing, len(pairs)))
+    return 0
+
+
+def build_apkg(args: argparse.Namespace) -> int:
+    from tools import apkg
+
+    apkg.build(args.image_dir, args.output, args.deck)
+    return 0
+
+
+def make_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog='python -m tools',
+        description='Scrapes adjective pictures and turns them into cards.')
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+
+    def add_command(name: str,
+                    run,
+                    description: str,
+                    image_dir: bool = True) -> argparse.ArgumentParser:
+        command = commands.add_parser(name,
+                                      help=description,
+                                      description=description)
+        command.set_defaults(run=run)
+        if image_dir:
+            command.add_argument('image_dir',
+                                 nargs='?',
+                                 default=DEFAULT_IMAGE_DIR)
+        return command
+
+    add_command('list', list_pictures,
+                'List the pictures and their adjectives.')
+    add_command('validate', validate_names,
+                'Check that every filename names two adjectives.')
+    add_command('scrape',
+                scrape_pictures,
+                'Download the pictures into images/.',
+                image_dir=False)
+    command = add_command('process', process_pictures,
+                          'Write the halves of every picture.')
+    command.add_argument('out_dir')
+    command.add_argument('--format',
+                         choices=('png', 'webp', 'jpeg'),
+                         default='png')
+    command.add_argument('--max-dimension', type=int)
+    command.add_argument('--workers', type=int)
+    command = add_command('import',
+                          import_notes,
+                          'Add the pictures in images/ to the collection.',
+                          image_dir=False)
+    command.add_argument('--dry-run', action='store_true')
+    command = add_command('audit', audit_collection,
+                          'Show the notes the collection has for each pair.')
+    command.add_argument('--collection',
+                         help='Defaults to my collection.')
+    command.add_argument('--index',
+                         help='The note index to keep up to date. ' +
+                         'Defaults to a file next to the collection.')
+    command = add_command('apkg', build_apkg,
+                          'Build a deck package of the pictures.')
+    command.add_argument('output', help='The .apkg file to write.')
+    command.add_argument('--deck', default='200')
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = make_parser().parse_args(argv)
+    return args.run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
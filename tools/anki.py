@@ -1,13 +1,21 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 """A collection of utilities for adding cards to Anki's DB."""
+import functools
+import html
+import html.entities
 from itertools import chain
 import os
-from typing import List
+import re
+from typing import (TYPE_CHECKING, Dict, Iterable, List, NamedTuple, Optional,
+                    Tuple)
 
-from bs4 import BeautifulSoup as BS
+from tools import instrument
+from tools.cards import NoteDraft  # noqa: F401
 
-import anki
+# anki and bs4 are slow to import, so they are imported where they are used.
+if TYPE_CHECKING:
+    import anki
 
 
 # I often put silent hyphens to my cards to improve their layout.
@@ -16,7 +24,68 @@ def remove_silent_hyphens(input: str) -> str:
     return input.replace('\u00ad', '')
 
 
-def get_related_double_notes(col: anki.collection._Collection, adj0: str,
+_ATTRS = r"""(?:"[^"]*"|'[^']*'|[^'">])*"""
+# Markup that contributes no text: scripts and stylesheets with their
+# content, comments, tags, and declarations such as <!DOCTYPE html>.
+_MARKUP_RE = re.compile(
+    r'<(script|style)\b' + _ATTRS + r'>.*?</\1\s*>|' + r'<!--.*?-->|' +
+    r'</?[a-zA-Z]' + _ATTRS + r'>|' + r'<![a-zA-Z][^>]*>',
+    re.DOTALL | re.IGNORECASE)
+_ENTITY_RE = re.compile(r'&(?:#[0-9]+;|#[xX][0-9a-fA-F]+;|([a-zA-Z0-9]+);)')
+FIELD_TEXT_CACHE_SIZE = 1 << 14
+
+
+_ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+_PRE_RE = re.compile(r'<(pre|textarea)\b', re.IGNORECASE)
+
+
+def _has_only_known_entities(text: str) -> bool:
+    entities = 0
+    for match in _ENTITY_RE.finditer(text):
+        name = match.group(1)
+        if name is not None and name + ';' not in html.entities.html5:
+            return False
+        entities += 1
+    return entities == text.count('&')
+
+
+def _segment_text(segment: str) -> str:
+    text = html.unescape(segment) if '&' in segment else segment
+    # Like BeautifulSoup, collapse strings made only of whitespace.
+    if text and not text.strip(_ASCII_SPACES):
+        return '\n' if '\n' in text else ' '
+    return text
+
+
+def field_text_with_bs(field: str) -> str:
+    from bs4 import BeautifulSoup as BS
+
+    return BS(field, 'html.parser').text
+
+
+@functools.lru_cache(maxsize=FIELD_TEXT_CACHE_SIZE)
+def field_text(field: str) -> str:
+    """Returns the text of a note field, the same as BeautifulSoup's .text.
+
+    Well-formed fields, which are nearly all of them, are handled by a
+    compiled regex and html.unescape. Fields with stray '<' or '&', which
+    BeautifulSoup treats in peculiar ways, fall back to BeautifulSoup.
+    """
+    if _PRE_RE.search(field):
+        return field_text_with_bs(field)
+    segments = []
+    pos = 0
+    for match in _MARKUP_RE.finditer(field):
+        segments.append(field[pos:match.start()])
+        pos = match.end()
+    segments.append(field[pos:])
+    text = ''.join(segments)
+    if '<' in text or not _has_only_known_entities(text):
+        return field_text_with_bs(field)
+    return ''.join(_segment_text(segment) for segment in segments)
+
+
+def get_related_double_notes(col: 'anki.collection._Collection', adj0: str,
                              adj1: str):
     """Finds language cards related to adjs.
 
@@ -50,7 +119,7 @@ def get_related_double_notes(col: anki.collection._Collection, adj0: str,
     return (image_occlusion_notes, normal_notes)
 
 
-def get_related_notes(col: anki.collection._Collection, adjs: List[str]):
+def get_related_notes(col: 'anki.collection._Collection', adjs: List[str]):
     """Finds language cards related to `adjs`.
 
     This function searches through my collection looking for flashcards for
@@ -79,7 +148,7 @@ def get_related_notes(col: anki.collection._Collection, adjs: List[str]):
             image_occlusion_notes.append(note)
             continue
 
-        top_field = BS(note.fields[0]).text
+        top_field = field_text(note.fields[0])
         for adj in adjs:
             if top_field == adj:
                 normal_notes.append(note)
@@ -95,13 +164,278 @@ def get_related_notes(col: anki.collection._Collection, adjs: List[str]):
     return (image_occlusion_notes, normal_notes)
 
 
-def open_my_collection() -> anki.collection._Collection:
+IMAGE_OCCLUSION_MODEL = "Image Occlusion Enhanced"
+# Keeps the number of query parameters below old SQLite's limit of 999.
+TERMS_PER_QUERY = 200
+
+
+class NoteRecord(NamedTuple):
+    """A note as loaded in bulk from the collection's notes table.
+
+    Use `col.getNote(record.id)` to get a full `anki.notes.Note`.
+    """
+    id: int
+    model_name: str
+    mod: int
+    fields: List[str]
+    tags: List[str]
+
+
+class ModelNameCache:
+    """Resolves model ids to names, asking the collection once per model."""
+    def __init__(self, col: 'anki.collection._Collection'):
+        self.col = col
+        self._names: Dict[int, str] = {}
+
+    def get(self, mid: int) -> str:
+        if mid not in self._names:
+            model = self.col.models.get(mid)
+            if not model:
+                raise Exception(
+                    "Found a note without a model. " +
+                    "Correct the assumption that every note has a model.")
+            self._names[mid] = model['name']
+        return self._names[mid]
+
+
+def _escape_like(term: str) -> str:
+    return (term.replace('\\', '\\\\').replace('%', '\\%').replace(
+        '_', '\\_'))
+
+
+def _like_pattern(term: str) -> str:
+    """Returns a LIKE pattern for the fields or tags that contain `term`.
+
+    LIKE folds the case of ASCII letters only, so every other character,
+    e.g., the "Ä" of "Ärger", matches any character.
+    """
+    return '%' + ''.join(c if c.isascii() else '_'
+                         for c in _escape_like(term)) + '%'
+
+
+def load_notes_mentioning(
+        col: 'anki.collection._Collection',
+        terms: Iterable[str],
+        model_names: Optional[ModelNameCache] = None) -> List[NoteRecord]:
+    """Loads all notes whose fields or tags contain any of `terms`.
+
+    Instead of a search and a lookup per note, this runs a single query per
+    `TERMS_PER_QUERY` terms against the notes table. The match is SQLite's
+    LIKE, a loose substring match that ignores case and non-ASCII
+    characters, so callers should check the returned notes for what they
+    actually need.
+    """
+    terms = sorted(set(terms))
+    model_names = model_names or ModelNameCache(col)
+    clause = "(flds like ? escape '\\' or tags like ? escape '\\')"
+    records: Dict[int, NoteRecord] = {}
+    for i in range(0, len(terms), TERMS_PER_QUERY):
+        chunk = terms[i:i + TERMS_PER_QUERY]
+        args: List[str] = []
+        for term in chunk:
+            pattern = _like_pattern(term)
+            args.extend([pattern, pattern])
+        rows = col.db.all(
+            "select id, mid, mod, flds, tags from notes where " +
+            " or ".join([clause] * len(chunk)), *args)
+        for nid, mid, mod, flds, tags in rows:
+            records[nid] = NoteRecord(nid, model_names.get(mid), mod,
+                                      flds.split('\x1f'), tags.split())
+    return [records[nid] for nid in sorted(records)]
+
+
+def _mentions(record: NoteRecord, adj: str) -> bool:
+    adj = adj.casefold()
+    return (any(tag.casefold() == adj for tag in record.tags)
+            or any(adj in f.casefold() for f in record.fields))
+
+
+def _split_by_model(
+        records: Iterable[NoteRecord]
+) -> Tuple[List[NoteRecord], List[NoteRecord]]:
+    image_occlusion_notes = []
+    normal_notes = []
+    for record in records:
+        if record.model_name == IMAGE_OCCLUSION_MODEL:
+            image_occlusion_notes.append(record)
+        else:
+            normal_notes.append(record)
+    return (image_occlusion_notes, normal_notes)
+
+
+def get_related_notes_in_bulk(
+    col: 'anki.collection._Collection', adjs: List[str]
+) -> Dict[str, Tuple[List[NoteRecord], List[NoteRecord]]]:
+    """Finds language cards related to each of `adjs` in one pass.
+
+    This is the bulk version of `get_related_notes`. It maps each adjective
+    to its image occlusion notes and its normal notes, i.e., notes with the
+    adjective in the first field or with an image from deutschlernerblog.
+    """
+    records = load_notes_mentioning(col, adjs)
+    related = {}
+    for adj in adjs:
+        io_notes, other_notes = _split_by_model(r for r in records
+                                                if _mentions(r, adj))
+        normal_notes = [
+            r for r in other_notes
+            if field_text(r.fields[0]) == adj or any(
+                f.find('Adjektive') != -1 for f in r.fields)
+        ]
+        related[adj] = (io_notes, normal_notes)
+    return related
+
+
+def get_related_double_notes_in_bulk(
+    col: 'anki.collection._Collection', pairs: List[Tuple[str, str]]
+) -> Dict[Tuple[str, str], Tuple[List[NoteRecord], List[NoteRecord]]]:
+    """Finds language cards related to each pair of adjectives in one pass.
+
+    This is the bulk version of `get_related_double_notes`.
+    """
+    records = load_notes_mentioning(col, set(chain.from_iterable(pairs)))
+    return {
+        (adj0, adj1): _split_by_model(
+            r for r in records if _mentions(r, adj0) and _mentions(r, adj1))
+        for adj0, adj1 in pairs
+    }
+
+
+class ImportReport:
+    def __init__(self, dry_run: bool, action: str = 'add'):
+        self.dry_run = dry_run
+        # Either 'add' or 'update'.
+        self.action = action
+        # Ids of added or updated notes. Dry runs leave this empty.
+        self.added: List[int] = []
+        # Maps the position of each added draft to its note's id.
+        self.note_ids: Dict[int, int] = {}
+        # Number of notes that were (or, in a dry run, would be) added.
+        self.count = 0
+        self.failed: List[Tuple[NoteDraft, str]] = []
+        # Positions of updates whose notes no longer exist. They are failed
+        # too.
+        self.missing: List[int] = []
+
+    def summary(self) -> str:
+        verb = {
+            ('add', False): 'Added',
+            ('add', True): 'Would add',
+            ('update', False): 'Updated',
+            ('update', True): 'Would update',
+        }[(self.action, self.dry_run)]
+        lines = ['{} {} notes, {} failed.'.format(verb, self.count,
+                                                  len(self.failed))]
+        for draft, error in self.failed:
+            lines.append('  {}: {}'.format(draft.tags, error))
+        return '\n'.join(lines)
+
+
+def add_notes_in_bulk(col: 'anki.collection._Collection',
+                      drafts: Iterable[NoteDraft],
+                      model_name: str,
+                      deck_name: str,
+                      dry_run: bool = False) -> ImportReport:
+    """Adds `drafts` to `col` in a single transaction.
+
+    The model and the deck are resolved once for all notes. Either all
+    notes get committed or, if anything unexpected fails, none. Drafts that
+    would not produce any cards are reported and skipped. A dry run checks
+    the drafts without changing the collection.
+    """
+    model = col.models.byName(model_name)
+    if not model:
+        raise Exception("Could not find the model: " + model_name)
+    report = ImportReport(dry_run)
+    if not dry_run:
+        model['did'] = col.decks.id(deck_name)
+        col.models.setCurrent(model)
+    try:
+        for i, draft in enumerate(drafts):
+            note = col.newNote(forDeck=False)
+            if len(draft.fields) > len(note.fields):
+                report.failed.append(
+                    (draft, 'Expected at most {} fields.'.format(
+                        len(note.fields))))
+                continue
+            note.fields[:len(draft.fields)] = draft.fields
+            note.tags = list(draft.tags)
+            if dry_run:
+                if not col.findTemplates(note):
+                    report.failed.append((draft, 'No cards would be made.'))
+                    continue
+            else:
+                with instrument.timer('note_add'):
+                    added = col.addNote(note)
+                if not added:
+                    report.failed.append((draft, 'No cards were made.'))
+                    continue
+                report.added.append(note.id)
+                report.note_ids[i] = note.id
+            report.count += 1
+        if not dry_run:
+            with instrument.timer('note_save'):
+                col.save()
+    except BaseException:
+        if not dry_run:
+            col.rollback()
+        raise
+    return report
+
+
+def update_notes_in_bulk(col: 'anki.collection._Collection',
+                         updates: Iterable[Tuple[int, NoteDraft]],
+                         dry_run: bool = False) -> ImportReport:
+    """Replaces the fields and tags of existing notes in a single transaction.
+
+    `updates` are pairs of a note id and the note's new content. Notes that
+    no longer exist are reported, in `missing` too, and skipped.
+    """
+    report = ImportReport(dry_run, action='update')
+    try:
+        for i, (nid, draft) in enumerate(updates):
+            if not col.db.scalar("select 1 from notes where id = ?", nid):
+                report.failed.append(
+                    (draft, 'No note with id {}.'.format(nid)))
+                report.missing.append(i)
+                continue
+            note = col.getNote(nid)
+            if len(draft.fields) > len(note.fields):
+                report.failed.append(
+                    (draft, 'Expected at most {} fields.'.format(
+                        len(note.fields))))
+                continue
+            if not dry_run:
+                note.fields[:len(draft.fields)] = draft.fields
+                note.tags = list(draft.tags)
+                with instrument.timer('note_update'):
+                    note.flush()
+                report.added.append(nid)
+            report.count += 1
+        if not dry_run:
+            col.save()
+    except BaseException:
+        if not dry_run:
+            col.rollback()
+        raise
+    return report
+
+
+MY_COLLECTION = '/home/grzesiek/Documents/Anki/grzesiek/collection.anki2'
+
+
+def open_collection(filename: str) -> 'anki.collection._Collection':
+    import anki
+
     cwd = os.getcwd()
     try:
-        return anki.storage.Collection(
-            '/home/grzesiek/Documents/Anki/grzesiek/collection.anki2')
+        return anki.storage.Collection(filename)
     finally:
         # Opening an Anki Collection can have the inadvertent effect of
         # changing the PWD, so restore PWD afterwards.
         if cwd != os.getcwd():
             os.chdir(cwd)
+
+
+def open_my_collection() -> 'anki.collection._Collection':
+    return open_collection(MY_COLLECTION)
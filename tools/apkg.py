@@ -0,0 +1,458 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Writes Anki deck packages (.apkg) without Anki.
+
+A package is a zip of a collection database, in the schema 11 format that
+every Anki 2.1 version imports, of the media files, stored under numbers,
+and of a "media" file mapping those numbers to media names. `ApkgWriter`
+streams media into the zip as they are added and batches notes and cards
+into the database in one transaction, so neither the pictures nor the notes
+are ever held in memory at once.
+
+Notes get stable GUIDs, so importing a rebuilt package updates the notes
+imported before instead of duplicating them.
+
+Run as
+
+    python -m tools.apkg images/ 200.apkg
+
+to build the deck of double adjective pictures from a folder of scraped
+pictures.
+"""
+import argparse
+from functools import partial
+import hashlib
+import html
+import json
+import os
+from os import path
+import re
+import sqlite3
+import tempfile
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+import zipfile
+
+from tools.cards import NoteDraft, make_double_cloze_draft
+from tools.dedup import DuplicateIndex, export_fingerprinted_halves
+from tools.filenames import originals_first_key
+from tools.media import content_media_name
+from tools.process import (COMPACT_ENCODE_OPTIONS, DoubleAdjectivePic,
+                           EncodeOptions, process_in_parallel,
+                           scan_source_pics)
+
+SCHEMA_VERSION = 11
+# Rows per executemany.
+BATCH_SIZE = 1000
+# Fixed so that every package shares the model, and Anki does not create a
+# copy of it on each import.
+CLOZE_MODEL_ID = 1425279151691
+DEFAULT_DECK_NAME = '200'
+
+SCHEMA = """
+create table col (
+    id integer primary key, crt integer not null, mod integer not null,
+    scm integer not null, ver integer not null, dty integer not null,
+    usn integer not null, ls integer not null, conf text not null,
+    models text not null, decks text not null, dconf text not null,
+    tags text not null
+);
+create table notes (
+    id integer primary key, guid text not null, mid integer not null,
+    mod integer not null, usn integer not null, tags text not null,
+    flds text not null, sfld integer not null, csum integer not null,
+    flags integer not null, data text not null
+);
+create table cards (
+    id integer primary key, nid integer not null, did integer not null,
+    ord integer not null, mod integer not null, usn integer not null,
+    type integer not null, queue integer not null, due integer not null,
+    ivl integer not null, factor integer not null, reps integer not null,
+    lapses integer not null, left integer not null, odue integer not null,
+    odid integer not null, flags integer not null, data text not null
+);
+create table revlog (
+    id integer primary key, cid integer not null, usn integer not null,
+    ease integer not null, ivl integer not null, lastIvl integer not null,
+    factor integer not null, time integer not null, type integer not null
+);
+create table graves (
+    usn integer not null, oid integer not null, type integer not null
+);
+create index ix_notes_usn on notes (usn);
+create index ix_cards_usn on cards (usn);
+create index ix_revlog_usn on revlog (usn);
+create index ix_cards_nid on cards (nid);
+create index ix_cards_sched on cards (did, queue, due);
+create index ix_revlog_cid on revlog (cid);
+create index ix_notes_csum on notes (csum);
+"""
+
+CLOZE_CSS = """.card {
+  font-family: arial;
+  font-size: 20px;
+  text-align: center;
+  color: black;
+  background-color: white;
+}
+.cloze {
+  font-weight: bold;
+  color: blue;
+}
+"""
+LATEX_PRE = ('\\documentclass[12pt]{article}\n\\special{papersize=3in,5in}\n'
+             '\\usepackage[utf8]{inputenc}\n\\usepackage{amssymb,amsmath}\n'
+             '\\pagestyle{empty}\n\\setlength{\\parindent}{0in}\n'
+             '\\begin{document}\n')
+LATEX_POST = '\\end{document}'
+
+DECK_CONF = {
+    'id': 1,
+    'name': 'Default',
+    'mod': 0,
+    'usn': 0,
+    'maxTaken': 60,
+    'autoplay': True,
+    'replayq': True,
+    'timer': 0,
+    'dyn': False,
+    'new': {
+        'bury': False,
+        'delays': [1, 10],
+        'initialFactor': 2500,
+        'ints': [1, 4, 7],
+        'order': 1,
+        'perDay': 20,
+        'separate': True,
+    },
+    'lapse': {
+        'delays': [10],
+        'leechAction': 0,
+        'leechFails': 8,
+        'minInt': 1,
+        'mult': 0,
+    },
+    'rev': {
+        'bury': False,
+        'ease4': 1.3,
+        'fuzz': 0.05,
+        'ivlFct': 1,
+        'maxIvl': 36500,
+        'minSpace': 1,
+        'perDay': 200,
+        'hardFactor': 1.2,
+    },
+}
+
+_CLOZE_RE = re.compile(r'{{c(\d+)::')
+_TAG_RE = re.compile(r'<[^>]*>')
+# Anki's stripHTMLMedia keeps the filenames of pictures.
+_IMG_RE = re.compile(r'(?i)<img[^>]+src=["\']?([^"\'>]+)["\']?[^>]*>')
+
+
+def cloze_model(deck_id: int) -> Dict[str, Any]:
+    """Returns Anki's stock Cloze note type."""
+    def field(name: str, ordinal: int) -> Dict[str, Any]:
+        return {
+            'name': name,
+            'ord': ordinal,
+            'sticky': False,
+            'rtl': False,
+            'font': 'Arial',
+            'size': 20,
+            'media': [],
+        }
+
+    return {
+        'id': CLOZE_MODEL_ID,
+        'name': 'Cloze',
+        'type': 1,
+        'mod': 0,
+        'usn': -1,
+        'sortf': 0,
+        'did': deck_id,
+        'flds': [field('Text', 0), field('Back Extra', 1)],
+        'tmpls': [{
+            'name': 'Cloze',
+            'ord': 0,
+            'qfmt': '{{cloze:Text}}',
+            'afmt': '{{cloze:Text}}<br>\n{{Back Extra}}',
+            'did': None,
+            'bqfmt': '',
+            'bafmt': '',
+        }],
+        'css': CLOZE_CSS,
+        'latexPre': LATEX_PRE,
+        'latexPost': LATEX_POST,
+        'latexsvg': False,
+        'tags': [],
+        'vers': [],
+        'req': [[0, 'any', [0]]],
+    }
+
+
+def deck(deck_id: int, name: str) -> Dict[str, Any]:
+    return {
+        'id': deck_id,
+        'name': name,
+        'mod': 0,
+        'usn': -1,
+        'conf': 1,
+        'desc': '',
+        'dyn': 0,
+        'collapsed': False,
+        'browserCollapsed': False,
+        'extendNew': 10,
+        'extendRev': 50,
+        'newToday': [0, 0],
+        'revToday': [0, 0],
+        'lrnToday': [0, 0],
+        'timeToday': [0, 0],
+    }
+
+
+def stable_id(text: str) -> int:
+    """Returns an id that stays the same across builds."""
+    return int(hashlib.sha1(text.encode('utf-8')).hexdigest()[:12], 16)
+
+
+def note_guid(key: str) -> str:
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+
+def sort_field(field: str) -> str:
+    """Returns the text of `field` that Anki sorts by, as stripHTMLMedia."""
+    text = _IMG_RE.sub(r' \1 ', field)
+    return html.unescape(_TAG_RE.sub('', text)).strip()
+
+
+def field_checksum(field: str) -> int:
+    """Returns Anki's checksum of a note's first field, for duplicate checks.
+    """
+    return int(
+        hashlib.sha1(sort_field(field).encode('utf-8')).hexdigest()[:8], 16)
+
+
+def cloze_ordinals(fields: List[str]) -> List[int]:
+    """Returns the card ordinals of a cloze note, one per cloze number."""
+    numbers = {int(n) for f in fields for n in _CLOZE_RE.findall(f)}
+    return sorted(n - 1 for n in numbers if n > 0)
+
+
+class ApkgWriter:
+    """Writes a deck package of cloze notes.
+
+    Use as a context manager, or call `close` to finish the package.
+    """
+    def __init__(self, filename: str, deck_name: str = DEFAULT_DECK_NAME):
+        self.filename = filename
+        self.deck_id = stable_id('deck:' + deck_name)
+        self.deck_name = deck_name
+        self.notes = 0
+        self.cards = 0
+        self._now = int(time.time())
+        # Note and card ids are creation times in milliseconds.
+        self._next_id = self._now * 1000
+        self._media: Dict[str, str] = {}
+        self._media_names: Set[str] = set()
+        self._note_rows: List[Tuple] = []
+        self._card_rows: List[Tuple] = []
+        self._tmp = tempfile.TemporaryDirectory()
+        self._db_path = path.join(self._tmp.name, 'collection.anki2')
+        self._db = sqlite3.connect(self._db_path, isolation_level=None)
+        self._db.executescript(SCHEMA)
+        self._db.execute('begin')
+        self._zip = zipfile.ZipFile(filename + '.part', 'w')
+
+    def __enter__(self) -> 'ApkgWriter':
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def add_media(self, filename: str, name: Optional[str] = None) -> str:
+        """Streams `filename` into the package and returns its media name.
+
+        The name defaults to the content-addressed one that
+        `tools.media.MediaStager` uses. Adding a name again is a no-op.
+        """
+        name = name or content_media_name(filename)
+        if name in self._media_names:
+            return name
+        number = str(len(self._media))
+        # Pictures are compressed already.
+        self._zip.write(filename, number, compress_type=zipfile.ZIP_STORED)
+        self._media[number] = name
+        self._media_names.add(name)
+        return name
+
+    def _new_id(self) -> int:
+        self._next_id += 1
+        return self._next_id
+
+    def add_note(self, draft: NoteDraft, key: Optional[str] = None) -> int:
+        """Adds a cloze note and its cards, and returns the note's id.
+
+        `key` identifies the note across builds, e.g., the source picture's
+        name. It defaults to the note's first field.
+        """
+        fields = draft.fields + [''] * (2 - len(draft.fields))
+        ordinals = cloze_ordinals(fields)
+        if not ordinals:
+            raise Exception('The note has no clozes: ' + str(draft))
+        nid = self._new_id()
+        self._note_rows.append(
+            (nid, note_guid(key or fields[0]), CLOZE_MODEL_ID, self._now, -1,
+             ' ' + ' '.join(draft.tags) + ' ', '\x1f'.join(fields),
+             sort_field(fields[0]), field_checksum(fields[0]), 0, ''))
+        for ordinal in ordinals:
+            self._card_rows.append(
+                (self._new_id(), nid, self.deck_id, ordinal, self._now, -1,
+                 0, 0, self.notes + 1, 0, 0, 0, 0, 0, 0, 0, 0, ''))
+        self.notes += 1
+        self.cards += len(ordinals)
+        if len(self._note_rows) >= BATCH_SIZE:
+            self._flush_rows()
+        return nid
+
+    def _flush_rows(self) -> None:
+        self._db.executemany(
+            'insert into notes values (?,?,?,?,?,?,?,?,?,?,?)',
+            self._note_rows)
+        self._db.executemany(
+            'insert into cards values '
+            '(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)', self._card_rows)
+        self._note_rows = []
+        self._card_rows = []
+
+    def _write_col(self) -> None:
+        conf = {
+            'activeDecks': [self.deck_id],
+            'curDeck': self.deck_id,
+            'curModel': str(CLOZE_MODEL_ID),
+            'newSpread': 0,
+            'collapseTime': 1200,
+            'timeLim': 0,
+            'estTimes': True,
+            'dueCounts': True,
+            'sortType': 'noteFld',
+            'sortBackwards': False,
+            'addToCur': True,
+            'nextPos': self.notes + 1,
+        }
+        decks = {
+            '1': deck(1, 'Default'),
+            str(self.deck_id): deck(self.deck_id, self.deck_name),
+        }
+        self._db.execute(
+            'insert into col values (1,?,?,?,?,0,0,0,?,?,?,?,?)',
+            (self._now, self._now * 1000, self._now * 1000, SCHEMA_VERSION,
+             json.dumps(conf),
+             json.dumps({str(CLOZE_MODEL_ID): cloze_model(self.deck_id)}),
+             json.dumps(decks), json.dumps({'1': DECK_CONF}), '{}'))
+
+    def close(self) -> None:
+        """Commits the notes and finishes the package."""
+        self._flush_rows()
+        self._write_col()
+        self._db.execute('commit')
+        self._db.close()
+        self._zip.write(self._db_path, 'collection.anki2',
+                        compress_type=zipfile.ZIP_DEFLATED)
+        self._zip.writestr('media', json.dumps(self._media))
+        self._zip.close()
+        os.replace(self.filename + '.part', self.filename)
+        self._tmp.cleanup()
+
+    def abort(self) -> None:
+        """Discards the package."""
+        self._db.close()
+        self._zip.close()
+        os.remove(self.filename + '.part')
+        self._tmp.cleanup()
+
+
+def export_deck(daps: Iterable[DoubleAdjectivePic],
+                filename: str,
+                deck_name: str = DEFAULT_DECK_NAME,
+                options: EncodeOptions = COMPACT_ENCODE_OPTIONS,
+                max_workers: Optional[int] = None,
+                index: Optional[DuplicateIndex] = None) -> ApkgWriter:
+    """Writes a package with a double cloze note for each of `daps`.
+
+    Pictures are processed in parallel and streamed into the package, and
+    each processed half is deleted once it is in. Pictures that fail to
+    process are reported and skipped. Returns the closed writer, whose
+    `notes` and `cards` count what was written.
+
+    The default `options` are those of gists/fill200.py, so the package's
+    media are the very files that fill200 adds to a collection.
+
+    `index`, if given, skips duplicate pictures as `dedup.remove_duplicates`
+    does, from the same decode that exports them. The unique pictures get
+    added to it.
+    """
+    if index is not None:
+        daps = sorted(daps,
+                      key=lambda dap: originals_first_key(dap.filename or
+                                                          ''))
+    with tempfile.TemporaryDirectory() as out_dir, ApkgWriter(
+            filename, deck_name) as writer:
+        for result in process_in_parallel(
+                partial(export_fingerprinted_halves,
+                        out_dir=out_dir,
+                        options=options), daps, max_workers):
+            if result.error:
+                print("Could not process " + result.item.get_filename() +
+                      ":\n" + result.error)
+                continue
+            dap = result.item
+            fingerprint, halves = result.value
+            original = None if index is None else index.find(fingerprint)
+            if original is not None:
+                print("Skipping " + dap.get_filename() +
+                      ", a duplicate of " + original.get_filename())
+                for half in halves:
+                    os.remove(half.filename)
+                continue
+            if index is not None:
+                index.add(dap, fingerprint)
+            media = []
+            for adjective, half in zip(
+                (dap.left_adjective, dap.right_adjective), halves):
+                media.append(
+                    writer.add_media(
+                        half.filename,
+                        content_media_name(half.filename, adjective)))
+                os.remove(half.filename)
+            writer.add_note(make_double_cloze_draft(dap, *media),
+                            key=path.basename(dap.get_filename()))
+    return writer
+
+
+def build(image_dir: str, output: str,
+          deck_name: str = DEFAULT_DECK_NAME) -> None:
+    """Builds the deck of the pictures in `image_dir`, skipping duplicates."""
+    writer = export_deck(scan_source_pics(image_dir),
+                         output,
+                         deck_name,
+                         index=DuplicateIndex())
+    print('Wrote {} notes with {} cards to {}.'.format(
+        writer.notes, writer.cards, output))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Builds an Anki deck package from scraped pictures.')
+    parser.add_argument('image_dir')
+    parser.add_argument('output', help='The .apkg file to write.')
+    parser.add_argument('--deck', default=DEFAULT_DECK_NAME)
+    args = parser.parse_args()
+    build(args.image_dir, args.output, args.deck)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""A persistent cache of derived images.
+
+Entries are keyed by the content hash of the source picture and by the
+operations applied to it, so a derived image is recomputed only if either of
+them changes. The cache is capped in size and evicts the least recently used
+entries first.
+"""
+import hashlib
+import json
+import os
+from os import path
+import shutil
+import tempfile
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from tools.process import (AdjectivePic, DoubleAdjectivePic, EncodedPic,
+                           EncodeOptions, Fingerprint, file_digest,
+                           plan_halves)
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+def get_pic_key(pic: AdjectivePic, extra: str = '') -> str:
+    """Returns the cache key of `pic`.
+
+    `extra` distinguishes otherwise identical pictures, e.g., ones encoded
+    with different settings.
+    """
+    source = pic.plan.source
+    if not isinstance(source, str):
+        raise Exception("Only pictures derived from files can be cached.")
+    description = '\n'.join(
+        [file_digest(source), pic.plan.describe(), extra])
+    return hashlib.sha256(description.encode('utf-8')).hexdigest()
+
+
+class DerivedImageCache:
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._size = sum(e.stat().st_size for e in os.scandir(directory)
+                         if e.is_file())
+
+    def _entry(self, key: str, ext: str) -> str:
+        return path.join(self.directory, key + ext)
+
+    def get(self, key: str, ext: str = '.png') -> Optional[str]:
+        """Returns the filename of the cached entry or None."""
+        entry = self._entry(key, ext)
+        try:
+            # Touching the entry records its use for the LRU policy.
+            os.utime(entry)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def put(self, key: str, filename: str) -> str:
+        """Copies `filename` into the cache and returns the entry's filename.
+
+        The entry keeps the extension of `filename`.
+        """
+        return self._add(self._entry(key, path.splitext(filename)[1]),
+                         lambda tmp: shutil.copyfile(filename, tmp))
+
+    def put_bytes(self, key: str, data: bytes, ext: str) -> str:
+        """Writes `data` into the cache and returns the entry's filename."""
+        def write(tmp: str) -> None:
+            with open(tmp, 'wb') as f:
+                f.write(data)
+
+        return self._add(self._entry(key, ext), write)
+
+    def _add(self, entry: str, write: Callable[[str], Any]) -> str:
+        if path.isfile(entry):
+            os.utime(entry)
+            return entry
+        # Write under a temporary name first so that readers never see a
+        # partially written entry.
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        os.close(fd)
+        write(tmp)
+        os.replace(tmp, entry)
+        self._size += path.getsize(entry)
+        self._evict()
+        return entry
+
+    def _evict(self) -> None:
+        if self._size <= self.max_bytes:
+            return
+        entries = sorted(
+            (e for e in os.scandir(self.directory)
+             if e.is_file() and not e.name.endswith('.tmp')),
+            key=lambda e: e.stat().st_mtime_ns)
+        for e in entries:
+            if self._size <= self.max_bytes:
+                break
+            size = e.stat().st_size
+            os.remove(e.path)
+            self._size -= size
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'bytes': self._size,
+        }
+
+
+def lookup_halves(cache: DerivedImageCache,
+                  dap: DoubleAdjectivePic,
+                  halve_above: int = 400,
+                  max_dimension: Optional[int] = None,
+                  options: EncodeOptions = EncodeOptions(),
+                  resample: Optional[int] = None
+                  ) -> Optional[Tuple[EncodedPic, EncodedPic]]:
+    """Returns the cached halves of `dap`, as made by `export_halves`."""
+    ext = options.get_extension()
+    entries = []
+    for half in plan_halves(dap, halve_above, max_dimension, resample):
+        entry = cache.get(get_pic_key(half, repr(options)), ext)
+        if entry is None:
+            return None
+        entries.append(EncodedPic(entry, path.getsize(entry)))
+    return (entries[0], entries[1])
+
+
+def store_halves(cache: DerivedImageCache,
+                 dap: DoubleAdjectivePic,
+                 halves: Tuple[EncodedPic, EncodedPic],
+                 halve_above: int = 400,
+                 max_dimension: Optional[int] = None,
+                 options: EncodeOptions = EncodeOptions(),
+                 resample: Optional[int] = None
+                 ) -> Tuple[EncodedPic, EncodedPic]:
+    """Caches halves made by `export_halves` and returns the cached ones."""
+    left, right = plan_halves(dap, halve_above, max_dimension, resample)
+    extra = repr(options)
+    return (halves[0]._replace(
+        filename=cache.put(get_pic_key(left, extra), halves[0].filename)),
+            halves[1]._replace(filename=cache.put(
+                get_pic_key(right, extra), halves[1].filename)))
+
+
+def lookup_fingerprint(cache: DerivedImageCache,
+                       dap: DoubleAdjectivePic) -> Optional[Fingerprint]:
+    """Returns the cached fingerprint of the illustration of `dap`.
+
+    This is what `dedup.get_illustration_fingerprint` returns, so pictures
+    with cached halves need not be decoded to find duplicates.
+    """
+    entry = cache.get(get_pic_key(dap, 'illustration fingerprint'), '.json')
+    if entry is None:
+        return None
+    with open(entry) as f:
+        size, digest, dhash = json.load(f)
+    return Fingerprint((size[0], size[1]), digest, dhash)
+
+
+def store_fingerprint(cache: DerivedImageCache, dap: DoubleAdjectivePic,
+                      fingerprint: Fingerprint) -> None:
+    data = json.dumps([
+        list(fingerprint.size), fingerprint.digest, fingerprint.dhash
+    ])
+    cache.put_bytes(get_pic_key(dap, 'illustration fingerprint'),
+                    data.encode('utf-8'), '.json')
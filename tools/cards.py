@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""The cloze notes made from double adjective pictures.
+
+Nothing here needs Anki, so notes can also be drafted on machines without
+it, e.g., for `tools.apkg`.
+"""
+from typing import TYPE_CHECKING, List, NamedTuple
+
+# tools.process needs Pillow and numpy, which are slow to import.
+if TYPE_CHECKING:
+    from tools.process import DoubleAdjectivePic
+
+SHARED_TAGS = ['200-wichtigsten-deutschen-adjektive', 'Adjektiv']
+DOUBLE_CLOZE_TEMPLATE = """
+<div style="display:flex;justify-content:center;">
+  <div style="text-align:center;">
+    <img src="{left_pic}" style="max-height:200px"/>
+    <div>{{{{c1::{left_word}}}}}</div>
+  </div>
+  <div style="text-align:center;">
+    <img src="{right_pic}" style="max-height:200px"/>
+    <div>{right_cloze}</div>
+  </div>
+</div>
+"""
+
+
+class NoteDraft(NamedTuple):
+    """A note that is ready to be added to the collection."""
+    fields: List[str]
+    tags: List[str]
+
+
+def get_cloze_field(left_pic: str, left_adj: str, right_pic: str,
+                    right_adj: str) -> str:
+    if right_adj.startswith('un'):
+        right_cloze = 'un{{c1::' + right_adj[2:] + '}}'
+    elif right_adj.startswith('nicht '):
+        right_cloze = 'nicht {{c1::' + right_adj[6:] + '}}'
+    elif right_adj.endswith('los'):
+        right_cloze = '{{c1::' + right_adj[:-3] + '}}los'
+    else:
+        right_cloze = '{{c2::' + right_adj + '}}'
+    return DOUBLE_CLOZE_TEMPLATE.format(
+        left_pic=left_pic,
+        left_word=left_adj,
+        right_pic=right_pic,
+        right_cloze=right_cloze,
+    )
+
+
+def make_double_cloze_draft(dap: 'DoubleAdjectivePic', left_pic: str,
+                            right_pic: str) -> NoteDraft:
+    """Returns a cloze note for `dap` whose halves are the media files."""
+    return NoteDraft(
+        fields=[
+            get_cloze_field(left_pic, dap.left_adjective, right_pic,
+                            dap.right_adjective)
+        ],
+        tags=(SHARED_TAGS + [dap.left_adjective, dap.right_adjective] +
+              ['double']))
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Finds duplicate adjective pictures in the scraped corpus.
+
+Pictures are indexed by the perceptual hash of their illustration, without
+subtitles, in a BK-tree. Looking up everything within a small Hamming
+distance of a hash then visits only a fraction of the tree instead of
+comparing against every picture.
+"""
+from typing import (Callable, Dict, Generic, Iterable, List, Optional, Tuple,
+                    TypeVar)
+
+from tools.filenames import originals_first_key
+from tools.process import (DoubleAdjectivePic, EncodedPic, EncodeOptions,
+                           Fingerprint, compute_fingerprint,
+                           get_half_filenames, hamming_distance, plan_halves,
+                           process_in_parallel, render_plans, save_image)
+
+T = TypeVar('T')
+
+# Pictures whose hashes differ in at most this many bits are duplicates.
+DEFAULT_MAX_DISTANCE = 3
+
+
+class _Node(Generic[T]):
+    def __init__(self, key: int, value: T):
+        self.key = key
+        self.value = value
+        self.children: Dict[int, '_Node[T]'] = {}
+
+
+class BKTree(Generic[T]):
+    """A Burkhard-Keller tree of values keyed by integer hashes."""
+    def __init__(self, distance: Callable[[int, int],
+                                          int] = hamming_distance):
+        self.distance = distance
+        self._root: Optional[_Node[T]] = None
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, key: int, value: T) -> None:
+        self._size += 1
+        if self._root is None:
+            self._root = _Node(key, value)
+            return
+        node = self._root
+        while True:
+            d = self.distance(key, node.key)
+            child = node.children.get(d)
+            if child is None:
+                node.children[d] = _Node(key, value)
+                return
+            node = child
+
+    def search(self, key: int, max_distance: int) -> List[Tuple[int, T]]:
+        """Returns (distance, value) pairs within `max_distance` of `key`.
+
+        The pairs are sorted by distance.
+        """
+        found: List[Tuple[int, T]] = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node = stack.pop()
+            d = self.distance(key, node.key)
+            if d <= max_distance:
+                found.append((d, node.value))
+            # By the triangle inequality, matches can only be in subtrees
+            # whose edge distance is within max_distance of d.
+            for edge, child in node.children.items():
+                if d - max_distance <= edge <= d + max_distance:
+                    stack.append(child)
+        found.sort(key=lambda pair: pair[0])
+        return found
+
+
+def get_illustration_fingerprint(dap: DoubleAdjectivePic) -> Fingerprint:
+    """Returns the fingerprint of `dap` without its subtitles."""
+    return dap.remove_subs().get_fingerprint()
+
+
+def export_fingerprinted_halves(
+    dap: DoubleAdjectivePic,
+    out_dir: str,
+    halve_above: int = 400,
+    max_dimension: Optional[int] = None,
+    options: EncodeOptions = EncodeOptions(),
+    measure_savings: bool = False,
+    resample: Optional[int] = None
+) -> Tuple[Fingerprint, Tuple[EncodedPic, EncodedPic]]:
+    """Does `get_illustration_fingerprint` and `process.export_halves`.
+
+    Both render from a single decode of the source, so a picture that turns
+    out to be unique needs no second pass to export it.
+    """
+    halves = plan_halves(dap, halve_above, max_dimension, resample)
+    imgs = render_plans([dap.remove_subs().plan] +
+                        [half.plan for half in halves])
+    with imgs[0] as img:
+        fingerprint = compute_fingerprint(img)
+    encoded = []
+    for half, filename, img in zip(
+            halves, get_half_filenames(dap, out_dir, options), imgs[1:]):
+        with img:
+            encoded.append(
+                save_image(img, filename, options, measure_savings))
+        half.filename = filename
+    return (fingerprint, (encoded[0], encoded[1]))
+
+
+class DuplicateIndex:
+    """An index of pictures that answers "is this picture already in?"."""
+    def __init__(self, max_distance: int = DEFAULT_MAX_DISTANCE):
+        self.max_distance = max_distance
+        self._by_digest: Dict[str, DoubleAdjectivePic] = {}
+        self._tree: BKTree[DoubleAdjectivePic] = BKTree()
+        # Fingerprints of the indexed pictures by their filenames.
+        self.fingerprints: Dict[str, Fingerprint] = {}
+
+    def __len__(self) -> int:
+        return len(self._tree)
+
+    def find(self,
+             fingerprint: Fingerprint) -> Optional[DoubleAdjectivePic]:
+        """Returns an indexed picture that `fingerprint` duplicates, if any."""
+        exact = self._by_digest.get(fingerprint.digest)
+        if exact is not None:
+            return exact
+        matches = self._tree.search(fingerprint.dhash, self.max_distance)
+        return matches[0][1] if matches else None
+
+    def add(self, dap: DoubleAdjectivePic, fingerprint: Fingerprint) -> None:
+        self._by_digest.setdefault(fingerprint.digest, dap)
+        self._tree.add(fingerprint.dhash, dap)
+        if dap.filename is not None:
+            self.fingerprints[dap.filename] = fingerprint
+
+
+def remove_duplicates(
+    daps: Iterable[DoubleAdjectivePic],
+    max_distance: int = DEFAULT_MAX_DISTANCE,
+    max_workers: Optional[int] = None,
+    index: Optional[DuplicateIndex] = None
+) -> Tuple[List[DoubleAdjectivePic], List[Tuple[DoubleAdjectivePic,
+                                                 DoubleAdjectivePic]]]:
+    """Splits `daps` into unique pictures and duplicates.
+
+    Fingerprints are computed in parallel. The first of duplicate pictures
+    is kept, going by `originals_first_key`, so that a reupload never
+    replaces its original. Returns the unique pictures, in that order, and
+    (duplicate, original) pairs. Pictures that could not be fingerprinted
+    are kept.
+
+    `index`, if given, may already hold pictures, e.g., ones imported before,
+    which count as originals. The unique pictures get added to it.
+    """
+    index = index if index is not None else DuplicateIndex(max_distance)
+    unique: List[DoubleAdjectivePic] = []
+    duplicates: List[Tuple[DoubleAdjectivePic, DoubleAdjectivePic]] = []
+    candidates = sorted(daps,
+                        key=lambda dap: originals_first_key(dap.filename or
+                                                            ''))
+    for result in process_in_parallel(get_illustration_fingerprint,
+                                      candidates, max_workers):
+        if result.error:
+            unique.append(result.item)
+            continue
+        original = index.find(result.value)
+        if original is not None:
+            duplicates.append((result.item, original))
+            continue
+        index.add(result.item, result.value)
+        unique.append(result.item)
+    return (unique, duplicates)
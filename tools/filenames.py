@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Parses the adjective pairs out of scraped filenames.
+
+A filename looks like "wild_zahm_Adjektive_Deutsch_deutschlernerblog.png".
+Its trunk, the part before "Adjektive", holds the adjectives separated by
+'_' or '-'. The trunk's words are matched against a table of rules. Dirty
+filenames are handled by a JSON config instead of code:
+
+* "overrides" maps the trunk's words, joined by spaces, to a pair.
+* "ignored_words" are dropped from the end of the trunk, e.g., the "2" of a
+  reupload.
+* "rules" are extra rules, tried before the built-in ones, each with a
+  "pattern" matched against the joined words and "left" and "right"
+  templates filled with the pattern's groups.
+"""
+import functools
+import json
+import os
+from os import path
+import re
+from typing import (Dict, Iterable, Iterator, List, NamedTuple, Optional,
+                    Pattern, Tuple)
+
+DEFAULT_RULES_FILE = path.join(path.dirname(path.realpath(__file__)),
+                               'filename_rules.json')
+PARSE_CACHE_SIZE = 1 << 14
+
+_TRUNK_RE = re.compile(r'^(?P<trunk>.*?)Adjektive')
+
+
+class FilenameError(Exception):
+    """A filename that does not name a pair of adjectives."""
+    def __init__(self, filename: str, reason: str):
+        super().__init__(reason)
+        self.filename = filename
+        self.reason = reason
+
+
+class Rule(NamedTuple):
+    pattern: Pattern
+    left: str
+    right: str
+
+    def apply(self, words: str) -> Optional[Tuple[str, str]]:
+        match = self.pattern.fullmatch(words)
+        if not match:
+            return None
+        groups = match.groups()
+        return (self.left.format(*groups), self.right.format(*groups))
+
+
+BUILTIN_RULES = [
+    Rule(re.compile(r'(\S+) (\S+)'), '{0}', '{1}'),
+    Rule(re.compile(r'(\S+) nicht (\S+)'), '{0}', 'nicht {1}'),
+]
+
+
+class ParseResults(NamedTuple):
+    # Adjective pairs by filename.
+    parsed: Dict[str, Tuple[str, str]]
+    errors: List[FilenameError]
+
+
+class FilenameParser:
+    def __init__(self,
+                 overrides: Optional[Dict[str, Tuple[str, str]]] = None,
+                 ignored_words: Iterable[str] = (),
+                 rules: Iterable[Rule] = ()):
+        self.overrides = dict(overrides or {})
+        self.ignored_words = frozenset(ignored_words)
+        self.rules = list(rules) + BUILTIN_RULES
+        self._parse_basename = functools.lru_cache(
+            maxsize=PARSE_CACHE_SIZE)(self._parse_basename_uncached)
+
+    @staticmethod
+    def from_config(filename: str) -> 'FilenameParser':
+        with open(filename, encoding='utf-8') as f:
+            config = json.load(f)
+        return FilenameParser(
+            overrides={
+                words: (pair[0], pair[1])
+                for words, pair in config.get('overrides', {}).items()
+            },
+            ignored_words=config.get('ignored_words', []),
+            rules=[
+                Rule(re.compile(rule['pattern']), rule['left'],
+                     rule['right']) for rule in config.get('rules', [])
+            ])
+
+    def _split_trunk(self, basename: str) -> List[str]:
+        match = _TRUNK_RE.match(basename)
+        if not match:
+            raise FilenameError(
+                basename,
+                "Expected a filename with 'Adjektive' in it but got: " +
+                basename)
+        trunk = match['trunk'][:-1]
+        if not trunk:
+            raise FilenameError(
+                basename,
+                "Expected a filename with a trunk in it but got: " + basename)
+        if '_' in trunk:
+            words = trunk.split('_')
+        elif '-' in trunk:
+            words = trunk.split('-')
+        else:
+            raise FilenameError(
+                basename,
+                "Expected a filename with '_' or '-' as separator but got: " +
+                trunk)
+        return words
+
+    def _parse_basename_uncached(self, basename: str) -> Tuple[str, str]:
+        words = self._split_trunk(basename)
+        joined = ' '.join(words)
+        if joined in self.overrides:
+            return self.overrides[joined]
+        while len(words) > 2 and words[-1] in self.ignored_words:
+            words = words[:-1]
+        joined = ' '.join(words)
+        for rule in self.rules:
+            pair = rule.apply(joined)
+            if pair:
+                return pair
+        raise FilenameError(
+            basename, "No rule matches the words " + str(words) +
+            ". Add an override to " + DEFAULT_RULES_FILE)
+
+    def parse(self, filename: str) -> Tuple[str, str]:
+        """Returns the adjectives in `filename` or raises FilenameError.
+
+        Results are memoized by the filename's basename.
+        """
+        return self._parse_basename(path.basename(filename))
+
+    def count_ignored_words(self, filename: str) -> int:
+        """Returns how many ignored words end the trunk of `filename`.
+
+        Reuploads have some, e.g., the "2" of "wild_zahm_2_Adjektive.png".
+        Filenames that can not be parsed have none.
+        """
+        try:
+            words = self._split_trunk(path.basename(filename))
+        except FilenameError:
+            return 0
+        if ' '.join(words) in self.overrides:
+            return 0
+        kept = words
+        while len(kept) > 2 and kept[-1] in self.ignored_words:
+            kept = kept[:-1]
+        return len(words) - len(kept)
+
+    def parse_all(self, filenames: Iterable[str]) -> ParseResults:
+        """Parses a whole listing, collecting errors instead of raising."""
+        results = ParseResults({}, [])
+        for filename in filenames:
+            try:
+                results.parsed[filename] = self.parse(filename)
+            except FilenameError as e:
+                results.errors.append(FilenameError(filename, e.reason))
+        return results
+
+
+@functools.lru_cache(maxsize=None)
+def default_parser() -> FilenameParser:
+    return FilenameParser.from_config(DEFAULT_RULES_FILE)
+
+
+def originals_first_key(filename: str) -> Tuple[int, str]:
+    """Sorts pictures by name, but reuploads after all originals."""
+    return (default_parser().count_ignored_words(filename),
+            path.basename(filename))
+
+
+def iter_source_files(directory: str, ext: str = '.png') -> Iterator[str]:
+    """Yields the scraped pictures in `directory`, sorted by name.
+
+    The order does not depend on the filesystem, so that runs over the same
+    pictures are reproducible.
+    """
+    with os.scandir(directory) as entries:
+        names = sorted(
+            entry.name for entry in entries
+            if (entry.name.endswith(ext) and not entry.name.startswith('.')
+                and entry.is_file()))
+    for name in names:
+        yield path.join(directory, name)
+
+
+def find_bad_source_names(
+        filenames: Iterable[str]) -> List[Tuple[str, str]]:
+    """Returns pairs of filenames that can not be parsed and the reason."""
+    return [(e.filename, e.reason)
+            for e in default_parser().parse_all(filenames).errors]
+
+
+def check_source_names(directory: str, ext: str = '.png') -> None:
+    """Raises an exception listing every unparseable filename in `directory`.
+
+    This only looks at names, so it is cheap enough to run before any
+    picture gets decoded.
+    """
+    bad = find_bad_source_names(iter_source_files(directory, ext))
+    if bad:
+        raise Exception(
+            "Found {} filenames without adjectives:\n".format(len(bad)) +
+            '\n'.join('  {}: {}'.format(path.basename(filename), error)
+                      for filename, error in sorted(bad)))
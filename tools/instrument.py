@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Timers and counters for the stages of the pipeline.
+
+Instrumentation is off by default, and then a timer costs a global lookup
+and a call. Turn it on with the TOOLS_INSTRUMENT environment variable, set to
+the file that gets the JSON summary at exit, or to '-' for stderr:
+
+    TOOLS_INSTRUMENT=stats.json python -m tools.scrape
+
+TOOLS_PROFILE, set to a stage name, additionally runs that stage under
+cProfile and saves the profile next to the summary, as stats.json.<stage>.prof.
+
+Stages are timed with a context manager,
+
+    with instrument.timer('encode') as t:
+        data = encode(img)
+        t.add_bytes(len(data))
+
+or with the `timed` decorator. `count` records events without timing them.
+"""
+import atexit
+import cProfile
+import functools
+import json
+import multiprocessing
+import os
+import pstats
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple, TypeVar
+
+ENV_VAR = 'TOOLS_INSTRUMENT'
+PROFILE_ENV_VAR = 'TOOLS_PROFILE'
+
+F = TypeVar('F', bound=Callable[..., Any])
+
+
+class StageStats:
+    __slots__ = ('count', 'total', 'max', 'bytes')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.bytes = 0
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            'count': self.count,
+            'total_s': self.total,
+            'mean_s': self.total / self.count if self.count else 0.0,
+            'max_s': self.max,
+            'bytes': self.bytes,
+        }
+
+
+_enabled = False
+_stats: Dict[str, StageStats] = {}
+_lock = threading.Lock()
+_profile_stage: Optional[str] = None
+_profiler: Optional[cProfile.Profile] = None
+_profiling = False
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def enable(profile_stage: Optional[str] = None) -> None:
+    """Turns instrumentation on, also for worker processes started later."""
+    global _enabled, _profile_stage, _profiler
+    _enabled = True
+    os.environ.setdefault(ENV_VAR, '-')
+    if profile_stage is not None:
+        _profile_stage = profile_stage
+        _profiler = cProfile.Profile()
+
+
+def disable() -> None:
+    global _enabled
+    _enabled = False
+
+
+def reset() -> None:
+    global _profiler
+    with _lock:
+        _stats.clear()
+    if _profile_stage is not None:
+        _profiler = cProfile.Profile()
+
+
+def _record(stage: str, elapsed: float, count: int, nbytes: int) -> None:
+    with _lock:
+        stats = _stats.get(stage)
+        if stats is None:
+            stats = _stats[stage] = StageStats()
+        stats.count += count
+        stats.total += elapsed
+        stats.bytes += nbytes
+        if elapsed > stats.max:
+            stats.max = elapsed
+
+
+class _Timer:
+    __slots__ = ('stage', 'bytes', '_start', '_profiling')
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.bytes = 0
+
+    def add_bytes(self, n: int) -> None:
+        self.bytes += n
+
+    def __enter__(self) -> '_Timer':
+        global _profiling
+        self._profiling = False
+        if (self.stage == _profile_stage and _profiler is not None
+                and not _profiling):
+            # cProfile supports one active profiler, so nested or concurrent
+            # runs of the stage are only timed.
+            with _lock:
+                if not _profiling:
+                    _profiling = self._profiling = True
+            if self._profiling:
+                _profiler.enable()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        global _profiling
+        elapsed = time.perf_counter() - self._start
+        if self._profiling and _profiler is not None:
+            _profiler.disable()
+            _profiling = False
+        _record(self.stage, elapsed, 1, self.bytes)
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def add_bytes(self, n: int) -> None:
+        pass
+
+    def __enter__(self) -> '_NullTimer':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timer(stage: str) -> Any:
+    """Returns a context manager that times `stage` if instrumentation is on.
+    """
+    return _Timer(stage) if _enabled else _NULL_TIMER
+
+
+def timed(stage: str) -> Callable[[F], F]:
+    """Decorates a function so that its calls are timed as `stage`."""
+    def decorator(fn: F) -> F:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with _Timer(stage):
+                return fn(*args, **kwargs)
+
+        return wrapper  # type: ignore
+
+    return decorator
+
+
+def count(stage: str, n: int = 1, nbytes: int = 0) -> None:
+    """Counts `n` events of `stage` without timing them."""
+    if _enabled:
+        _record(stage, 0.0, n, nbytes)
+
+
+def snapshot() -> Dict[str, Tuple[int, float, float, int]]:
+    """Returns the current stats in a picklable form for `merge`."""
+    with _lock:
+        return {
+            stage: (s.count, s.total, s.max, s.bytes)
+            for stage, s in _stats.items()
+        }
+
+
+def merge(other: Dict[str, Tuple[int, float, float, int]]) -> None:
+    """Adds the stats of, e.g., a worker process to this process's."""
+    with _lock:
+        for stage, (n, total, max_, nbytes) in other.items():
+            stats = _stats.get(stage)
+            if stats is None:
+                stats = _stats[stage] = StageStats()
+            stats.count += n
+            stats.total += total
+            stats.bytes += nbytes
+            stats.max = max(stats.max, max_)
+
+
+class Collecting:
+    """Wraps a function run in a worker process to send its stats back.
+
+    Calling it returns the function's result and the stats recorded during
+    the call. Pass the stats to `merge` in the parent process.
+    """
+    def __init__(self, fn: Callable[[Any], Any]):
+        self.fn = fn
+
+    def __call__(self, item: Any) -> Tuple[Any, Dict]:
+        reset()
+        return (self.fn(item), snapshot())
+
+
+def summary() -> Dict[str, Dict[str, Any]]:
+    with _lock:
+        return {stage: _stats[stage].to_json() for stage in sorted(_stats)}
+
+
+def dump(output: str) -> None:
+    """Writes the summary as JSON to `output`, or to stderr if it is '-'.
+
+    A profile, if any, is saved as `output`.<stage>.prof, or printed.
+    """
+    text = json.dumps(summary(), indent=2)
+    if output == '-':
+        print(text, file=sys.stderr)
+    else:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
+    if _profiler is not None and _profile_stage is not None:
+        if output == '-':
+            pstats.Stats(_profiler, stream=sys.stderr).sort_stats(
+                'cumulative').print_stats(20)
+        else:
+            _profiler.dump_stats('{}.{}.prof'.format(output, _profile_stage))
+
+
+def _init_from_env() -> None:
+    output = os.environ.get(ENV_VAR)
+    if not output:
+        return
+    enable(os.environ.get(PROFILE_ENV_VAR) or None)
+    # Worker processes send their stats to the parent instead.
+    if multiprocessing.parent_process() is None:
+        atexit.register(dump, output)
+
+
+_init_from_env()
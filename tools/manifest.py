@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""A manifest of source pictures that have been imported into Anki.
+
+For every source picture, the manifest records its content hash, its
+adjectives, the media files made from it, and the note that shows them. A
+rebuild compares the source folder against the manifest and only processes
+pictures that are new or changed. Sources whose size and modification time
+are unchanged are not even hashed.
+"""
+import json
+import os
+from os import path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from tools.process import Fingerprint, file_digest, filename_to_adjectives
+
+MANIFEST_VERSION = 1
+
+
+class ManifestEntry(NamedTuple):
+    # SHA-256 of the source file.
+    digest: str
+    size: int
+    mtime_ns: int
+    adjectives: Tuple[str, str]
+    # The media names of the left and the right half.
+    media: Tuple[str, str]
+    note_id: Optional[int] = None
+    # The fingerprint of the illustration, if known, for finding duplicates
+    # without decoding already imported pictures.
+    fingerprint: Optional[Fingerprint] = None
+    # The source that this one duplicates. Duplicates get no media or note.
+    duplicate_of: Optional[str] = None
+
+    def to_json(self) -> Dict:
+        return {
+            'digest': self.digest,
+            'size': self.size,
+            'mtime_ns': self.mtime_ns,
+            'adjectives': list(self.adjectives),
+            'media': list(self.media),
+            'note_id': self.note_id,
+            'fingerprint': (None if self.fingerprint is None else [
+                list(self.fingerprint.size), self.fingerprint.digest,
+                self.fingerprint.dhash
+            ]),
+            'duplicate_of': self.duplicate_of,
+        }
+
+    @staticmethod
+    def from_json(data: Dict) -> 'ManifestEntry':
+        fingerprint = data.get('fingerprint')
+        return ManifestEntry(
+            digest=data['digest'],
+            size=data['size'],
+            mtime_ns=data['mtime_ns'],
+            adjectives=tuple(data['adjectives']),  # type: ignore
+            media=tuple(data['media']),  # type: ignore
+            note_id=data.get('note_id'),
+            fingerprint=(None if fingerprint is None else Fingerprint(
+                tuple(fingerprint[0]), fingerprint[1],
+                fingerprint[2])),  # type: ignore
+            duplicate_of=data.get('duplicate_of'))
+
+
+class ManifestDiff(NamedTuple):
+    """How the source pictures differ from the manifest."""
+    new: List[str]
+    changed: List[str]
+    unchanged: List[str]
+    # Sources in the manifest that are gone from the folder.
+    removed: List[str]
+
+    def summary(self) -> str:
+        return '{} new, {} changed, {} unchanged, {} removed sources.'.format(
+            len(self.new), len(self.changed), len(self.unchanged),
+            len(self.removed))
+
+
+class Manifest:
+    """Maps source filenames, relative to the source folder, to entries."""
+    def __init__(self, filename: str, settings: str = ''):
+        """Loads the manifest from `filename` if it exists.
+
+        `settings` describes how media files get made, e.g., the encode
+        options. If it differs from the loaded manifest's, every source
+        counts as changed. The new settings are only saved once every
+        changed source has been recorded or forgotten.
+        """
+        self.filename = filename
+        self.settings = settings
+        self.entries: Dict[str, ManifestEntry] = {}
+        self._loaded_settings = settings
+        # Keys of entries that `diff` found changed and that have not been
+        # recorded again.
+        self._outdated: Set[str] = set()
+        try:
+            with open(filename) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        if data.get('version') != MANIFEST_VERSION:
+            raise Exception("Unsupported manifest version in " + filename)
+        self._loaded_settings = data.get('settings', '')
+        self.entries = {
+            source: ManifestEntry.from_json(entry)
+            for source, entry in data['entries'].items()
+        }
+
+    def _is_unchanged(self, source: str, key: str) -> bool:
+        entry = self.entries.get(key)
+        if entry is None:
+            return False
+        if self._loaded_settings != self.settings:
+            return False
+        st = os.stat(source)
+        if (st.st_size, st.st_mtime_ns) == (entry.size, entry.mtime_ns):
+            return True
+        return file_digest(source) == entry.digest
+
+    def diff(self, sources: Iterable[str], source_dir: str) -> ManifestDiff:
+        """Compares `sources`, files inside `source_dir`, to the manifest."""
+        result = ManifestDiff([], [], [], [])
+        seen = set()
+        for source in sources:
+            key = path.relpath(source, source_dir)
+            seen.add(key)
+            if key not in self.entries:
+                result.new.append(source)
+            elif self._is_unchanged(source, key):
+                result.unchanged.append(source)
+            else:
+                result.changed.append(source)
+                self._outdated.add(key)
+        result.removed.extend(
+            path.join(source_dir, key) for key in sorted(self.entries)
+            if key not in seen)
+        return result
+
+    def get(self, source: str, source_dir: str) -> Optional[ManifestEntry]:
+        return self.entries.get(path.relpath(source, source_dir))
+
+    def record(self,
+               source: str,
+               source_dir: str,
+               media: Tuple[str, str],
+               note_id: Optional[int],
+               fingerprint: Optional[Fingerprint] = None,
+               duplicate_of: Optional[str] = None) -> ManifestEntry:
+        """Records that `source` has been imported or that it is a duplicate.
+        """
+        st = os.stat(source)
+        entry = ManifestEntry(digest=file_digest(source),
+                              size=st.st_size,
+                              mtime_ns=st.st_mtime_ns,
+                              adjectives=filename_to_adjectives(source),
+                              media=media,
+                              note_id=note_id,
+                              fingerprint=fingerprint,
+                              duplicate_of=(None if duplicate_of is None else
+                                            path.relpath(
+                                                duplicate_of, source_dir)))
+        key = path.relpath(source, source_dir)
+        self.entries[key] = entry
+        self._outdated.discard(key)
+        return entry
+
+    def forget(self, source: str, source_dir: str) -> None:
+        key = path.relpath(source, source_dir)
+        self.entries.pop(key, None)
+        self._outdated.discard(key)
+
+    def save(self) -> None:
+        """Writes the manifest atomically.
+
+        If changed sources failed to be recorded, the old settings are kept,
+        so that the next `diff` still finds those sources changed.
+        """
+        settings = (self._loaded_settings
+                    if self._outdated else self.settings)
+        data = {
+            'version': MANIFEST_VERSION,
+            'settings': settings,
+            'entries': {
+                source: entry.to_json()
+                for source, entry in sorted(self.entries.items())
+            },
+        }
+        tmp = self.filename + '.part'
+        with open(tmp, 'w') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+        os.replace(tmp, self.filename)
+        self._loaded_settings = settings
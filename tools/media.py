@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Stages generated pictures for Anki's media folder.
+
+Staged files are named after a hash of their content. A picture that is
+already in the media folder keeps its existing name instead of being copied
+again under a new one. New pictures are copied into a staging directory as
+they are staged, so their sources may go away, and are moved into the media
+folder in one bulk step.
+"""
+import hashlib
+import os
+from os import path
+import re
+import shutil
+import tempfile
+from typing import Dict, List, Optional, Tuple
+
+from tools import instrument
+
+# Length of the content hash in media filenames.
+DIGEST_LENGTH = 16
+_MEDIA_NAME_RE = re.compile(r'_([0-9a-f]{%d})\.[^.]+$' % DIGEST_LENGTH)
+
+
+def _content_digest(filename: str) -> str:
+    sha = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            sha.update(chunk)
+    return sha.hexdigest()[:DIGEST_LENGTH]
+
+
+def _sanitize(prefix: str) -> str:
+    return re.sub(r'[^\w-]+', '_', prefix).strip('_')
+
+
+def _media_name(digest: str, ext: str, prefix: str) -> str:
+    return (_sanitize(prefix) + '_' if prefix else '') + digest + ext
+
+
+def content_media_name(filename: str, prefix: str = '') -> str:
+    """Returns the media name that `MediaStager` would give a new file."""
+    return _media_name(_content_digest(filename),
+                       path.splitext(filename)[1], prefix)
+
+
+class MediaStager:
+    """Stages media for a media folder.
+
+    Use as a context manager, or call `close`, to remove the staging
+    directory with whatever was not flushed.
+    """
+    def __init__(self, media_dir: str, staging_dir: Optional[str] = None):
+        self.media_dir = media_dir
+        # Content digests of media files staged before, found by their names
+        # alone, so that the media folder's content does not get hashed.
+        self._names: Dict[str, str] = {}
+        for entry in os.scandir(media_dir):
+            match = _MEDIA_NAME_RE.search(entry.name)
+            if match and entry.is_file():
+                self._names.setdefault(match[1], entry.name)
+        # Copies of the staged files, in a new directory in `staging_dir`.
+        self._staging = tempfile.TemporaryDirectory(prefix='media-',
+                                                    dir=staging_dir)
+        # Pairs of staged copy and media name waiting for `flush`.
+        self._pending: List[Tuple[str, str]] = []
+        self.reused = 0
+
+    def __enter__(self) -> 'MediaStager':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._staging.cleanup()
+        self._pending = []
+
+    def stage(self, filename: str, prefix: str = '') -> str:
+        """Returns the media name for `filename`'s content.
+
+        Unless the media folder already has the same content, the file is
+        copied into the staging directory now and moved into the media
+        folder by the next `flush`.
+        """
+        digest = _content_digest(filename)
+        if digest in self._names:
+            self.reused += 1
+            instrument.count('media_reused')
+            return self._names[digest]
+        name = _media_name(digest, path.splitext(filename)[1], prefix)
+        staged = path.join(self._staging.name, name)
+        with instrument.timer('media_stage') as t:
+            shutil.copyfile(filename, staged)
+            t.add_bytes(path.getsize(staged))
+        self._names[digest] = name
+        self._pending.append((staged, name))
+        return name
+
+    def flush(self) -> List[str]:
+        """Moves all pending files into the media folder.
+
+        Returns the names of the new media files.
+        """
+        added = []
+        for staged, name in self._pending:
+            dest = path.join(self.media_dir, name)
+            tmp = dest + '.part'
+            with instrument.timer('media_add') as t:
+                shutil.move(staged, tmp)
+                os.replace(tmp, dest)
+                t.add_bytes(path.getsize(dest))
+            added.append(name)
+        self._pending = []
+        return added
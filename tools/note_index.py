@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""A persistent index from adjectives to the notes that teach them.
+
+The index lives in a sidecar SQLite file next to the collection. It maps the
+normalized text of each note's first field, and each of its tags, to the
+note's id. Refreshing it only reparses notes whose modification time changed
+since the last refresh, so repeated audits skip the HTML parsing of the whole
+collection.
+"""
+from os import path
+import sqlite3
+from typing import TYPE_CHECKING, List, Tuple
+
+from tools.anki import (IMAGE_OCCLUSION_MODEL, ModelNameCache, field_text,
+                        remove_silent_hyphens)
+
+if TYPE_CHECKING:
+    import anki
+
+# The number of note ids per query when loading changed notes.
+IDS_PER_QUERY = 500
+
+SCHEMA = """
+create table if not exists notes (
+    id integer primary key,
+    mod integer not null,
+    model_name text not null,
+    -- Whether any field mentions an image from deutschlernerblog.
+    has_adjective_image integer not null
+);
+create table if not exists terms (
+    term text not null,
+    nid integer not null references notes(id) on delete cascade,
+    kind text not null  -- 'field' or 'tag'
+);
+create index if not exists terms_term on terms(term);
+create index if not exists terms_nid on terms(nid);
+"""
+
+
+def normalize_text(field: str) -> str:
+    """Returns the plain text of a note field for matching adjectives."""
+    return remove_silent_hyphens(field_text(field)).strip()
+
+
+def default_index_path(collection_path: str) -> str:
+    return path.splitext(collection_path)[0] + '.adjective-index.sqlite'
+
+
+class NoteIndex:
+    def __init__(self, filename: str):
+        self.db = sqlite3.connect(filename)
+        self.db.execute('pragma foreign_keys = on')
+        self.db.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.db.close()
+
+    def refresh(self,
+                col: 'anki.collection._Collection') -> Tuple[int, int]:
+        """Brings the index up to date with `col`.
+
+        Returns the number of reindexed and of removed notes.
+        """
+        current = dict(col.db.all("select id, mod from notes"))
+        indexed = dict(self.db.execute("select id, mod from notes"))
+        changed = sorted(nid for nid, mod in current.items()
+                         if indexed.get(nid) != mod)
+        removed = [nid for nid in indexed if nid not in current]
+        model_names = ModelNameCache(col)
+        with self.db:
+            self.db.executemany("delete from notes where id = ?",
+                                [(nid, ) for nid in removed + changed])
+            for i in range(0, len(changed), IDS_PER_QUERY):
+                chunk = changed[i:i + IDS_PER_QUERY]
+                rows = col.db.all(
+                    "select id, mid, mod, flds, tags from notes where id in (" +
+                    ",".join("?" * len(chunk)) + ")", *chunk)
+                for nid, mid, mod, flds, tags in rows:
+                    self._index_note(nid, model_names.get(mid), mod,
+                                     flds.split('\x1f'), tags.split())
+        return (len(changed), len(removed))
+
+    def _index_note(self, nid: int, model_name: str, mod: int,
+                    fields: List[str], tags: List[str]) -> None:
+        has_image = any(f.find('Adjektive') != -1 for f in fields)
+        self.db.execute("insert into notes values (?, ?, ?, ?)",
+                        (nid, mod, model_name, has_image))
+        terms = [(normalize_text(fields[0]).casefold(), nid, 'field')]
+        terms.extend((tag.casefold(), nid, 'tag') for tag in tags)
+        self.db.executemany("insert into terms values (?, ?, ?)", terms)
+
+    def find(self, adj: str) -> List[int]:
+        """Returns the ids of notes with `adj` as first field or as a tag."""
+        return [
+            nid for nid, in self.db.execute(
+                "select distinct nid from terms where term = ? order by nid",
+                (adj.casefold(), ))
+        ]
+
+    def get_related_notes(self, adj: str) -> Tuple[List[int], List[int]]:
+        """Returns the ids of image occlusion and of normal notes for `adj`.
+
+        This mirrors `tools.anki.get_related_notes`, but matches the
+        normalized first field and the tags instead of running a full text
+        search.
+        """
+        rows = self.db.execute(
+            "select distinct n.id, n.model_name, n.has_adjective_image, " +
+            "t.kind from terms t join notes n on n.id = t.nid " +
+            "where t.term = ? order by n.id", (adj.casefold(), ))
+        image_occlusion_notes: List[int] = []
+        normal_notes: List[int] = []
+        for nid, model_name, has_image, kind in rows:
+            if model_name == IMAGE_OCCLUSION_MODEL:
+                target = image_occlusion_notes
+            elif kind == 'field' or has_image:
+                target = normal_notes
+            else:
+                continue
+            if nid not in target:
+                target.append(nid)
+        return (image_occlusion_notes, normal_notes)
+
+    def get_related_double_notes(
+            self, adj0: str, adj1: str) -> Tuple[List[int], List[int]]:
+        """Returns the ids of the notes related to both adjectives.
+
+        This mirrors `tools.anki.get_related_double_notes_in_bulk` for one
+        pair, with the matching of `get_related_notes`.
+        """
+        io0, normal0 = self.get_related_notes(adj0)
+        io1, normal1 = self.get_related_notes(adj1)
+        return ([nid for nid in io0 if nid in io1],
+                [nid for nid in normal0 if nid in normal1])
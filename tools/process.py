@@ -2,158 +2,639 @@
 # -*- coding: utf-8 -*-
 """A collection of utilities for processing scraped images."""
 import abc
-from contextlib import closing
+import collections
+from concurrent import futures
+import functools
+import hashlib
+import io
+import os
 from os import path
-import tempfile
-from typing import Tuple, Union
+import traceback
+from typing import (Any, Callable, Deque, Dict, Iterable, Iterator, List,
+                    NamedTuple, Optional, Sequence, Tuple, Union)
 
-from PIL import Image, ImageChops
+import numpy as np
+from PIL import Image
+
+# FilenameError is what filename_to_adjectives raises.
+from tools.filenames import (  # noqa: F401
+    FilenameError, check_source_names, default_parser, find_bad_source_names,
+    iter_source_files)
+from tools import instrument
 
 
 def filename_to_adjectives(filename: str) -> Tuple[str, str]:
     """
     >>> filename_to_adjectives("wild_zahm_Adjektive_Deutsch_deutschlernerblog.png")
     ("wild", "zahm")
+
+    Raises FilenameError for filenames that the rules in
+    tools/filename_rules.json do not cover.
     """
-    filename = path.basename(filename)
-    adj_idx = filename.find("Adjektive")
-    if adj_idx == -1:
-        raise Exception(
-            "Expected a filename with 'Adjektive' in it but got: " + filename)
-    if adj_idx == 0:
-        raise Exception("Expected a filename with a trunk in it but got: " +
-                        filename)
-
-    trunk = filename[:adj_idx - 1]
-    if trunk.find('_') != -1:
-        sep = '_'
-    elif trunk.find('-') != -1:
-        sep = '-'
-    else:
-        raise Exception(
-            "Expected a filename with '_' or '-' as separator but got: " +
-            trunk)
+    return default_parser().parse(filename)
 
-    words = trunk.split(sep)
-    if len(words) == 2:
-        return (words[0], words[1])
 
-    if len(words) != 3:
-        raise Exception("Expected two or three words but got: " + str(words))
+@functools.lru_cache(maxsize=None)
+def _file_digest(filename: str, mtime_ns: int, size: int) -> str:
+    del mtime_ns, size  # Only used to invalidate the memoized digest.
+    sha = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
 
-    if words[1] == 'nicht':
-        return (words[0], 'nicht ' + words[2])
 
-    # Special cases of dirty input data
-    if words == ['neugierig', 'gleichgültig', 'unehrlich']:
-        return ('neugierig', 'gleichgültig')
-    elif words[2] == '2':
-        return (words[0], words[1])
+def file_digest(filename: str) -> str:
+    """Returns the SHA-256 of the file's content.
 
-    raise Exception("When given three words, expected the second of them to " +
-                    "start with nicht, but got: " + str(words) +
-                    ". Add a handler " + "to this function")
+    The digest is memoized for as long as the file's mtime and size stay the
+    same.
+    """
+    st = os.stat(filename)
+    return _file_digest(path.abspath(filename), st.st_mtime_ns, st.st_size)
 
 
 def get_picture_size(pic_filename: str) -> Tuple[int, int]:
+    # Image.open only parses the header, so this does not decode any pixels.
     with Image.open(pic_filename) as im:
         return im.size
 
 
-def remove_subs(pic: Image) -> Image:
-    size = pic.size
-    if size[1] == 402:
-        return pic.crop((0, 0, size[0], 329))
-    if size[1] == 803:
-        return pic.crop((0, 0, size[0], 659))
-    raise Exception("Not Implemented")
+# Subtitle cut lines measured by hand for the layouts served by
+# deutschlernerblog, keyed by picture height.
+KNOWN_SUBS_CUTS = {402: 329, 803: 659}
+# The share of the blank gap between a picture and its subtitles that stays
+# above the cut. It matches the hand-measured cut of the 640x402 layout.
+SUBS_GAP_MARGIN = 13 / 30
+# Subtitles never take more than this share of a picture's height.
+MAX_SUBS_SHARE = 0.35
+
+_detected_subs_cuts: Dict[Tuple[int, int, str], int] = {}
+
+
+def get_layout_template(filename: str) -> str:
+    """Returns the part of a scraped filename that identifies its layout.
+
+    >>> get_layout_template("wild_zahm_Adjektive_Deutsch_deutschlernerblog.png")
+    'Adjektive_Deutsch_deutschlernerblog.png'
+    """
+    basename = path.basename(filename)
+    adj_idx = basename.find("Adjektive")
+    return basename[adj_idx:] if adj_idx != -1 else ''
+
+
+def detect_subs_cut(pic: Image.Image) -> int:
+    """Finds the row at which the subtitles of `pic` should be cut off.
+
+    Subtitles are dark text on the picture's bottom background, separated
+    from the illustration by a blank gap. The gap is found with vectorized
+    per-row statistics: a row is blank if hardly any of its pixels differ
+    from the background colour.
+    """
+    rgb = np.asarray(pic.convert('RGB'), dtype=np.int16)
+    background = np.median(rgb[-1], axis=0)
+    ink = (np.abs(rgb - background).max(axis=2) > 32).mean(axis=1)
+    blank = ink <= 0.002
+    height = len(blank)
+    # Runs of blank rows as [start, end) pairs.
+    edges = np.flatnonzero(
+        np.diff(np.concatenate(([0], blank.astype(np.int8), [0]))))
+    starts, ends = edges[::2], edges[1::2]
+    # The gap sits between the illustration and the text. That excludes the
+    # bottom margin and, by requiring a minimal length, gaps between lines.
+    candidates = ((starts > 0) & (ends < height) &
+                  (starts >= height * (1 - MAX_SUBS_SHARE)) &
+                  (ends - starts >= max(2, height // 50)))
+    if not candidates.any():
+        raise Exception("Could not find subtitles in a picture of size " +
+                        str(pic.size))
+    lengths = np.where(candidates, ends - starts, 0)
+    gap = int(np.argmax(lengths))
+    return int(starts[gap] +
+               round((ends[gap] - starts[gap]) * SUBS_GAP_MARGIN))
+
+
+def get_subs_box(size: Tuple[int, int],
+                 detect: Optional[Callable[[], int]] = None,
+                 template: str = '') -> Tuple[int, int, int, int]:
+    """Returns the crop box that cuts the subtitles off a picture of `size`.
+
+    Known layouts are cut without looking at the picture. Otherwise `detect`
+    is called for the cut, e.g., `detect_subs_cut` on the picture, and the
+    cut is memoized for all pictures with the same size and layout
+    `template`.
+    """
+    if size[1] in KNOWN_SUBS_CUTS:
+        return (0, 0, size[0], KNOWN_SUBS_CUTS[size[1]])
+    key = (size[0], size[1], template)
+    if key not in _detected_subs_cuts:
+        if detect is None:
+            raise Exception("Not Implemented")
+        _detected_subs_cuts[key] = detect()
+    return (0, 0, size[0], _detected_subs_cuts[key])
+
+
+def remove_subs(pic: Image.Image) -> Image.Image:
+    return pic.crop(get_subs_box(pic.size, lambda: detect_subs_cut(pic)))
+
+
+def get_split_boxes(
+    size: Tuple[int, int]
+) -> Tuple[Tuple[int, int, int, int], Tuple[int, int, int, int]]:
+    return ((0, 0, size[0] // 2, size[1]), (size[0] // 2, 0, size[0], size[1]))
 
 
 def split_double_adjective_img(
         pic: Image.Image) -> Tuple[Image.Image, Image.Image]:
-    size = pic.size
-    return (
-        pic.crop((0, 0, pic.size[0] // 2, size[1])),
-        pic.crop((pic.size[0] // 2, 0, pic.size[0], size[1])),
-    )
+    left_box, right_box = get_split_boxes(pic.size)
+    return (pic.crop(left_box), pic.crop(right_box))
+
+
+Box = Tuple[float, float, float, float]
+# Modes that Image.reduce supports. Palette images need a resize.
+_REDUCIBLE_MODES = ('L', 'LA', 'RGB', 'RGBA', 'I', 'F')
+
+
+class ImagePlan:
+    """A lazy crop-then-resize of a source image.
+
+    Crops and resizes are only recorded. Consecutive operations are composed
+    into a single crop box, expressed in source coordinates, and a single
+    output size, so rendering a plan takes one decode and one resample no
+    matter how many operations it went through.
+    """
+    def __init__(self,
+                 source: Union[str, Image.Image],
+                 box: Optional[Box] = None,
+                 size: Optional[Tuple[int, int]] = None,
+                 source_size: Optional[Tuple[int, int]] = None,
+                 resample: Optional[int] = None):
+        self.source = source
+        self.box = box
+        self.size = size
+        self._source_size = source_size
+        # A Pillow resampling filter, e.g., Image.LANCZOS. None reduces
+        # whole-number downscales by averaging boxes of pixels and uses
+        # Pillow's default filter for other scales.
+        self.resample = resample
+
+    def get_source_size(self) -> Tuple[int, int]:
+        if self._source_size is None:
+            if isinstance(self.source, str):
+                self._source_size = get_picture_size(self.source)
+            else:
+                self._source_size = self.source.size
+        return self._source_size
+
+    def get_box(self) -> Box:
+        if self.box is None:
+            width, height = self.get_source_size()
+            return (0, 0, width, height)
+        return self.box
+
+    def get_size(self) -> Tuple[int, int]:
+        if self.size is not None:
+            return self.size
+        x0, y0, x1, y1 = self.get_box()
+        return (int(x1 - x0), int(y1 - y0))
+
+    def crop(self, box: Tuple[int, int, int, int]) -> 'ImagePlan':
+        """Returns a plan cropping `box`, given in this plan's coordinates."""
+        x0, y0, x1, y1 = self.get_box()
+        width, height = self.get_size()
+        scale_x, scale_y = (x1 - x0) / width, (y1 - y0) / height
+        new_box = (x0 + box[0] * scale_x, y0 + box[1] * scale_y,
+                   x0 + box[2] * scale_x, y0 + box[3] * scale_y)
+        new_size = (None if self.size is None else
+                    (box[2] - box[0], box[3] - box[1]))
+        return ImagePlan(self.source, new_box, new_size,
+                         self.get_source_size(), self.resample)
+
+    def resize(self,
+               size: Tuple[int, int],
+               resample: Optional[int] = None) -> 'ImagePlan':
+        return ImagePlan(self.source, self.box, size, self.get_source_size(),
+                         self.resample if resample is None else resample)
+
+    def describe(self) -> str:
+        """Returns a canonical description of the planned operations."""
+        return 'box={};size={};resample={}'.format(self.get_box(),
+                                                   self.get_size(),
+                                                   self.resample)
+
+    def get_reduce_factor(self) -> Optional[int]:
+        """Returns the factor if the plan shrinks by a whole number.
+
+        The box may be up to factor - 1 pixels larger than the scaled size,
+        as when halving an odd number of pixels. Those pixels get dropped.
+        """
+        box = self.get_box()
+        if any(c != int(c) for c in box):
+            return None
+        width, height = self.get_size()
+        box_width, box_height = box[2] - box[0], box[3] - box[1]
+        if not width or not height:
+            return None
+        factor = int(box_width // width)
+        if (factor < 2 or not 0 <= box_width - width * factor < factor
+                or not 0 <= box_height - height * factor < factor):
+            return None
+        return factor
+
+    def apply(self, source_img: Image.Image) -> Image.Image:
+        """Runs the plan on an already decoded source image."""
+        box = self.get_box()
+        size = self.get_size()
+        int_box = (int(box[0]), int(box[1]), int(box[2]), int(box[3]))
+        factor = (self.get_reduce_factor() if self.resample is None
+                  and source_img.mode in _REDUCIBLE_MODES else None)
+        if factor is not None:
+            # Averages factor x factor blocks straight from the source,
+            # which touches each source pixel once and needs no crop.
+            with instrument.timer('reduce'):
+                return source_img.reduce(
+                    factor, (int_box[0], int_box[1], int_box[0] +
+                             size[0] * factor, int_box[1] + size[1] * factor))
+        if self.resample is not None and (
+                int_box != box
+                or size != (int_box[2] - int_box[0], int_box[3] - int_box[1])):
+            with instrument.timer('resize'):
+                return source_img.resize(size, self.resample, box=box)
+        if int_box == box:
+            with instrument.timer('crop'):
+                img = source_img.crop(int_box)
+            if img.size == size:
+                return img
+            with instrument.timer('resize'):
+                return img.resize(size)
+        with instrument.timer('resize'):
+            return source_img.resize(size, box=box)
+
+    def render(self) -> Image.Image:
+        """Decodes the source once and returns the planned image."""
+        if isinstance(self.source, str):
+            with Image.open(self.source) as source_img:
+                with instrument.timer('decode'):
+                    source_img.load()
+                return self.apply(source_img)
+        return self.apply(self.source)
+
+
+def render_plans(plans: Sequence[ImagePlan]) -> List[Image.Image]:
+    """Renders `plans`, decoding every distinct source only once."""
+    by_source: Dict[Union[str, int], List[int]] = {}
+    for i, plan in enumerate(plans):
+        key = plan.source if isinstance(plan.source,
+                                        str) else id(plan.source)
+        by_source.setdefault(key, []).append(i)
+    rendered: List[Optional[Image.Image]] = [None] * len(plans)
+    for idxs in by_source.values():
+        source = plans[idxs[0]].source
+        if isinstance(source, str):
+            with Image.open(source) as source_img:
+                with instrument.timer('decode'):
+                    source_img.load()
+                for i in idxs:
+                    rendered[i] = plans[i].apply(source_img)
+        else:
+            for i in idxs:
+                rendered[i] = plans[i].apply(source)
+    return [img for img in rendered if img is not None]
+
+
+class Fingerprint(NamedTuple):
+    size: Tuple[int, int]
+    # SHA-256 of the decoded pixels. Equal digests mean identical pictures.
+    digest: str
+    # A 64-bit difference hash. Near-duplicates have a small Hamming distance.
+    dhash: int
+
+
+def compute_dhash(img: Image.Image, hash_size: int = 8) -> int:
+    """Returns the difference hash of `img`.
+
+    Each bit tells whether a pixel of a tiny grayscale thumbnail is brighter
+    than its right neighbour, so the hash survives rescaling and
+    re-encoding.
+    """
+    thumb = img.convert('L').resize((hash_size + 1, hash_size),
+                                    Image.Resampling.BILINEAR)
+    pixels = np.asarray(thumb, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+def compute_fingerprint(img: Image.Image) -> Fingerprint:
+    sha = hashlib.sha256(img.mode.encode('ascii'))
+    sha.update(img.tobytes())
+    if img.mode in ('P', 'PA'):
+        # The pixels are only indices, so the colours are in the palette.
+        sha.update(bytes(img.getpalette('RGBA') or []))
+    return Fingerprint(img.size, sha.hexdigest(), compute_dhash(img))
 
 
 class AdjectivePic(abc.ABC):
-    @abc.abstractmethod
+    """An adjective picture described by a lazy `ImagePlan`.
+
+    Transformations only extend the plan, and sizes are computed from the
+    source's header, so nothing is decoded until the picture is rendered
+    with `to_image` or written once with `save`.
+
+    Two pictures are equal if their metadata and pixels are. Pixels are
+    compared through cached fingerprints, after cheaper checks on the size
+    and on the files' digests.
+    """
+    def __init__(self,
+                 filename: Optional[str],
+                 image: Optional[Image.Image] = None,
+                 plan: Optional[ImagePlan] = None):
+        if plan is None:
+            if image is not None:
+                plan = ImagePlan(image)
+            elif filename is not None:
+                plan = ImagePlan(filename)
+            else:
+                raise Exception(
+                    "Expected either a filename, an image, or a plan.")
+        # The file holding exactly this picture, if there is one.
+        self.filename = filename
+        self.plan = plan
+        self._fingerprint: Optional[Fingerprint] = None
+
     def get_size(self) -> Tuple[int, int]:
-        pass
+        return self.plan.get_size()
 
-    @abc.abstractmethod
     def get_filename(self) -> str:
-        pass
+        if self.filename is None:
+            raise Exception("This picture only exists in memory. " +
+                            "Call save() before asking for its filename.")
+        return self.filename
 
     @abc.abstractmethod
     def remove_subs(self):
         pass
 
+    @abc.abstractmethod
+    def get_metadata(self) -> Tuple:
+        """Returns everything but the pixels that makes up this picture."""
+
+    def get_fingerprint(self) -> Fingerprint:
+        """Returns the picture's fingerprint, decoding it on the first call."""
+        if self._fingerprint is None:
+            with self.to_image() as img:
+                self._fingerprint = compute_fingerprint(img)
+        return self._fingerprint
+
     def to_image(self) -> Image.Image:
-        return Image.open(self.get_filename())
+        """Returns a fresh image that the caller is responsible for closing."""
+        return self.plan.render()
 
-    __hash__ = None  # type: ignore
+    def get_subs_box(self) -> Tuple[int, int, int, int]:
+        source = self.plan.source
+        template = (get_layout_template(source)
+                    if isinstance(source, str) else '')
+        return get_subs_box(self.get_size(), self._detect_subs_cut, template)
 
+    def _detect_subs_cut(self) -> int:
+        with self.to_image() as img:
+            return detect_subs_cut(img)
 
-class SingleAdjectivePic(AdjectivePic):
-    def __init__(self, filename: str, adjective: str, subs: bool):
+    def save(self, filename: str) -> str:
+        """Writes the picture to `filename` and returns the filename."""
+        with self.to_image() as img:
+            img.save(filename)
         self.filename = filename
+        return filename
+
+    def __eq__(self, other):
+        if not isinstance(other, AdjectivePic):
+            return NotImplemented
+        if (type(self) != type(other)
+                or self.get_metadata() != other.get_metadata()
+                or self.get_size() != other.get_size()):
+            return False
+        if (self.filename is not None and other.filename is not None
+                and file_digest(self.filename) == file_digest(
+                    other.filename)):
+            return True
+        return self.get_fingerprint().digest == other.get_fingerprint().digest
+
+    def __hash__(self):
+        return hash((type(self), self.get_metadata(), self.get_size()))
+
+
+class EncodeOptions(NamedTuple):
+    """How to encode a picture. The defaults are Pillow's PNG defaults."""
+    # One of 'png', 'webp' or 'jpeg'.
+    format: str = 'png'
+    # PNG only.
+    optimize: bool = False
+    compress_level: int = 6
+    # Store PNGs with at most this many colours as palette images, which
+    # is lossless. With `quantize`, reduce other PNGs to this many colours.
+    colors: Optional[int] = None
+    quantize: bool = False
+    # WebP and JPEG only.
+    quality: int = 80
+
+    def get_extension(self) -> str:
+        return {'png': '.png', 'webp': '.webp', 'jpeg': '.jpg'}[self.format]
+
+
+# Settings that make the pictures synced to every device a lot smaller.
+COMPACT_ENCODE_OPTIONS = EncodeOptions(optimize=True,
+                                       compress_level=9,
+                                       colors=256)
+
+
+class EncodedPic(NamedTuple):
+    filename: str
+    bytes: int
+    # The size with Pillow's default PNG settings, if it was measured.
+    baseline_bytes: Optional[int] = None
+
+
+def to_palette(img: Image.Image, colors: int) -> Optional[Image.Image]:
+    """Losslessly converts `img` to a palette image if it has few colours."""
+    rgba = np.ascontiguousarray(np.asarray(img.convert('RGBA')))
+    packed = rgba.view(np.uint32).reshape(rgba.shape[:2])
+    palette, indices = np.unique(packed, return_inverse=True)
+    if len(palette) > min(colors, 256):
+        return None
+    pic = Image.fromarray(indices.reshape(packed.shape).astype(np.uint8), 'P')
+    pic.putpalette(palette.view(np.uint8).tobytes(), rawmode='RGBA')
+    return pic
+
+
+def encode_image(img: Image.Image, options: EncodeOptions) -> bytes:
+    with instrument.timer('encode') as t:
+        data = _encode_image(img, options)
+        t.add_bytes(len(data))
+    return data
+
+
+def _encode_image(img: Image.Image, options: EncodeOptions) -> bytes:
+    if options.format == 'png':
+        if options.colors is not None and img.mode != 'P':
+            img = (to_palette(img, options.colors)
+                   or (img.quantize(options.colors,
+                                    method=Image.Quantize.FASTOCTREE)
+                       if options.quantize else img))
+        params: Dict[str, Any] = {
+            'optimize': options.optimize,
+            'compress_level': options.compress_level
+        }
+    elif options.format == 'webp':
+        params = {'quality': options.quality, 'method': 6}
+    elif options.format == 'jpeg':
+        if img.mode in ('RGBA', 'LA', 'P'):
+            rgba = img.convert('RGBA')
+            img = Image.new('RGB', rgba.size, 'white')
+            img.paste(rgba, mask=rgba.getchannel('A'))
+        params = {'quality': options.quality, 'optimize': True}
+    else:
+        raise Exception("Unsupported format: " + options.format)
+    buf = io.BytesIO()
+    img.save(buf, format=options.format, **params)
+    return buf.getvalue()
+
+
+def save_image(img: Image.Image,
+               filename: str,
+               options: EncodeOptions = EncodeOptions(),
+               measure_savings: bool = False) -> EncodedPic:
+    """Encodes `img` into `filename`.
+
+    With `measure_savings`, the picture is also encoded with Pillow's
+    default PNG settings to find out how many bytes `options` save.
+    """
+    data = encode_image(img, options)
+    with open(filename, 'wb') as f:
+        f.write(data)
+    baseline = (len(encode_image(img, EncodeOptions()))
+                if measure_savings else None)
+    return EncodedPic(filename, len(data), baseline)
+
+
+class EncodeReport:
+    """Sums up the sizes of encoded pictures."""
+    def __init__(self):
+        self.count = 0
+        self.bytes = 0
+        self.measured = 0
+        self.measured_bytes = 0
+        self.baseline_bytes = 0
+
+    def add(self, pic: EncodedPic) -> None:
+        self.count += 1
+        self.bytes += pic.bytes
+        if pic.baseline_bytes is not None:
+            self.measured += 1
+            self.measured_bytes += pic.bytes
+            self.baseline_bytes += pic.baseline_bytes
+
+    def summary(self) -> str:
+        lines = ['Encoded {} pictures into {} bytes.'.format(
+            self.count, self.bytes)]
+        if self.measured:
+            saved = self.baseline_bytes - self.measured_bytes
+            lines.append(
+                'Saved {} bytes ({:.0%}) over default PNGs on {} pictures.'.
+                format(saved, saved / self.baseline_bytes, self.measured))
+        return '\n'.join(lines)
+
+
+def save_pics(pics: Sequence[Tuple[AdjectivePic, str]],
+              options: EncodeOptions = EncodeOptions(),
+              measure_savings: bool = False) -> List[EncodedPic]:
+    """Saves each picture to its filename.
+
+    Pictures derived from the same source, e.g., both halves of a
+    `DoubleAdjectivePic`, share a single decode of that source.
+    """
+    imgs = render_plans([pic.plan for pic, _ in pics])
+    encoded = []
+    for (pic, filename), img in zip(pics, imgs):
+        with img:
+            encoded.append(
+                save_image(img, filename, options, measure_savings))
+        pic.filename = filename
+    return encoded
+
+
+class SingleAdjectivePic(AdjectivePic):
+    def __init__(self,
+                 filename: Optional[str],
+                 adjective: str,
+                 subs: bool,
+                 image: Optional[Image.Image] = None,
+                 plan: Optional[ImagePlan] = None):
+        super().__init__(filename, image, plan)
         self.adjective = adjective
         self.subs = subs
 
     @staticmethod
-    def from_image(img: Image, adjective: str,
+    def from_image(img: Image.Image, adjective: str,
                    subs: bool) -> 'SingleAdjectivePic':
-        with tempfile.NamedTemporaryFile(delete=False,
-                                         prefix=adjective +
-                                         ('_sub' if subs else '') + '_',
-                                         suffix='.png') as tmp:
-            img.save(tmp)
-            filename = tmp.name
-        return SingleAdjectivePic(filename, adjective, subs)
-
-    def get_size(self) -> Tuple[int, int]:
-        return get_picture_size(self.filename)
-
-    def get_filename(self) -> str:
-        return self.filename
+        return SingleAdjectivePic(None, adjective, subs, image=img)
 
-    def remove_subs(self) -> AdjectivePic:
+    def remove_subs(self) -> 'SingleAdjectivePic':
         if not self.subs:
             return self
-        with self.to_image() as img:
-            no_sub_img = remove_subs(img)
-        return SingleAdjectivePic.from_image(no_sub_img,
-                                             adjective=self.adjective,
-                                             subs=False)
-
-    def resize(self, scale: float) -> 'SingleAdjectivePic':
+        return SingleAdjectivePic(None,
+                                  self.adjective,
+                                  subs=False,
+                                  plan=self.plan.crop(self.get_subs_box()))
+
+    def resize(self,
+               scale: float,
+               resample: Optional[int] = None) -> 'SingleAdjectivePic':
+        """Scales the picture.
+
+        `resample` is a Pillow filter. By default, scales such as 0.5 are
+        done by averaging blocks of source pixels, the fastest way there is.
+        """
         old_size = self.get_size()
-        with self.to_image() as img:
-            new_img = img.resize(
-                (int(old_size[0] * scale), int(old_size[1] * scale)))
-        return SingleAdjectivePic.from_image(new_img,
-                                             adjective=self.adjective,
-                                             subs=self.subs)
-
-    def __eq__(self, other):
-        with self.to_image() as img,\
-                other.to_image() as other_img:
-            diff = ImageChops.difference(img, other_img)
-            if diff.getbbox():
-                return True
+        return SingleAdjectivePic(
+            None,
+            self.adjective,
+            self.subs,
+            plan=self.plan.resize(
+                (int(old_size[0] * scale), int(old_size[1] * scale)),
+                resample))
+
+    def fit(self,
+            max_dimension: int,
+            resample: Optional[int] = None) -> 'SingleAdjectivePic':
+        """Scales the picture down so that neither side exceeds the limit."""
+        width, height = self.get_size()
+        scale = max_dimension / max(width, height)
+        if scale >= 1:
+            return self
+        return SingleAdjectivePic(
+            None,
+            self.adjective,
+            self.subs,
+            plan=self.plan.resize((max(1, round(width * scale)),
+                                   max(1, round(height * scale))), resample))
 
-        return (self.adjective == other.adjective
-                and self.adjective == other.adjective
-                and self.subs == other.subs)
+    def get_metadata(self) -> Tuple:
+        return (self.adjective, self.subs)
 
 
 class DoubleAdjectivePic(AdjectivePic):
-    def __init__(self, filename: str, left_adjective: str,
-                 right_adjective: str, subs: bool):
-        self.filename = filename
+    def __init__(self,
+                 filename: Optional[str],
+                 left_adjective: str,
+                 right_adjective: str,
+                 subs: bool,
+                 image: Optional[Image.Image] = None,
+                 plan: Optional[ImagePlan] = None):
+        super().__init__(filename, image, plan)
         self.subs = subs
         self.left_adjective, self.right_adjective = (left_adjective,
                                                      right_adjective)
@@ -167,53 +648,176 @@ class DoubleAdjectivePic(AdjectivePic):
                                   subs=True)
 
     @staticmethod
-    def from_image(img: Image, left_adjective: str, right_adjective: str,
+    def from_image(img: Image.Image, left_adjective: str, right_adjective: str,
                    subs: bool) -> 'DoubleAdjectivePic':
-        with tempfile.NamedTemporaryFile(delete=False,
-                                         prefix=left_adjective + '_' +
-                                         right_adjective + '_' +
-                                         ('_sub' if subs else '') + '_',
-                                         suffix='.png') as tmp:
-            img.save(tmp)
-            filename = tmp.name
-        return DoubleAdjectivePic(filename, left_adjective, right_adjective,
-                                  subs)
-
-    def get_size(self) -> Tuple[int, int]:
-        return get_picture_size(self.filename)
-
-    def get_filename(self) -> str:
-        return self.filename
+        return DoubleAdjectivePic(None,
+                                  left_adjective,
+                                  right_adjective,
+                                  subs,
+                                  image=img)
 
     def split(self) -> Tuple[SingleAdjectivePic, SingleAdjectivePic]:
-        with Image.open(self.filename) as img:
-            left, right = split_double_adjective_img(img)
-            with closing(left) as left, closing(right) as right:
-                return (SingleAdjectivePic.from_image(left,
-                                                      self.left_adjective,
-                                                      self.subs),
-                        SingleAdjectivePic.from_image(right,
-                                                      self.right_adjective,
-                                                      self.subs))
+        left_box, right_box = get_split_boxes(self.get_size())
+        return (SingleAdjectivePic(None,
+                                   self.left_adjective,
+                                   self.subs,
+                                   plan=self.plan.crop(left_box)),
+                SingleAdjectivePic(None,
+                                   self.right_adjective,
+                                   self.subs,
+                                   plan=self.plan.crop(right_box)))
 
     def remove_subs(self) -> 'DoubleAdjectivePic':
         if not self.subs:
             return self
-        with self.to_image() as img:
-            no_sub_img = remove_subs(img)
-        return DoubleAdjectivePic.from_image(
-            no_sub_img,
-            left_adjective=self.left_adjective,
-            right_adjective=self.right_adjective,
-            subs=False)
-
-    def __eq__(self, other):
-        with self.to_image() as img,\
-                other.to_image() as other_img:
-            diff = ImageChops.difference(img, other_img)
-            if diff.getbbox():
-                return True
-
-        return (self.left_adjective == other.left_adjective
-                and self.right_adjective == other.right_adjective
-                and self.subs == other.subs)
+        return DoubleAdjectivePic(None,
+                                  self.left_adjective,
+                                  self.right_adjective,
+                                  subs=False,
+                                  plan=self.plan.crop(self.get_subs_box()))
+
+    def get_metadata(self) -> Tuple:
+        return (self.left_adjective, self.right_adjective, self.subs)
+
+
+def plan_halves(
+        dap: DoubleAdjectivePic,
+        halve_above: int = 400,
+        max_dimension: Optional[int] = None,
+        resample: Optional[int] = None
+) -> Tuple[SingleAdjectivePic, SingleAdjectivePic]:
+    """Splits `dap` and removes its subtitles.
+
+    Halves get scaled down to fit within `max_dimension` if it is given.
+    Otherwise, halves taller than `halve_above` get scaled down by half.
+    `resample` is the Pillow filter for scaling, see
+    `SingleAdjectivePic.resize`.
+    """
+    left, right = [sap.remove_subs() for sap in dap.split()]
+    if max_dimension is not None:
+        return (left.fit(max_dimension, resample),
+                right.fit(max_dimension, resample))
+    if left.get_size()[1] > halve_above:
+        left, right = (left.resize(0.5, resample),
+                       right.resize(0.5, resample))
+    return (left, right)
+
+
+def get_half_filenames(dap: DoubleAdjectivePic, out_dir: str,
+                       options: EncodeOptions) -> Tuple[str, str]:
+    """Returns where `export_halves` writes the halves of `dap`."""
+    stem = path.splitext(path.basename(dap.get_filename()))[0]
+    ext = options.get_extension()
+    return (path.join(out_dir, stem + '_left' + ext),
+            path.join(out_dir, stem + '_right' + ext))
+
+
+def export_halves(dap: DoubleAdjectivePic,
+                  out_dir: str,
+                  halve_above: int = 400,
+                  max_dimension: Optional[int] = None,
+                  options: EncodeOptions = EncodeOptions(),
+                  measure_savings: bool = False,
+                  resample: Optional[int] = None
+                  ) -> Tuple[EncodedPic, EncodedPic]:
+    """Encodes the halves planned by `plan_halves` into `out_dir`.
+
+    Returns the left and the right half.
+    """
+    left, right = plan_halves(dap, halve_above, max_dimension, resample)
+    left_filename, right_filename = get_half_filenames(dap, out_dir, options)
+    left_pic, right_pic = save_pics([
+        (left, left_filename),
+        (right, right_filename),
+    ], options, measure_savings)
+    return (left_pic, right_pic)
+
+
+def scan_source_pics(directory: str,
+                     ext: str = '.png') -> Iterator[DoubleAdjectivePic]:
+    """Checks all filenames in `directory`, then streams its pictures.
+
+    Bad filenames raise before the first picture is yielded. The pictures
+    are created one at a time while scanning the directory again, so the
+    caller can start working on them right away.
+    """
+    check_source_names(directory, ext)
+    return (DoubleAdjectivePic.from_original(filename)
+            for filename in iter_source_files(directory, ext))
+
+
+class BatchResult(NamedTuple):
+    """The outcome of processing a single item of a batch."""
+    # The item's position in the batch.
+    position: int
+    item: Any
+    value: Any
+    # A formatted traceback if processing the item failed.
+    error: Optional[str]
+
+
+def process_in_parallel(
+        fn: Callable[[Any], Any],
+        items: Iterable[Any],
+        max_workers: Optional[int] = None,
+        shortcut: Optional[Callable[[Any], Optional[Any]]] = None
+) -> Iterator[BatchResult]:
+    """Runs `fn` on every item in a pool of processes.
+
+    Results are yielded as soon as they are ready but always in the order of
+    `items`, so a single consumer can, e.g., write them to Anki. A failing
+    item is reported in its `BatchResult` and does not abort the batch.
+    Only a bounded number of items is in flight at any time.
+
+    `shortcut`, if given, is called in this process before an item is sent to
+    the pool. If it returns anything other than None, e.g., a cached result,
+    that becomes the item's value and `fn` is not called. A failing shortcut
+    falls back to `fn`.
+
+    `fn` and the items need to be picklable.
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    collecting = instrument.enabled()
+    if collecting:
+        # Workers send their stage stats back with each result.
+        fn = instrument.Collecting(fn)
+    in_flight: Deque[Tuple[int, Any, futures.Future]] = collections.deque()
+    with futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for position, item in enumerate(items):
+            in_flight.append((position, item, _submit(executor, fn, item,
+                                                   shortcut)))
+            if len(in_flight) >= 2 * max_workers:
+                yield _collect(*in_flight.popleft(), collecting)
+        while in_flight:
+            yield _collect(*in_flight.popleft(), collecting)
+
+
+def _submit(executor: futures.Executor, fn: Callable[[Any], Any], item: Any,
+            shortcut: Optional[Callable[[Any], Optional[Any]]]
+            ) -> futures.Future:
+    if shortcut is not None:
+        try:
+            value = shortcut(item)
+        except Exception:
+            value = None
+        if value is not None:
+            done: futures.Future = futures.Future()
+            # Shortcuts run in this process, so their stats are recorded.
+            done.set_result((value, {}) if isinstance(
+                fn, instrument.Collecting) else value)
+            return done
+    return executor.submit(fn, item)
+
+
+def _collect(position: int,
+             item: Any,
+             future: futures.Future,
+             collecting: bool = False) -> BatchResult:
+    try:
+        value = future.result()
+        if collecting:
+            value, stats = value
+            instrument.merge(stats)
+        return BatchResult(position, item, value, None)
+    except Exception:
+        return BatchResult(position, item, None, traceback.format_exc())
@@ -5,12 +5,32 @@
 This binary scrapes adjective images from deutschlernenblog and saves them to
 images/ folder.
 """
+import collections
+from concurrent import futures
+import html.parser
+import json
 import logging
+import os
+from os import path
 import re
-from typing import List, Tuple
+import queue
+import threading
+from typing import (TYPE_CHECKING, Any, Deque, Dict, Iterable, Iterator, List,
+                    Mapping, NamedTuple, Optional, Tuple, TypeVar)
+from urllib.parse import urlsplit
 
-import requests
-from bs4 import BeautifulSoup
+from tools import instrument
+
+# requests and bs4 are imported by the functions that use them, so that the
+# filename helpers load quickly.
+if TYPE_CHECKING:
+    import requests
+
+T = TypeVar('T')
+
+# The file, inside the download directory, that remembers the ETags of
+# downloaded images.
+ETAGS_FILENAME = '.etags.json'
 
 
 def extract_filename_from_image_url(url: str) -> str:
@@ -24,54 +44,332 @@ def extract_filename_from_image_url(url: str) -> str:
     return filename_match[1]
 
 
-def scrape_images_and_metadata_from_site(url: str) -> Tuple:
-    logging.info('Scraping image sources from: ' + url)
-    response = requests.get(url)
-    response.raise_for_status()
-    soup = BeautifulSoup(response.text)
+def make_session(pool_size: int = 8,
+                 retries: int = 3,
+                 backoff: float = 0.5) -> 'requests.Session':
+    """Returns a session with pooled connections that retries with backoff."""
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(total=retries,
+                  backoff_factor=backoff,
+                  status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=('GET', 'HEAD'))
+    adapter = HTTPAdapter(pool_connections=pool_size,
+                          pool_maxsize=pool_size,
+                          max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+WEITER_RE = re.compile(r'weiter\s+$')
+
 
-    imgs = soup.findAll('img')
-    imgs = [
-        img for img in imgs if img.has_attr('width') and img['width'] == '640'
-        and img.has_attr('height') and img['height'] == '402'
-        and not img.has_attr('data-lazy-src')
-    ]
-    srcs = [img['src'] for img in imgs]
+def is_gallery_image(attrs: Mapping[str, Any]) -> bool:
+    """Whether the <img> attributes belong to a full-size adjective image.
 
-    weiter = soup.find(string=re.compile('weiter\s+$'))
-    next_link = weiter.next['href'] if weiter else None
+    `attrs` are either the parser's or bs4's, whose values can be lists.
+    """
+    return (attrs.get('width') == '640' and attrs.get('height') == '402'
+            and 'data-lazy-src' not in attrs)
+
+
+def parse_gallery_page_with_tree(page: str) -> Tuple:
+    """Parses a gallery page by building the full BeautifulSoup tree."""
+    from bs4 import BeautifulSoup, Tag
+
+    soup = BeautifulSoup(page, 'html.parser')
+
+    imgs = soup.find_all('img')
+    srcs = [img['src'] for img in imgs if is_gallery_image(img.attrs)]
+
+    weiter = soup.find(string=WEITER_RE)
+    next_element = weiter.next if weiter else None
+    next_link = (next_element.get('href')
+                 if isinstance(next_element, Tag) else None)
 
     return (srcs, next_link)
 
 
-def download_image(url: str) -> bytes:
-    logging.info('Downloading image: ' + extract_filename_from_image_url(url))
-    image = requests.get(url)
-    image.raise_for_status()
-    return image.content
+class GalleryPageParser(html.parser.HTMLParser):
+    """Extracts gallery images and the "weiter" link from parser events.
+
+    Unlike BeautifulSoup, it never materializes the document tree. The
+    "weiter" link is the element right after the first text ending in
+    "weiter ".
+    """
+    def __init__(self) -> None:
+        super().__init__()
+        self.srcs: List[str] = []
+        self.next_link: Optional[str] = None
+        self._weiter_state = 'searching'
+
+    def handle_starttag(self, tag: str,
+                        attr_list: List[Tuple[str, Optional[str]]]) -> None:
+        attrs = dict(attr_list)
+        if tag == 'img' and is_gallery_image(attrs):
+            self.srcs.append(attrs['src'] or '')
+        if self._weiter_state == 'found':
+            self.next_link = attrs.get('href')
+            self._weiter_state = 'done'
+
+    def handle_startendtag(self, tag: str,
+                           attr_list: List[Tuple[str, Optional[str]]]
+                           ) -> None:
+        self.handle_starttag(tag, attr_list)
+
+    def handle_data(self, data: str) -> None:
+        if self._weiter_state == 'found':
+            self._weiter_state = 'done'
+        elif self._weiter_state == 'searching' and WEITER_RE.search(data):
+            self._weiter_state = 'found'
+
+
+def parse_gallery_page_with_stream(page: str) -> Tuple:
+    """Parses a gallery page in a single streaming pass."""
+    parser = GalleryPageParser()
+    parser.feed(page)
+    parser.close()
+    return (parser.srcs, parser.next_link)
+
+
+GALLERY_PAGE_PARSERS = {
+    'stream': parse_gallery_page_with_stream,
+    'tree': parse_gallery_page_with_tree,
+}
+
+
+def scrape_images_and_metadata_from_site(
+        url: str,
+        session: Optional['requests.Session'] = None,
+        parser: str = 'stream') -> Tuple:
+    """Returns the image sources of a gallery page and the next page's URL.
+
+    `parser` is either 'stream' or 'tree'. Both give the same results, but
+    'stream' avoids building the page's tree.
+    """
+    import requests
+
+    logging.info('Scraping image sources from: ' + url)
+    with instrument.timer('fetch_page') as t:
+        response = (session or requests).get(url)
+        response.raise_for_status()
+        t.add_bytes(len(response.content))
+    with instrument.timer('parse'):
+        return GALLERY_PAGE_PARSERS[parser](response.text)
+
+
+class HostLimiter:
+    """Limits the number of concurrent requests to each host."""
+    def __init__(self, max_per_host: int):
+        self.max_per_host = max_per_host
+        self._semaphores: Dict[str, threading.Semaphore] = {}
+        self._lock = threading.Lock()
+
+    def get(self, url: str) -> threading.Semaphore:
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.Semaphore(
+                    self.max_per_host)
+            return self._semaphores[host]
 
 
-def fetch_image_sources() -> List:
-    WEBSITE_PART_1_URL = "https://deutschlernerblog.de/die-200-wichtigsten-deutschen-adjektive-mit-bildern-lernen-teil-1/"
-    url = WEBSITE_PART_1_URL
-    all_srcs = []
+class DownloadReport(NamedTuple):
+    downloaded: List[str]
+    # Images that were already present and up to date.
+    skipped: List[str]
+    # Pairs of URL and the error message.
+    failed: List[Tuple[str, str]]
+
+
+def load_etags(dest_dir: str) -> Dict[str, str]:
+    try:
+        with open(path.join(dest_dir, ETAGS_FILENAME)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_etags(dest_dir: str, etags: Dict[str, str]) -> None:
+    tmp = path.join(dest_dir, ETAGS_FILENAME + '.part')
+    with open(tmp, 'w') as f:
+        json.dump(etags, f, indent=2, sort_keys=True)
+    os.replace(tmp, path.join(dest_dir, ETAGS_FILENAME))
+
+
+def fetch_image(session: 'requests.Session', url: str, dest_dir: str,
+                etag: Optional[str]) -> Tuple[bool, Optional[str]]:
+    """Downloads the image at `url` into `dest_dir` unless it is up to date.
+
+    An image is up to date if the server confirms `etag` or, when the ETag
+    is unknown, if the local file has the advertised size. The image is
+    written under a temporary name and renamed once complete, so an
+    interrupted run never leaves a truncated image behind.
+
+    Returns whether the image was downloaded and its current ETag.
+    """
+    fn = extract_filename_from_image_url(url)
+    dest = path.join(dest_dir, fn)
+    headers = {}
+    if path.isfile(dest):
+        if etag:
+            headers['If-None-Match'] = etag
+        else:
+            head = session.head(url)
+            head.raise_for_status()
+            length = head.headers.get('Content-Length')
+            if length is not None and int(length) == path.getsize(dest):
+                instrument.count('download_skipped')
+                return (False, head.headers.get('ETag'))
+    response = session.get(url, headers=headers, stream=True)
+    with response:
+        if response.status_code == 304:
+            instrument.count('download_skipped')
+            return (False, response.headers.get('ETag', etag))
+        response.raise_for_status()
+        logging.info('Downloading image: ' + fn)
+        part = dest + '.part'
+        with instrument.timer('download') as t, open(part, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=1 << 16):
+                f.write(chunk)
+                t.add_bytes(len(chunk))
+        os.replace(part, dest)
+        return (True, response.headers.get('ETag'))
+
+
+def download_images(urls: Iterable[str],
+                    dest_dir: str,
+                    max_workers: int = 8,
+                    max_per_host: int = 4,
+                    session: Optional['requests.Session'] = None
+                    ) -> DownloadReport:
+    """Concurrently downloads `urls` into `dest_dir`.
+
+    Images that are already present and up to date are skipped, so an
+    interrupted run can simply be restarted.
+
+    `urls` is consumed lazily, so downloads start while, e.g., a generator
+    is still fetching gallery pages. At most `2 * max_workers` downloads are
+    queued at any time.
+    """
+    session = session or make_session(pool_size=max_workers)
+    limiter = HostLimiter(max_per_host)
+    etags = load_etags(dest_dir)
+    etags_lock = threading.Lock()
+
+    def fetch(url: str) -> bool:
+        fn = extract_filename_from_image_url(url)
+        with limiter.get(url):
+            downloaded, etag = fetch_image(session, url, dest_dir,
+                                           etags.get(fn))
+        with etags_lock:
+            if etag:
+                etags[fn] = etag
+            else:
+                etags.pop(fn, None)
+        return downloaded
+
+    report = DownloadReport([], [], [])
+
+    def collect(url: str, future: futures.Future) -> None:
+        try:
+            if future.result():
+                report.downloaded.append(url)
+            else:
+                report.skipped.append(url)
+        except Exception as e:
+            logging.error('Could not download {}: {}'.format(url, e))
+            report.failed.append((url, str(e)))
+
+    in_flight: Deque[Tuple[str, futures.Future]] = collections.deque()
+    try:
+        with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for url in urls:
+                in_flight.append((url, executor.submit(fetch, url)))
+                if len(in_flight) >= 2 * max_workers:
+                    collect(*in_flight.popleft())
+            while in_flight:
+                collect(*in_flight.popleft())
+    finally:
+        save_etags(dest_dir, etags)
+    return report
+
+
+WEBSITE_PART_1_URL = "https://deutschlernerblog.de/die-200-wichtigsten-deutschen-adjektive-mit-bildern-lernen-teil-1/"
+
+
+def iter_image_sources(url: str = WEBSITE_PART_1_URL,
+                       session: Optional['requests.Session'] = None
+                       ) -> Iterator[str]:
+    """Yields image sources as soon as each gallery page is parsed."""
     while True:
-        srcs, next_link = scrape_images_and_metadata_from_site(url)
-        all_srcs.extend(srcs)
+        srcs, next_link = scrape_images_and_metadata_from_site(url, session)
+        yield from srcs
         if not next_link:
             break
         url = next_link
-    return all_srcs
+
+
+_DONE = object()
+
+
+def prefetch(items: Iterable[T], maxsize: int = 64) -> Iterator[T]:
+    """Iterates `items` in a background thread.
+
+    The thread runs ahead of the consumer by at most `maxsize` items, so a
+    slow consumer holds back the producer instead of letting items pile up.
+    An exception raised by the producer is re-raised in the consumer.
+    """
+    buffer: queue.Queue = queue.Queue(maxsize)
+    stop = threading.Event()
+
+    def put(item: Any) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce() -> None:
+        try:
+            for item in items:
+                if not put((item, None)):
+                    return
+        except BaseException as e:
+            put((_DONE, e))
+            return
+        put((_DONE, None))
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item, error = buffer.get()
+            if item is _DONE:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        # Unblocks the producer if the consumer stopped early.
+        stop.set()
 
 
 def main():
     logging.basicConfig(filename='scrape.log', level=logging.INFO)
-    image_srcs = fetch_image_sources()
-    metadata = []
-    for img_url in image_srcs:
-        fn = extract_filename_from_image_url(img_url)
-        with open('images/' + fn, 'wb') as f:
-            f.write(download_image(img_url))
+    session = make_session()
+    # Pages are parsed in the background while images get downloaded.
+    image_srcs = prefetch(iter_image_sources(session=session))
+    os.makedirs('images', exist_ok=True)
+    report = download_images(image_srcs, 'images', session=session)
+    print('Downloaded {}, skipped {}, failed {} images.'.format(
+        len(report.downloaded), len(report.skipped), len(report.failed)))
 
 
 if __name__ == "__main__":